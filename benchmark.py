@@ -0,0 +1,360 @@
+# benchmark.py
+"""
+End-to-end scrape benchmark against a local synthetic batdongsan site.
+
+    python benchmark.py [--pages 10] [--listings-per-page 20] [--latency-ms 50]
+                        [--jitter-ms 10] [--error-rate 0.01] [--threads 1,2,4,8]
+                        [--block-above-rps 20] [--fixed-rate] [--mode http|browser]
+                        [--output bench.json] [--compare old.json]
+
+Each num_threads setting runs scrape_properties in a fresh process (so peak RSS is
+per run) and reports pages/sec, listings/sec, p50/p95 fetch latency (the fetch
+itself, i.e. the fetch_seconds metric), p50/p95 time spent waiting for the rate
+limiter, and the process's CPU time and peak RSS. Browser mode also reports CPU
+seconds and peak RSS per Chrome instance (sampled by the driver pool after every
+page; needs psutil); HTTP mode starts no browsers, so it has only the process figures. The stage benchmarks time
+pagination discovery, the listing stage and offline detail parsing separately.
+The refresh check re-runs a small site with a page cache and listing index after
+repricing it, and counts records that still carry the old price (should be 0).
+The JSON report records the git commit so reports from two commits can be compared
+with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from fixture_site import SyntheticSite
+
+# Metrics compared by --compare, with True when higher is better
+COMPARED_METRICS = {
+    "pages_per_sec": True,
+    "listings_per_sec": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "limiter_wait_p95_ms": False,
+    "peak_rss_mb": False,
+    "peak_rss_mb_per_browser": False,
+    "cpu_seconds": False,
+}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its reaped children (e.g. chromedriver), in MB"""
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / divisor, 1), round(children / divisor, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_scraper(mode, num_threads, adaptive_rate=True):
+    """PropertyScraper that records the fetch time, limiter wait and outcome of every page fetch"""
+    from driver_pool import DriverPool
+    from metrics import Metrics
+    from scraper import LISTING_READY_SELECTOR, PropertyScraper
+
+    class SampledMetrics(Metrics):
+        """Metrics that also keep every fetch_seconds and rate_limit_wait_seconds value, by page kind"""
+
+        def __init__(self):
+            super().__init__()
+            self.samples = {}  # (metric, page kind) -> seconds
+            self.page = threading.local()
+            self._samples_lock = threading.Lock()
+
+        def observe(self, name, seconds, **labels):
+            super().observe(name, seconds, **labels)
+            if name in ("fetch_seconds", "rate_limit_wait_seconds"):
+                with self._samples_lock:
+                    self.samples.setdefault((name, getattr(self.page, "kind", None)), []).append(seconds)
+
+        def values(self, name, kind=None):
+            with self._samples_lock:
+                return [value for (metric, page_kind), values in self.samples.items()
+                        if metric == name and kind in (None, page_kind) for value in values]
+
+    class TimedScraper(PropertyScraper):
+        def __init__(self, **kwargs):
+            super().__init__(metrics=SampledMetrics(), **kwargs)
+            self.pages = {"listing": 0, "detail": 0}
+            self.fetch_errors = 0
+            self.browser_cpu = []
+            self.browser_peak_rss = []
+            self._timing_lock = threading.Lock()
+
+        def fetch_html(self, url, chrome_driver=None, ready_selector=None, refresh=False):
+            kind = "listing" if ready_selector == LISTING_READY_SELECTOR else "detail"
+            self.metrics.page.kind = kind
+            with self._timing_lock:
+                self.pages[kind] += 1
+            try:
+                if ready_selector is None:
+                    return super().fetch_html(url, chrome_driver, refresh=refresh)
+                return super().fetch_html(url, chrome_driver, ready_selector, refresh)
+            except Exception:
+                with self._timing_lock:
+                    self.fetch_errors += 1
+                raise
+
+        def close_drivers(self):
+            # scrape_properties closes the pool itself; sample the browsers first
+            for driver in self.driver_pool.active_drivers():
+                cpu = driver.cpu_seconds()
+                if cpu is not None:
+                    self.browser_cpu.append(cpu)
+                driver.memory_mb()  # one last sample towards the peak
+                if driver.peak_memory_mb is not None:
+                    self.browser_peak_rss.append(driver.peak_memory_mb)
+            super().close_drivers()
+
+    if mode == "browser":
+        return TimedScraper(use_http=False, driver_pool=DriverPool(size=num_threads),
+                            adaptive_rate=adaptive_rate)
+    return TimedScraper(driver_pool=DriverPool(size=num_threads), browser_fallback=False,
+                        adaptive_rate=adaptive_rate)
+
+
+def run_scrape(start_url, num_threads, mode, workdir, adaptive_rate=True):
+    """One full scrape_properties run; executed in a child process"""
+    logging.basicConfig(level=logging.CRITICAL)
+    os.chdir(workdir)
+    scraper = make_scraper(mode, num_threads, adaptive_rate)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        df = scraper.scrape_properties([start_url], num_threads=num_threads,
+                                       run_id=f"bench_{num_threads}")
+    finally:
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        scraper.close()
+
+    def ms(values, q):
+        return round(percentile(values, q) * 1000, 2) if values else None
+
+    latencies = scraper.metrics.values("fetch_seconds")
+    detail_latencies = scraper.metrics.values("fetch_seconds", "detail")
+    waits = scraper.metrics.values("rate_limit_wait_seconds")
+    pages = scraper.pages["listing"] + scraper.pages["detail"]
+    own_rss, children_rss = peak_rss_mb()
+    result = {
+        "num_threads": num_threads,
+        "seconds": round(elapsed, 3),
+        "listing_pages": scraper.pages["listing"],
+        "detail_pages": scraper.pages["detail"],
+        "listings": len(df),
+        "fetch_errors": scraper.fetch_errors,
+        "pages_per_sec": round(pages / elapsed, 2),
+        "listings_per_sec": round(len(df) / elapsed, 2),
+        "latency_p50_ms": ms(latencies, 0.50),
+        "latency_p95_ms": ms(latencies, 0.95),
+        "detail_latency_p95_ms": ms(detail_latencies, 0.95),
+        "limiter_wait_p50_ms": ms(waits, 0.50),
+        "limiter_wait_p95_ms": ms(waits, 0.95),
+        "limiter_wait_seconds": round(sum(waits), 3),
+        "cpu_seconds": round(cpu, 3),
+        "peak_rss_mb": own_rss,
+        "children_peak_rss_mb": children_rss,
+        "metrics": scraper.last_run_metrics,
+    }
+    if mode == "browser":
+        result["browser_cpu_seconds"] = [round(cpu, 3) for cpu in scraper.browser_cpu]
+        result["cpu_seconds_per_browser"] = (
+            round(sum(scraper.browser_cpu) / len(scraper.browser_cpu), 3) if scraper.browser_cpu else None
+        )
+        result["browser_peak_rss_mb"] = [round(rss, 1) for rss in scraper.browser_peak_rss]
+        result["peak_rss_mb_per_browser"] = (
+            round(max(scraper.browser_peak_rss), 1) if scraper.browser_peak_rss else None
+        )
+    return result
+
+
+def run_stages(site, num_threads):
+    """Time pagination discovery, the listing stage and offline detail parsing separately"""
+    from scraper import LISTING_READY_SELECTOR, PropertyScraper
+
+    scraper = PropertyScraper(browser_fallback=False)
+    stages = {}
+    try:
+        start = time.perf_counter()
+        page_urls = scraper.get_pagination_urls(site.start_url)
+        stages["pagination"] = {"pages": len(page_urls), "seconds": round(time.perf_counter() - start, 4)}
+
+        def listing(page_url):
+            try:
+                html_content = scraper.fetch_html(page_url, ready_selector=LISTING_READY_SELECTOR)
+            except Exception:
+                return []
+            return scraper.extract_listing_urls(html_content, page_url)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            detail_urls = [url for urls in executor.map(listing, page_urls) for url in urls]
+        elapsed = time.perf_counter() - start
+        stages["listing"] = {"pages": len(page_urls), "listing_urls": len(detail_urls),
+                             "seconds": round(elapsed, 4),
+                             "pages_per_sec": round(len(page_urls) / elapsed, 2) if elapsed else None}
+
+        sample = [(url, site.detail_page(int(url.rsplit("-pr", 1)[1]))) for url in detail_urls[:50]]
+        start = time.perf_counter()
+        for url, html_content in sample:
+            scraper.parse_property(html_content, url)
+        elapsed = time.perf_counter() - start
+        stages["detail_parse"] = {"parser": scraper.parser.name, "pages": len(sample),
+                                  "ms_per_page": round(elapsed / len(sample) * 1000, 3) if sample else None}
+    finally:
+        scraper.close()
+    return stages
+
+
+def check_refresh(workdir):
+    """Re-scrape a repriced site with page_cache and listing_index; stale records should be 0"""
+    from listing_index import ListingIndex
+    from page_cache import PageCache
+    from parsers import card_record
+    from scraper import PropertyScraper
+
+    workdir = os.path.join(workdir, "refresh_check")
+    os.makedirs(workdir)
+    cache = PageCache(os.path.join(workdir, "page_cache"))
+    index = ListingIndex(os.path.join(workdir, "listing_index.sqlite"))
+    with SyntheticSite(num_pages=2, listings_per_page=3) as site:
+        scraper = PropertyScraper(browser_fallback=False, page_cache=cache, listing_index=index,
+                                  adaptive_rate=False)
+        try:
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            try:
+                scraper.scrape_properties([site.start_url], run_id="refresh_1")
+                site.price_revision += 1
+                requests_before = len(site.requests)
+                df = scraper.scrape_properties([site.start_url], run_id="refresh_2")
+            finally:
+                os.chdir(cwd)
+        finally:
+            scraper.close()
+            index.close()
+            cache.close()
+        expected = {}
+        for number in range(1, site.num_pages + 1):
+            cards = scraper.extract_listing_cards(site.listing_page(number), site.url(f"/p{number}"))
+            expected.update((str(record["Mã tin"]), record["Mức giá"]) for record in map(card_record, cards))
+    stale = sum(expected.get(str(listing_id)) != price for listing_id, price in zip(df["Mã tin"], df["Mức giá"]))
+    return {"listings": site.total_listings, "rescraped": len(df),
+            "requests": len(site.requests) - requests_before, "stale_records": stale}
+
+
+def compare(current, previous):
+    """Print per-metric changes between two reports, matched on num_threads"""
+    print(f"\nCompared with {previous.get('commit') or 'previous report'} ({previous.get('timestamp')}):")
+    old_runs = {run["num_threads"]: run for run in previous.get("runs", [])}
+    for run in current["runs"]:
+        old = old_runs.get(run["num_threads"])
+        if old is None:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = old.get(metric), run.get(metric)
+            if not before or after is None:
+                continue
+            delta = (after - before) / before * 100
+            better = delta > 0 if higher_is_better else delta < 0
+            changes.append(f"{metric} {before} -> {after} ({delta:+.1f}%{'' if better or not delta else ' worse'})")
+        print(f"  threads={run['num_threads']}: " + "; ".join(changes))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--pages", type=int, default=10)
+    arg_parser.add_argument("--listings-per-page", type=int, default=20)
+    arg_parser.add_argument("--latency-ms", type=float, default=50)
+    arg_parser.add_argument("--jitter-ms", type=float, default=10)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--block-above-rps", type=float,
+                            help="serve challenge pages while the site gets more requests per second")
+    arg_parser.add_argument("--fixed-rate", action="store_true", help="disable adaptive rate control")
+    arg_parser.add_argument("--threads", default="1,2,4,8", help="comma-separated num_threads values")
+    arg_parser.add_argument("--mode", choices=["http", "browser"], default="http")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="write the JSON report here")
+    arg_parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = arg_parser.parse_args(argv)
+
+    thread_counts = [int(value) for value in args.threads.split(",") if value.strip()]
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    report = {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "config": config, "runs": []}
+
+    site = SyntheticSite(num_pages=args.pages, listings_per_page=args.listings_per_page,
+                         latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         error_rate=args.error_rate, block_above_rps=args.block_above_rps,
+                         seed=args.seed)
+    with site, tempfile.TemporaryDirectory(prefix="scrape_bench_") as workdir:
+        report["stages"] = run_stages(site, max(thread_counts))
+        print(f"Stages: {json.dumps(report['stages'])}")
+        report["refresh_check"] = check_refresh(workdir)
+        print(f"Refresh check: {json.dumps(report['refresh_check'])}")
+        if report["refresh_check"]["stale_records"]:
+            print("WARNING: changed listings were served from the page cache")
+
+        print("p50/p95 ms: fetch time only; wait ms: p50/p95 rate limiter wait; RSS and CPU: scraper process"
+              + ("" if args.mode == "browser" else " (per-browser CPU and RSS are reported in browser mode only)"))
+        print(f"{'threads':>7}{'seconds':>9}{'pages/s':>9}{'listings/s':>11}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'wait ms':>15}{'errors':>8}{'RSS MB':>8}{'CPU s':>7}")
+        for num_threads in thread_counts:
+            run_dir = os.path.join(workdir, f"threads_{num_threads}")
+            os.makedirs(run_dir)
+            # A fresh process per run keeps peak RSS and CPU time separate
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                run = executor.submit(run_scrape, site.start_url, num_threads, args.mode, run_dir,
+                                      not args.fixed_rate).result()
+            report["runs"].append(run)
+            wait = f"{run['limiter_wait_p50_ms'] or 0:.1f}/{run['limiter_wait_p95_ms'] or 0:.1f}"
+            print(f"{num_threads:>7}{run['seconds']:>9.2f}{run['pages_per_sec']:>9.1f}"
+                  f"{run['listings_per_sec']:>11.1f}{run['latency_p50_ms'] or 0:>9.1f}"
+                  f"{run['latency_p95_ms'] or 0:>9.1f}"
+                  f"{wait:>15}{run['fetch_errors']:>8}"
+                  f"{run['peak_rss_mb']:>8.0f}{run['cpu_seconds']:>7.2f}")
+            if args.mode == "browser":
+                print(f"        CPU seconds per browser: {run['browser_cpu_seconds']}")
+                print(f"        peak RSS MB per browser: {run['browser_peak_rss_mb']}")
+        report["server_errors"] = site.errors
+        report["server_blocks"] = site.blocks
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# benchmark_parsers.py
+"""
+Micro-benchmark of the parser backends on saved pages.
+
+    python benchmark_parsers.py [--pages-dir fixtures/batdongsan] [--repeat 50]
+
+Every backend must produce exactly the same records, listing URLs, cards and last page
+as the bs4 reference; the script exits non-zero if any backend differs.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+from fixture_site import FIXTURES_DIR
+from parsers import available_parsers, get_parser
+
+PAGE_URL = "https://batdongsan.com.vn/ban-can-ho-chung-cu-binh-duong"
+
+
+def load_pages(pages_dir):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages[os.path.basename(path)] = f.read()
+    details = {name: html for name, html in pages.items() if name.startswith("detail")}
+    listings = {name: html for name, html in pages.items() if name.startswith("listing")}
+    return details, listings
+
+
+def run_backend(parser, details, listings):
+    output = {}
+    for name, html in details.items():
+        output[name] = parser.parse_property(html, PAGE_URL)
+    for name, html in listings.items():
+        output[name] = (parser.listing_urls(html, PAGE_URL), parser.last_page(html),
+                        parser.listing_cards(html, PAGE_URL))
+    return output
+
+
+def time_backend(parser, pages, parse, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages.values():
+            parse(parser, html)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(pages)) if pages else 0.0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--pages-dir", default=FIXTURES_DIR)
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    args = arg_parser.parse_args(argv)
+
+    details, listings = load_pages(args.pages_dir)
+    if not details:
+        print(f"No detail_*.html pages found in {args.pages_dir}")
+        return 1
+
+    reference = run_backend(get_parser("bs4"), details, listings)
+    mismatches = 0
+    rows = []
+    for name in available_parsers():
+        parser = get_parser(name)
+        output = run_backend(parser, details, listings)
+        for page, expected in reference.items():
+            if output[page] != expected:
+                mismatches += 1
+                print(f"MISMATCH {name} on {page}:\n  expected {expected}\n  got      {output[page]}")
+        detail_time = time_backend(parser, details,
+                                   lambda p, html: p.parse_property(html, PAGE_URL), args.repeat)
+        listing_time = time_backend(parser, listings,
+                                    lambda p, html: p.listing_urls(html, PAGE_URL), args.repeat)
+        rows.append((name, detail_time, listing_time))
+
+    baseline = rows[0][1]
+    print(f"{'backend':<14}{'detail ms/page':>16}{'listing ms/page':>17}{'speedup':>10}")
+    for name, detail_time, listing_time in rows:
+        speedup = baseline / detail_time if detail_time else float("inf")
+        print(f"{name:<14}{detail_time * 1000:>16.3f}{listing_time * 1000:>17.3f}{speedup:>9.1f}x")
+
+    if mismatches:
+        print(f"{mismatches} output mismatches")
+        return 1
+    print("All backends produced identical output")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+# dedup.py
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from listing_store import slugify
+from normalize import normalize_properties
+from spatial_index import haversine_m
+
+DEFAULT_DEDUP_PATH = "scraped_data/dedup.sqlite"
+FEATURES = ["area", "price", "bedrooms", "toilets", "floors", "direction", "latitude", "longitude", "address"]
+# Fields that must agree when both listings have them
+EXACT_FEATURES = ["bedrooms", "toilets", "floors", "direction"]
+# Street/project, ward, district, province: anything coarser (a card's "Dĩ An, Bình Dương",
+# a bare ward) is shared by unrelated listings, so it is not matched on
+MIN_ADDRESS_PARTS = 4
+
+
+def _known(value):
+    return value is not None and not (isinstance(value, float) and math.isnan(value)) and value is not pd.NA
+
+
+def specific_address(text):
+    """Normalized address if it names a street or project, else None"""
+    if not isinstance(text, str):
+        return None
+    parts = [part.strip() for part in text.split(",") if part.strip()]
+    return slugify(", ".join(parts)) if len(parts) >= MIN_ADDRESS_PARTS else None
+
+
+class DuplicateDetector:
+    """
+    Clusters reposts of the same property listed under different Mã tin.
+    Listings are blocked by (coordinate cell, area bucket) and by (normalized
+    address, area bucket); only listings in the same or neighbouring blocks are
+    compared, so matching is near-linear. Two listings match when their areas are
+    within area_tolerance, prices within price_tolerance, bedrooms, toilets,
+    floors and direction agree where both are known, and they are within
+    max_distance_m of each other or share the normalized address. Only addresses
+    down to a street or project count (see MIN_ADDRESS_PARTS), and a card-mode row
+    of a listing seen before keeps its stored features where the card has none.
+    Matches are merged with union-find; a cluster is named after its oldest
+    listing. The clustering is kept in SQLite, so later runs only compare their
+    new listings against it.
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_PATH, area_tolerance=0.02, price_tolerance=0.1,
+                 max_distance_m=150.0, cell_degrees=0.002, area_bucket=2.0):
+        self.path = path
+        self.area_tolerance = area_tolerance
+        self.price_tolerance = price_tolerance
+        self.max_distance_m = max_distance_m
+        self.cell_degrees = cell_degrees
+        self.area_bucket = area_bucket
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS listings (
+                listing_id TEXT PRIMARY KEY,
+                cluster_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                area REAL, price REAL, bedrooms INTEGER, toilets INTEGER, floors INTEGER,
+                direction TEXT, latitude REAL, longitude REAL, address TEXT
+            )"""
+        )
+        self._conn.commit()
+        self._features = {}  # listing_id -> feature dict
+        self._seq = {}  # listing_id -> order first seen; the oldest member names a cluster
+        self._parent = {}
+        self._blocks = {}  # blocking key -> set of listing_ids
+        self._saved = {}  # listing_id -> cluster_id as last written to SQLite
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute(
+            f"SELECT listing_id, cluster_id, seq, {', '.join(FEATURES)} FROM listings ORDER BY seq").fetchall()
+        for listing_id, cluster_id, seq, *values in rows:
+            features = dict(zip(FEATURES, values))
+            self._features[listing_id] = features
+            self._seq[listing_id] = seq
+            self._parent[listing_id] = cluster_id
+            self._saved[listing_id] = cluster_id
+            self._block(listing_id, features)
+
+    def __len__(self):
+        return len(self._features)
+
+    # Union-find over listing ids; roots are the oldest member of each cluster
+    def _find(self, listing_id):
+        root = listing_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[listing_id] != root:
+            self._parent[listing_id], listing_id = root, self._parent[listing_id]
+        return root
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return False
+        if self._seq[b] < self._seq[a]:
+            a, b = b, a
+        self._parent[b] = a
+        return True
+
+    def _keys(self, features, neighbours=False):
+        """Blocking keys of a listing; with neighbours, also the adjacent cells and area buckets"""
+        area = features["area"]
+        if not _known(area):
+            return []
+        bucket = int(area // self.area_bucket)
+        spread = (-1, 0, 1) if neighbours else (0,)
+        keys = []
+        if features["address"]:
+            keys += [f"a|{features['address']}|{bucket + db}" for db in spread]
+        if _known(features["latitude"]) and _known(features["longitude"]):
+            row = int(math.floor(features["latitude"] / self.cell_degrees))
+            column = int(math.floor(features["longitude"] / self.cell_degrees))
+            keys += [f"g|{row + dr}|{column + dc}|{bucket + db}"
+                     for dr in spread for dc in spread for db in spread]
+        return keys
+
+    def _block(self, listing_id, features):
+        for key in self._keys(features):
+            self._blocks.setdefault(key, set()).add(listing_id)
+
+    def _unblock(self, listing_id, features):
+        for key in self._keys(features):
+            members = self._blocks.get(key)
+            if members is not None:
+                members.discard(listing_id)
+
+    def _matches(self, a, b):
+        if abs(a["area"] - b["area"]) > max(1.0, self.area_tolerance * max(a["area"], b["area"])):
+            return False
+        if _known(a["price"]) and _known(b["price"]) and \
+                abs(a["price"] - b["price"]) > self.price_tolerance * max(a["price"], b["price"]):
+            return False
+        for feature in EXACT_FEATURES:
+            if _known(a[feature]) and _known(b[feature]) and a[feature] != b[feature]:
+                return False
+        if a["address"] and a["address"] == b["address"]:
+            return True
+        if all(_known(value) for value in (a["latitude"], a["longitude"], b["latitude"], b["longitude"])):
+            distance = haversine_m(a["latitude"], a["longitude"], [b["latitude"]], [b["longitude"]])[0]
+            return distance <= self.max_distance_m
+        return False
+
+    @staticmethod
+    def features(df):
+        """Matching features of each row of a scraped (raw or typed) DataFrame, keyed by Mã tin"""
+        typed = normalize_properties(df)
+        typed = typed[typed["Mã tin"].notna()]
+
+        def column(name, default=None):
+            return typed[name] if name in typed else pd.Series(default, index=typed.index)
+
+        direction = column("Hướng ban công").astype("string").fillna(column("Hướng nhà").astype("string"))
+        address = column("Địa chỉ").astype("string").map(specific_address)
+        frame = pd.DataFrame({
+            "listing_id": typed["Mã tin"].astype("string"),
+            "area": column("Diện tích"), "price": column("Mức giá"),
+            "bedrooms": column("Số phòng ngủ"), "toilets": column("Số toilet"), "floors": column("Số tầng"),
+            "direction": direction, "latitude": column("latitude"), "longitude": column("longitude"),
+            "address": address.replace("unknown", None),
+            "card": column("source").astype("string").eq("card").fillna(False),
+        })
+        records = {}
+        for row in frame.astype(object).where(frame.notna(), None).to_dict("records"):
+            records[row.pop("listing_id")] = row
+        return records
+
+    def add(self, df):
+        """
+        Match df's listings against the clustering and each other and save the result;
+        returns {Mã tin: cluster_id} for df's listings. Listings seen before are
+        re-matched with their current features (clusters only ever merge).
+        """
+        records = self.features(df)
+        with self._lock:
+            merged = 0
+            next_seq = max(self._seq.values(), default=-1) + 1
+            for listing_id, features in records.items():
+                card = features.pop("card")
+                if listing_id in self._features:
+                    known = self._features[listing_id]
+                    self._unblock(listing_id, known)
+                    if card:
+                        # A card only shows price, area and district; keep what the detail page said
+                        features = {name: value if _known(value) else known[name] for name, value in features.items()}
+                        records[listing_id] = features
+                else:
+                    self._seq[listing_id] = next_seq
+                    self._parent[listing_id] = listing_id
+                    next_seq += 1
+                self._features[listing_id] = features
+                candidates = set()
+                for key in self._keys(features, neighbours=True):
+                    candidates |= self._blocks.get(key, set())
+                candidates.discard(listing_id)
+                for other in candidates:
+                    if self._find(other) != self._find(listing_id) and self._matches(features, self._features[other]):
+                        merged += self._union(listing_id, other)
+                self._block(listing_id, features)
+            self._save(records)
+            clusters = {listing_id: self._find(listing_id) for listing_id in records}
+        logging.info(f"Deduplicated {len(records)} listings: {len(set(clusters.values()))} clusters, "
+                     f"{merged} merges")
+        return clusters
+
+    def annotate(self, df, column="cluster_id"):
+        """df with a cluster_id column (the Mã tin naming each listing's cluster)"""
+        clusters = self.add(df)
+        ids = df["Mã tin"].astype("string") if "Mã tin" in df else pd.Series(pd.NA, index=df.index, dtype="string")
+        return df.assign(**{column: ids.map(clusters).astype("string")})
+
+    def clusters(self):
+        """DataFrame of Mã tin and cluster_id for every known listing"""
+        with self._lock:
+            return pd.DataFrame([(listing_id, self._find(listing_id)) for listing_id in self._features],
+                                columns=["Mã tin", "cluster_id"])
+
+    def _save(self, records):
+        """Write the given listings and every listing whose cluster changed by a merge"""
+        changed = [listing_id for listing_id in self._features
+                   if listing_id in records or self._find(listing_id) != self._saved.get(listing_id)]
+        rows = []
+        for listing_id in changed:
+            cluster_id = self._saved[listing_id] = self._find(listing_id)
+            features = self._features[listing_id]
+            rows.append((listing_id, cluster_id, self._seq[listing_id], *[features[name] for name in FEATURES]))
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO listings (listing_id, cluster_id, seq, {', '.join(FEATURES)}) "
+            f"VALUES ({', '.join('?' * (3 + len(FEATURES)))})", rows)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,247 @@
+# driver_pool.py
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from metrics import METRICS
+from queue import Empty, Queue
+from resource_blocking import BlockingProfile
+from seleniumbase import Driver
+import logging
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # memory-based recycling is skipped without psutil
+    psutil = None
+
+
+def new_chrome_driver(page_load_timeout=30):
+    driver = Driver(uc_cdp=True, incognito=True, block_images=True, headless=True)
+    driver.set_page_load_timeout(page_load_timeout)
+    return driver
+
+
+class DriverUnavailable(RuntimeError):
+    """Raised by DriverPool.acquire when no Chrome driver can be started"""
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.time()
+        self.peak_memory_mb = None  # highest memory_mb() seen (the pool samples it after every page)
+
+    def memory_mb(self):
+        """RSS of chromedriver plus its Chrome children, or None if unknown"""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(self.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            memory = sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except Exception:
+            return None
+        self.peak_memory_mb = max(self.peak_memory_mb or 0.0, memory)
+        return memory
+
+    def cpu_seconds(self):
+        """User+system CPU time of chromedriver plus its Chrome children, or None if unknown"""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(self.driver.service.process.pid)
+            total = 0.0
+            for p in [process] + process.children(recursive=True):
+                times = p.cpu_times()
+                total += times.user + times.system
+            return total
+        except Exception:
+            return None
+
+    def is_alive(self):
+        try:
+            self.driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        interceptor = getattr(self.driver, "_request_interceptor", None)
+        if interceptor is not None:
+            interceptor.stop()
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+class DriverPool:
+    """
+    Pool of headless Chrome drivers shared by scraper workers.
+    Drivers are started in parallel, checked before each lease, and replaced
+    when they crash, after max_pages page loads, or above max_memory_mb.
+    Start-up and lease wait times and recycling causes are recorded in metrics.
+    When no driver is alive or starting and a fresh start fails, acquire raises
+    DriverUnavailable at once instead of waiting out its timeout.
+    Every driver gets blocking_profile (see resource_blocking.py) unless
+    block_resources is False.
+    """
+
+    def __init__(self, size=2, driver_factory=None, max_pages=200, max_memory_mb=1500,
+                 page_load_timeout=30, metrics=None, block_resources=True, blocking_profile=None):
+        self.size = size
+        self.metrics = metrics or METRICS
+        self.blocking_profile = (blocking_profile or BlockingProfile()) if block_resources else None
+        self.driver_factory = driver_factory or (lambda: new_chrome_driver(page_load_timeout))
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self._idle = Queue()
+        self._all = set()
+        self._pending = 0  # spawns submitted but not finished
+        self._last_error = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._started = False
+        self._closed = False
+        self.recycled = 0
+
+    def _spawn(self):
+        try:
+            with self.metrics.timer("driver_start_seconds"):
+                pooled = PooledDriver(self.driver_factory())
+        except Exception as e:
+            logging.error(f"Error starting Chrome driver: {str(e)}")
+            with self._lock:
+                self._pending -= 1
+                self._last_error = e
+            # Wakes a waiting acquire so it can tell whether any driver is still coming
+            self._idle.put(None)
+            return None
+        if self.blocking_profile is not None:
+            try:
+                self.blocking_profile.apply(pooled.driver)
+            except Exception as e:
+                logging.warning(f"Could not apply the resource blocking profile: {str(e)}")
+        with self._lock:
+            self._pending -= 1
+            if self._closed:
+                pooled.quit()
+                return None
+            self._all.add(pooled)
+        self._idle.put(pooled)
+        return pooled
+
+    def _submit_spawns(self, count):
+        """Start count more drivers in the background; the caller holds self._lock"""
+        if self._closed or self._executor is None:
+            return
+        for _ in range(count):
+            self._pending += 1
+            self._executor.submit(self._spawn)
+
+    def _dead(self):
+        """No driver alive or starting; the caller holds self._lock"""
+        return not self._all and not self._pending
+
+    def start(self):
+        """Warm up all drivers in parallel; called automatically on first lease"""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+            self._closed = False
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.size),
+                                                thread_name_prefix="driver-pool")
+            self._submit_spawns(self.size)
+        return self
+
+    def ensure_size(self, size):
+        """Grow the pool to at least size drivers (started now if the pool is running)"""
+        with self._lock:
+            if size <= self.size:
+                return
+            extra, self.size = size - self.size, size
+            if self._started:
+                self._submit_spawns(extra)
+
+    def _retire(self, pooled, reason, cause):
+        logging.info(f"Recycling Chrome driver after {pooled.pages} pages ({reason})")
+        self.metrics.inc("drivers_recycled_total", cause=cause)
+        with self._lock:
+            self._all.discard(pooled)
+            self.recycled += 1
+            self._submit_spawns(1)
+        pooled.quit()
+
+    def acquire(self, timeout=120):
+        self.start()
+        start = time.perf_counter()
+        deadline = time.time() + timeout
+        with self._lock:
+            if self._dead():
+                # Every earlier start failed: restart the pool once more before giving up
+                self._submit_spawns(self.size)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError("No Chrome driver became available in the pool")
+            try:
+                pooled = self._idle.get(timeout=remaining)
+            except Empty:
+                continue
+            if pooled is None:
+                with self._lock:
+                    dead, error = self._dead(), self._last_error
+                if dead:
+                    self._idle.put(None)  # let other waiting leases fail too
+                    raise DriverUnavailable(f"No Chrome driver could be started: {error}")
+                continue
+            if pooled.is_alive():
+                self.metrics.observe("driver_wait_seconds", time.perf_counter() - start)
+                return pooled
+            self._retire(pooled, "failed health check", "health")
+
+    def release(self, pooled):
+        pooled.pages += 1
+        if self.max_pages and pooled.pages >= self.max_pages:
+            self._retire(pooled, "page limit", "pages")
+            return
+        memory = pooled.memory_mb() if self.max_memory_mb else None
+        if memory is not None and memory > self.max_memory_mb:
+            self._retire(pooled, f"{memory:.0f} MB in use", "memory")
+            return
+        with self._lock:
+            closed = self._closed
+        if closed:
+            pooled.quit()
+        else:
+            self._idle.put(pooled)
+
+    @contextmanager
+    def lease(self, timeout=120):
+        """Lease a healthy driver; each lease counts as one page load"""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled.driver
+        finally:
+            self.release(pooled)
+
+    def active_drivers(self):
+        with self._lock:
+            return list(self._all)
+
+    def close(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._closed = True
+            self._started = False
+            executor, self._executor = self._executor, None
+        executor.shutdown(wait=True)
+        with self._lock:
+            drivers, self._all = list(self._all), set()
+            self._pending = 0
+        for pooled in drivers:
+            pooled.quit()
+        self._idle = Queue()
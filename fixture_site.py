@@ -0,0 +1,264 @@
+# fixture_site.py
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from threading import Lock, Thread
+from urllib.parse import urlsplit
+import json
+import os
+import random
+import re
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "batdongsan")
+
+
+class _LocalSite:
+    """Threaded local HTTP server; subclasses implement respond(path) -> (status, body)"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path.rstrip("/") or "/"
+                site.requests.append(path)
+                status, body = site.respond(path)
+                if body is None:
+                    self.send_error(status)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def respond(self, path):
+        raise NotImplementedError
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return self.base_url + path
+
+    def start(self):
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FixtureSite(_LocalSite):
+    """
+    Local stand-in for batdongsan.com.vn serving saved pages.
+    routes.json maps a URL path to {"file": ..., "status": ...}; listing links are
+    site-relative so the scraper stays on this server.
+    """
+
+    def __init__(self, pages_dir=FIXTURES_DIR, host="127.0.0.1", port=0):
+        super().__init__(host, port)
+        self.pages_dir = pages_dir
+        with open(os.path.join(pages_dir, "routes.json"), encoding="utf-8") as f:
+            self.routes = json.load(f)
+
+    def respond(self, path):
+        route = self.routes.get(path)
+        if route is None:
+            return 404, None
+        with open(os.path.join(self.pages_dir, route["file"]), "rb") as page:
+            return route.get("status", 200), page.read()
+
+
+LISTING_ROOT = "/ban-can-ho-chung-cu-bench"
+DETAIL_PATTERN = re.compile(r"^/ban-can-ho-chung-cu-bench-pr(\d+)$")
+PAGE_PATTERN = re.compile(r"^" + LISTING_ROOT + r"(?:/p(\d+))?$")
+DIRECTIONS = ["Đông", "Tây", "Nam", "Bắc", "Đông - Nam", "Tây - Nam", "Đông - Bắc", "Tây - Bắc"]
+DISTRICTS = ["Dĩ An", "Thuận An", "Thủ Dầu Một", "Bến Cát", "Tân Uyên"]
+LEGAL = ["Sổ đỏ/ Sổ hồng", "Hợp đồng mua bán", "Đang chờ sổ"]
+CHALLENGE_PAGE = (b'<!DOCTYPE html><html><head><title>Just a moment...</title></head>'
+                  b'<body><div id="cf-challenge">Checking your browser</div></body></html>')
+
+
+class SyntheticSite(_LocalSite):
+    """
+    Generated batdongsan-like site for benchmarks: num_pages listing pages of
+    listings_per_page cards, each linking to a detail page. latency_ms (+- jitter_ms)
+    delays every response and error_rate is the share answered with HTTP 500.
+    The pagination block shows pages within pagination_window of the current one
+    plus the last page, like the real site's ellipsis pagination; with
+    show_last_page=False the last page stays hidden behind the ellipsis.
+    block_above_rps simulates anti-bot throttling: while more requests than that
+    arrived in the last second, requests get a 403 challenge page.
+    Raising price_revision (also while serving) reprices every listing, as an edit
+    of all of them would.
+    """
+
+    def __init__(self, num_pages=10, listings_per_page=20, latency_ms=0, jitter_ms=0,
+                 error_rate=0.0, pagination_window=2, show_last_page=True, block_above_rps=None,
+                 seed=0, price_revision=0, host="127.0.0.1", port=0):
+        super().__init__(host, port)
+        self.num_pages = num_pages
+        self.listings_per_page = listings_per_page
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.pagination_window = pagination_window
+        self.show_last_page = show_last_page
+        self.block_above_rps = block_above_rps
+        self.blocks = 0
+        self._recent = deque()
+        self.seed = seed
+        self.price_revision = price_revision
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._random_lock = Lock()
+
+    @property
+    def start_url(self):
+        return self.url(LISTING_ROOT)
+
+    @property
+    def total_listings(self):
+        return self.num_pages * self.listings_per_page
+
+    def respond(self, path):
+        with self._random_lock:
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+            failed = self._random.random() < self.error_rate
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 1.0:
+                self._recent.popleft()
+            blocked = self.block_above_rps is not None and len(self._recent) > self.block_above_rps
+            if blocked:
+                self.blocks += 1
+        if blocked:
+            return 403, CHALLENGE_PAGE
+        if delay:
+            time.sleep(delay / 1000)
+        if failed:
+            self.errors += 1
+            return 500, None
+        page = PAGE_PATTERN.match(path)
+        if page:
+            number = int(page.group(1) or 1)
+            if number > self.num_pages:
+                return 404, None
+            return 200, self.listing_page(number).encode("utf-8")
+        detail = DETAIL_PATTERN.match(path)
+        if detail and int(detail.group(1)) < 10_000_000 + self.total_listings:
+            return 200, self.detail_page(int(detail.group(1))).encode("utf-8")
+        return 404, None
+
+    def _listing(self, listing_id):
+        rng = random.Random(self.seed * 1_000_003 + listing_id)
+        area = round(rng.uniform(35, 120), 1)
+        price = round(area * rng.uniform(25, 60) / 1000 * (1 + self.price_revision / 10), 2)
+        return {
+            "id": listing_id,
+            "title": f"Bán căn hộ {rng.randint(1, 4)}PN mã {listing_id}",
+            "area": f"{area:g} m²".replace(".", ","),
+            "price": f"{price:g} tỷ".replace(".", ","),
+            "bedrooms": rng.randint(1, 4),
+            "toilets": rng.randint(1, 3),
+            "direction": rng.choice(DIRECTIONS),
+            "legal": rng.choice(LEGAL),
+            "district": rng.choice(DISTRICTS),
+            "lat": round(rng.uniform(10.85, 11.10), 7),
+            "lon": round(rng.uniform(106.60, 106.80), 7),
+            "posted": f"{rng.randint(1, 28):02d}/10/2024",
+        }
+
+    def _pagination(self, current):
+        shown = {1, self.num_pages if self.show_last_page else 1} | set(range(max(1, current - self.pagination_window),
+                                                min(self.num_pages, current + self.pagination_window) + 1))
+        items, previous = [], 0
+        for number in sorted(shown):
+            if number - previous > 1:
+                items.append('<span class="re__pagination-dot">...</span>')
+            href = LISTING_ROOT if number == 1 else f"{LISTING_ROOT}/p{number}"
+            active = " re__actived" if number == current else ""
+            items.append(f'<a class="re__pagination-number{active}" href="{href}" pid="{number}">{number}</a>')
+            previous = number
+        if previous < self.num_pages:
+            items.append('<span class="re__pagination-dot">...</span>')
+        return '<div class="re__pagination"><div class="re__pagination-group">' + "".join(items) + "</div></div>"
+
+    def listing_page(self, number):
+        first = 10_000_000 + (number - 1) * self.listings_per_page
+        cards = []
+        for listing_id in range(first, first + self.listings_per_page):
+            item = self._listing(listing_id)
+            cards.append(
+                f'<div class="js__card re__card-full" prid="{listing_id}">'
+                f'<a class="js__product-link-for-product-id" data-product-id="{listing_id}" '
+                f'href="/ban-can-ho-chung-cu-bench-pr{listing_id}" title="{item["title"]}">'
+                f'<h3 class="re__card-title"><span class="pr-title js__card-title">{item["title"]}</span></h3>'
+                f'<div class="re__card-config js__card-config">'
+                f'<span class="re__card-config-price js__card-config-item">{item["price"]}</span>'
+                f'<span class="re__card-config-area js__card-config-item">{item["area"]}</span></div>'
+                f'<div class="re__card-location"><span>{item["district"]}, Bình Dương</span></div>'
+                f'</a></div>'
+            )
+        return (
+            '<!DOCTYPE html><html lang="vi"><head><meta charset="utf-8">'
+            f'<title>Mua bán căn hộ chung cư - trang {number}</title></head><body class="re__body">'
+            '<div class="re__srp-list js__srp-list"><div id="product-lists-web">'
+            + "".join(cards) + "</div>" + self._pagination(number) + "</div></body></html>"
+        )
+
+    def detail_page(self, listing_id):
+        item = self._listing(listing_id)
+        specs = [("Diện tích", item["area"]), ("Mức giá", item["price"]),
+                 ("Hướng ban công", item["direction"]), ("Số phòng ngủ", f'{item["bedrooms"]} phòng'),
+                 ("Số toilet", f'{item["toilets"]} phòng'), ("Pháp lý", item["legal"])]
+        info = [("Ngày đăng", item["posted"]), ("Loại tin", "Tin thường"), ("Mã tin", str(listing_id))]
+        specs_html = "".join(
+            f'<div class="re__pr-specs-content-item"><span class="re__pr-specs-content-item-title">{t}</span>'
+            f'<span class="re__pr-specs-content-item-value">{v}</span></div>' for t, v in specs
+        )
+        info_html = "".join(
+            f'<div class="re__pr-short-info-item js__pr-config-item"><span class="title">{t}</span>'
+            f'<span class="value">{v}</span></div>' for t, v in info
+        )
+        return (
+            '<!DOCTYPE html><html lang="vi"><head><meta charset="utf-8">'
+            f'<title>{item["title"]}</title></head><body class="re__body"><div class="re__pr-info">'
+            f'<h1 class="re__pr-title pr-title js__pr-title">{item["title"]}</h1>'
+            f'<span class="re__pr-short-description js__pr-address">Phường {listing_id % 97}, '
+            f'{item["district"]}, Bình Dương</span>'
+            f'<div class="re__pr-specs-content js__other-info">{specs_html}</div>'
+            '<div class="re__section re__pr-map js__section js__li-other"><iframe class="lazyload" '
+            f'data-src="https://www.google.com/maps/embed/v1/place?q={item["lat"]},{item["lon"]}&amp;key=BENCH">'
+            '</iframe></div>'
+            f'<div class="re__pr-short-info re__pr-config js__pr-config">{info_html}</div>'
+            "</div></body></html>"
+        )
+
+
+if __name__ == "__main__":
+    with FixtureSite(port=8765) as site:
+        print(f"Serving fixtures from {site.pages_dir} at {site.base_url}")
+        try:
+            site._thread.join()
+        except KeyboardInterrupt:
+            pass
@@ -1,25 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.retry import Retry, if_transient_error
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
+from google.cloud.storage.exceptions import InvalidResponse
+from metrics import METRICS
+import gzip
 import json
+import logging
+import os
 import pandas as pd
 import io
+import random
+import requests
+import shutil
+import tempfile
+import threading
+import time
+
+# Resumable uploads must use chunk sizes that are multiples of 256 KiB
+CHUNK_MULTIPLE = 256 * 1024
+ALREADY_COMPRESSED = ('.parquet', '.gz', '.zip', '.png', '.jpg')
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+# A resumable session that answers 404/410 has expired and cannot be recovered
+EXPIRED_SESSION_STATUSES = (404, 410)
+
+
+def response_status(exc):
+    return getattr(getattr(exc, 'response', None), 'status_code', None)
+
+
+def is_retryable(exc):
+    if isinstance(exc, InvalidResponse):
+        return response_status(exc) in RETRYABLE_STATUSES
+    return if_transient_error(exc) or isinstance(
+        exc, (ConnectionError, TimeoutError, requests.exceptions.ConnectionError,
+              requests.exceptions.Timeout)
+    )
+
+
+class UploadStats:
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+        self.chunk_retries = 0
+        self.attempts = 0
+        self.resumed_from = []
+        self.error = None
+
+    @property
+    def throughput_mb_s(self):
+        return self.sent_bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "source": self.source, "destination": self.destination,
+            "raw_bytes": self.raw_bytes, "sent_bytes": self.sent_bytes,
+            "seconds": round(self.seconds, 3), "throughput_mb_s": round(self.throughput_mb_s, 3),
+            "chunk_retries": self.chunk_retries, "attempts": self.attempts,
+            "resumed_from": self.resumed_from, "error": self.error,
+        }
+
 
 class GCSModule:
-    def __init__(self, bucket_name, credentials_path):
+    def __init__(self, bucket_name, credentials_path=None, client=None, api_endpoint=None,
+                 chunk_size=8 * 1024 * 1024, max_attempts=5, metrics=None):
         """
         Initialize Google Cloud Storage client
         credentials_path: Path to your Google Cloud service account key JSON file
+        client: pre-built storage client (e.g. LocalStorageClient for offline runs)
+        api_endpoint: URL of a GCS emulator such as fake-gcs-server; uses anonymous credentials
+        chunk_size: resumable upload chunk size, rounded up to a multiple of 256 KiB
+        metrics: Metrics registry for upload timings and byte counts (default: shared registry)
         """
-        self.storage_client = storage.Client.from_service_account_json(credentials_path)
+        if client is not None:
+            self.storage_client = client
+        elif api_endpoint:
+            self.storage_client = storage.Client(
+                project="local", credentials=AnonymousCredentials(),
+                client_options={"api_endpoint": api_endpoint},
+            )
+        else:
+            self.storage_client = storage.Client.from_service_account_json(credentials_path)
         self.bucket_name = bucket_name
         self.bucket = self.storage_client.bucket(bucket_name)
+        self.chunk_size = -(-chunk_size // CHUNK_MULTIPLE) * CHUNK_MULTIPLE
+        self.max_attempts = max_attempts
+        self.metrics = metrics or METRICS
 
     def upload_file_to_bucket(self, file_content, destination_blob_name):
         """Upload file content to Google Cloud Storage bucket"""
         blob = self.bucket.blob(destination_blob_name)
-        
+
         if isinstance(file_content, str):
             blob.upload_from_string(file_content)
         else:
             blob.upload_from_file(file_content)
-        
-        print(f"File uploaded to {destination_blob_name}")
\ No newline at end of file
+
+        print(f"File uploaded to {destination_blob_name}")
+
+    def _gzip_to_tempfile(self, local_path):
+        """Stream-compress local_path into a temporary file without loading it in memory"""
+        tmp = tempfile.TemporaryFile()
+        with open(local_path, 'rb') as src, gzip.GzipFile(fileobj=tmp, mode='wb', mtime=0) as gz:
+            shutil.copyfileobj(src, gz, length=1024 * 1024)
+        tmp.seek(0)
+        return tmp
+
+    def upload_path(self, local_path, destination_blob_name=None, compress=None, content_type=None):
+        """
+        Stream a file from disk to the bucket as a chunked resumable upload.
+        Text files are gzip-compressed on the way (stored with Content-Encoding: gzip, so
+        GCS serves them decompressed); compress=None skips already-compressed formats.
+        Failed chunks are retried within the upload session. When an attempt still fails,
+        the next one (after exponential backoff, up to max_attempts) keeps the session and
+        recovers it, continuing from the last offset the server committed; only an expired
+        session starts over from byte 0. Returns UploadStats.
+        """
+        destination_blob_name = destination_blob_name or local_path.replace(os.sep, '/')
+        stats = UploadStats(local_path, destination_blob_name)
+        stats.raw_bytes = os.path.getsize(local_path)
+        if compress is None:
+            compress = not local_path.lower().endswith(ALREADY_COMPRESSED)
+        if content_type is None:
+            content_type = 'text/csv' if local_path.endswith('.csv') else 'application/octet-stream'
+
+        def count_retry(exc):
+            stats.chunk_retries += 1
+            self.metrics.inc("upload_chunk_retries_total")
+            logging.warning(f"Retrying chunk of {destination_blob_name}: {str(exc)}")
+
+        chunk_retry = Retry(predicate=is_retryable, initial=1.0, maximum=32.0, on_error=count_retry)
+        if compress:
+            with self.metrics.timer("upload_compress_seconds"):
+                source = self._gzip_to_tempfile(local_path)
+        else:
+            source = open(local_path, 'rb')
+        start = time.perf_counter()
+        upload = transport = None
+        try:
+            stats.sent_bytes = os.fstat(source.fileno()).st_size
+            for attempt in range(1, self.max_attempts + 1):
+                stats.attempts = attempt
+                try:
+                    if upload is not None and upload.invalid:
+                        upload = self._recover(upload, transport, destination_blob_name)
+                        if upload is not None:
+                            stats.resumed_from.append(upload.bytes_uploaded)
+                            self.metrics.inc("upload_resumes_total")
+                    if upload is None:
+                        blob = self.bucket.blob(destination_blob_name, chunk_size=self.chunk_size)
+                        if compress:
+                            blob.content_encoding = 'gzip'
+                        source.seek(0)
+                        upload, transport = blob._initiate_resumable_upload(
+                            None, source, content_type, stats.sent_bytes, retry=chunk_retry)
+                    while not upload.finished:
+                        upload.transmit_next_chunk(transport)
+                    stats.error = None
+                    break
+                except Exception as e:
+                    stats.error = str(e)
+                    if attempt == self.max_attempts or not is_retryable(e):
+                        logging.error(f"Upload of {local_path} failed after {attempt} attempts: {str(e)}")
+                        break
+                    delay = min(60, 2 ** attempt) * random.uniform(0.5, 1.0)
+                    logging.warning(f"Upload of {local_path} failed ({str(e)}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+        finally:
+            source.close()
+            stats.seconds = time.perf_counter() - start
+
+        self.metrics.observe("upload_seconds", stats.seconds)
+        self.metrics.inc("upload_raw_bytes_total", stats.raw_bytes)
+        self.metrics.inc("upload_attempts_total", stats.attempts)
+        if stats.error is not None:
+            self.metrics.inc("upload_failures_total")
+        else:
+            self.metrics.inc("upload_sent_bytes_total", stats.sent_bytes)
+            logging.info(f"Uploaded {local_path} to gs://{self.bucket_name}/{destination_blob_name}: "
+                         f"{stats.sent_bytes / 1024:.0f} KiB sent ({stats.raw_bytes / 1024:.0f} KiB raw) "
+                         f"at {stats.throughput_mb_s:.2f} MB/s, {stats.chunk_retries} chunk retries")
+        return stats
+
+    def _recover(self, upload, transport, destination_blob_name):
+        """Ask the server how much of an interrupted session it committed and seek there; None if it expired"""
+        try:
+            upload.recover(transport)
+        except InvalidResponse as e:
+            if response_status(e) not in EXPIRED_SESSION_STATUSES:
+                raise
+            logging.warning(f"Upload session for {destination_blob_name} expired, starting over")
+            return None
+        logging.info(f"Resuming upload of {destination_blob_name} at byte {upload.bytes_uploaded}")
+        return upload
+
+    def upload_many(self, local_paths, prefix="", max_workers=4, compress=None):
+        """Upload several files (e.g. result shards) in parallel; returns a list of UploadStats"""
+        def upload(path):
+            name = (prefix.rstrip('/') + '/' if prefix else '') + os.path.basename(path)
+            return self.upload_path(path, name, compress=compress)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            results = list(executor.map(upload, local_paths))
+        elapsed = time.perf_counter() - start
+        sent = sum(stats.sent_bytes for stats in results)
+        failed = [stats.source for stats in results if stats.error]
+        logging.info(f"Uploaded {len(results) - len(failed)}/{len(results)} files, "
+                     f"{sent / (1024 * 1024):.2f} MB in {elapsed:.2f}s "
+                     f"({sent / (1024 * 1024) / elapsed if elapsed else 0:.2f} MB/s), "
+                     f"{sum(stats.chunk_retries for stats in results)} chunk retries")
+        return results
+
+
+class LocalStorageClient:
+    """
+    Filesystem-backed stand-in for storage.Client: buckets are directories under root.
+    Supports the subset of the blob API that GCSModule uses, for offline runs and testing.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, bucket_name):
+        return _LocalBucket(os.path.join(self.root, bucket_name))
+
+
+class _LocalBucket:
+    def __init__(self, path):
+        self.path = path
+
+    def blob(self, blob_name, chunk_size=None):
+        return _LocalBlob(os.path.join(self.path, blob_name), chunk_size)
+
+
+class _LocalBlob:
+    _lock = threading.Lock()
+
+    def __init__(self, path, chunk_size=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.content_encoding = None
+        self.content_type = None
+
+    def _initiate_resumable_upload(self, client, stream, content_type, size, retry=None, **kwargs):
+        """Open a resumable session; mirrors storage.Blob so GCSModule drives both the same way"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        upload = _LocalResumableUpload(self, stream, content_type, size,
+                                       self.chunk_size or CHUNK_MULTIPLE, retry)
+        return upload, None
+
+    def _write_metadata(self, content_type):
+        metadata = {"content_type": content_type, "content_encoding": self.content_encoding}
+        with self._lock, open(self.path + '.metadata.json', 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+
+    def upload_from_string(self, data, content_type=None):
+        self.upload_from_file(io.BytesIO(data.encode('utf-8') if isinstance(data, str) else data),
+                              content_type=content_type)
+
+    def upload_from_file(self, file_obj, rewind=False, size=None, content_type=None, retry=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.uploading'
+        with open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(file_obj, dst, length=self.chunk_size or 1024 * 1024)
+        os.replace(tmp_path, self.path)
+        self._write_metadata(content_type)
+
+
+class _LocalResumableUpload:
+    """
+    Resumable session over a local file: the '.uploading' file holds the bytes the "server"
+    has committed. Same interface as the ResumableUpload that storage.Blob returns.
+    """
+
+    def __init__(self, blob, stream, content_type, size, chunk_size, retry=None):
+        self.blob = blob
+        self.stream = stream
+        self.content_type = content_type
+        self.size = size
+        self.chunk_size = chunk_size
+        self.retry = retry
+        self.resumable_url = blob.path + '.uploading'
+        self.bytes_uploaded = 0
+        self.finished = False
+        self.invalid = False
+        open(self.resumable_url, 'wb').close()
+
+    def _send_chunk(self):
+        self.stream.seek(self.bytes_uploaded)
+        data = self.stream.read(self.chunk_size)
+        with open(self.resumable_url, 'r+b') as dst:
+            dst.seek(self.bytes_uploaded)
+            dst.write(data)
+            dst.truncate()
+        return len(data)
+
+    def transmit_next_chunk(self, transport, timeout=None):
+        if self.invalid:
+            raise ValueError("Upload is in an invalid state. To recover call `recover()`.")
+        try:
+            sent = self.retry(self._send_chunk)() if self.retry is not None else self._send_chunk()
+        except Exception:
+            self.invalid = True
+            raise
+        self.bytes_uploaded += sent
+        if self.bytes_uploaded >= self.size:
+            os.replace(self.resumable_url, self.blob.path)
+            self.blob._write_metadata(self.content_type)
+            self.finished = True
+
+    def recover(self, transport):
+        self.bytes_uploaded = os.path.getsize(self.resumable_url)
+        self.stream.seek(self.bytes_uploaded)
+        self.invalid = False
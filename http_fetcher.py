@@ -0,0 +1,165 @@
+# http_fetcher.py
+import asyncio
+import logging
+import threading
+
+import aiohttp
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+# Markers of Cloudflare / captcha interstitials served instead of real content
+BLOCK_MARKERS = (
+    "cf-browser-verification",
+    "cf-challenge",
+    "challenge-platform",
+    "Just a moment...",
+    "Attention Required! | Cloudflare",
+    "g-recaptcha",
+    "h-captcha",
+    "captcha-delivery",
+)
+BLOCK_STATUSES = (403, 429, 503)
+# Classes every real listing or detail page has (the scraper's ready selectors). Ordinary
+# pages may also load Cloudflare's challenge-platform script or a reCAPTCHA login widget,
+# so a page with its content is never taken for a challenge page.
+CONTENT_MARKERS = ("js__product-link-for-product-id", "re__pr-specs-content", "re__pr-short-info")
+
+
+def is_blocked_page(html_content, status=200):
+    """
+    Return True if the response looks like an anti-bot or challenge page: a block
+    status, or a block marker on a page without the expected listing/detail content
+    """
+    if status in BLOCK_STATUSES:
+        return True
+    if not html_content:
+        return True
+    if any(marker in html_content for marker in CONTENT_MARKERS):
+        return False
+    head = html_content[:20000]
+    return any(marker in head for marker in BLOCK_MARKERS)
+
+
+class FetchError(Exception):
+    """
+    Raised when a page cannot be fetched (and is not a challenge page a browser can load).
+    status is the HTTP status, if there was a response.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def permanent(self):
+        """A 4xx other than the block statuses (e.g. 404/410 for an expired listing): retrying cannot help"""
+        return self.status is not None and 400 <= self.status < 500 and self.status not in BLOCK_STATUSES
+
+
+class FetchResult:
+    def __init__(self, url, status, html, elapsed, error=None):
+        self.url = url
+        self.status = status
+        self.html = html
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def blocked(self):
+        return self.error is None and is_blocked_page(self.html, self.status)
+
+    @property
+    def ok(self):
+        return self.error is None and self.status == 200 and not self.blocked
+
+
+class HttpFetcher:
+    """
+    Pooled asyncio HTTP client for static batdongsan pages.
+    The event loop runs in a background thread so worker threads can call
+    fetch() synchronously while sharing one keep-alive connection pool.
+    """
+
+    def __init__(self, max_connections=20, max_per_host=8, timeout=30, headers=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return self
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._open_session(), self._loop).result()
+        return self
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_per_host,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def fetch_async(self, url):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            async with self._session.get(url, allow_redirects=True) as response:
+                html = await response.text(errors="replace")
+                return FetchResult(url, response.status, html, loop.time() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return FetchResult(url, None, None, loop.time() - start, error=str(e) or type(e).__name__)
+
+    def fetch(self, url):
+        """Fetch a single URL from any thread"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.fetch_async(url), self._loop).result()
+
+    def fetch_many(self, urls):
+        """Fetch several URLs concurrently over the shared pool, preserving order"""
+        self.start()
+
+        async def gather():
+            return await asyncio.gather(*(self.fetch_async(url) for url in urls))
+
+        return asyncio.run_coroutine_threadsafe(gather(), self._loop).result()
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            except Exception as e:
+                logging.error(f"Error closing HTTP session: {str(e)}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+            self._session = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
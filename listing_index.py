@@ -0,0 +1,116 @@
+# listing_index.py
+from datetime import datetime
+import csv
+import glob
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+from parsers import CARD_FIELDS, listing_id_from_url
+
+DEFAULT_INDEX_PATH = "scraped_data/listing_index.sqlite"
+
+
+def card_fingerprint(card):
+    """Hash of the card fields that change when a listing is edited (price, area, title...)"""
+    text = "\x1f".join(card.get(field) or "" for field in CARD_FIELDS)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ListingIndex:
+    """
+    On-disk index of listings already scraped, keyed by detail URL.
+    fingerprint is the card hash at the time the detail page was scraped; rows
+    imported from old CSVs have no fingerprint and count as unchanged.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS listings (
+                url TEXT PRIMARY KEY,
+                listing_id TEXT,
+                fingerprint TEXT,
+                first_seen TEXT,
+                last_seen TEXT,
+                scraped_at TEXT
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS listings_id ON listings (listing_id)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def __contains__(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM listings WHERE url = ?", (url,)).fetchone()
+        return row is not None
+
+    def changed_cards(self, cards):
+        """Cards that are new or whose fingerprint differs from the scraped one"""
+        if not cards:
+            return []
+        urls = [card["url"] for card in cards]
+        with self._lock:
+            known = dict(self._conn.execute(
+                f"SELECT url, fingerprint FROM listings WHERE url IN ({','.join('?' * len(urls))})",
+                urls,
+            ).fetchall())
+        changed = []
+        for card in cards:
+            if card["url"] not in known:
+                changed.append(card)
+            elif known[card["url"]] is not None and known[card["url"]] != card_fingerprint(card):
+                changed.append(card)
+        return changed
+
+    def mark_seen(self, urls):
+        """Bump last_seen for listings that showed up on a listing page"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.executemany("UPDATE listings SET last_seen = ? WHERE url = ?",
+                                   [(now, url) for url in urls])
+            self._conn.commit()
+
+    def mark_scraped(self, url, listing_id=None, fingerprint=None):
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO listings (url, listing_id, fingerprint, first_seen, last_seen, scraped_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(url) DO UPDATE SET
+                       listing_id = COALESCE(excluded.listing_id, listing_id),
+                       fingerprint = COALESCE(excluded.fingerprint, fingerprint),
+                       last_seen = excluded.last_seen,
+                       scraped_at = excluded.scraped_at""",
+                (url, listing_id or listing_id_from_url(url), fingerprint, now, now, now),
+            )
+            self._conn.commit()
+
+    def import_csv(self, paths=None):
+        """Seed the index from earlier scraped_data/properties_*.csv files"""
+        paths = paths if paths is not None else sorted(glob.glob("scraped_data/properties_*.csv"))
+        imported = 0
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8-sig", newline="") as f:
+                    for row in csv.DictReader(f):
+                        if row.get("url") and row.get("blocked") != "True":
+                            self.mark_scraped(row["url"], row.get("Mã tin") or None)
+                            imported += 1
+            except Exception as e:
+                logging.error(f"Error importing {path} into listing index: {str(e)}")
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,350 @@
+# listing_store.py
+"""
+Historical listing store built from scrape snapshots.
+
+    python listing_store.py compact [--store DIR] [SNAPSHOT ...]
+    python listing_store.py history --store DIR MA_TIN
+
+Layout under the store directory:
+    snapshots/scrape_date=<YYYY-MM-DD>/district=<slug>/<snapshot>.parquet
+        typed rows of every compacted snapshot
+    history/scrape_date=<YYYY-MM-DD>/<snapshot>.parquet
+        one row per new listing and per price or expiry change
+    latest.parquet   current state of every listing, upserted on Mã tin
+                     (card-mode rows only refresh price, area and title)
+    index.sqlite     Mã tin -> snapshot files, plus the snapshots already compacted
+
+Lookups by Mã tin read only the files the index lists for it (and only the row
+groups that can hold it); date-range queries only open the matching
+scrape_date partitions.
+"""
+from datetime import date, datetime
+import argparse
+import glob
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+import pandas as pd
+
+from normalize import normalize_properties
+from parsers import BLOCKED_FIELD, CARD_RECORD_FIELDS
+from result_sink import read_output
+
+DEFAULT_STORE_PATH = "scraped_data/store"
+# Snapshot outputs to compact; typed copies and merged shards are derived from these
+SNAPSHOT_PATTERN = "scraped_data/properties_*.csv"
+RUN_DATE_PATTERN = re.compile(r"(\d{2})_(\d{2})_(\d{4})")
+TRACKED_CHANGES = {"price": "Mức giá", "expiry": "Ngày hết hạn"}
+TEXT_COLUMNS = ["Tiêu đề", "source", "district"]
+# What a search-result card carries (after normalization); its other fields are empty, not unknown
+CARD_COLUMNS = ["Mức giá", "Giá theo tháng", "Giá/m²", "Diện tích", "Tiêu đề", "url"]
+
+
+def district_of(address):
+    """'..., Phường An Bình, Dĩ An, Bình Dương' -> 'Dĩ An' (the part before the province)"""
+    if not isinstance(address, str):
+        return None
+    parts = [part.strip() for part in address.split(",") if part.strip()]
+    return parts[-2] if len(parts) >= 2 else (parts[0] if parts else None)
+
+
+def slugify(text):
+    """'Dĩ An' -> 'di-an', for partition directory names"""
+    if not text:
+        return "unknown"
+    text = unicodedata.normalize("NFKD", text.replace("đ", "d").replace("Đ", "D"))
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"[^a-z0-9]+", "-", text).strip("-") or "unknown"
+
+
+def snapshot_date(path):
+    """Scrape date from a properties_<dd_mm_YYYY_...> file name, else the file's modification date"""
+    match = RUN_DATE_PATTERN.search(os.path.basename(path))
+    if match:
+        day, month, year = map(int, match.groups())
+        try:
+            return date(year, month, day)
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path)).date()
+
+
+def _conform(typed):
+    """Same columns and dtypes for every snapshot, so partitions concatenate cleanly"""
+    typed["district"] = typed["Địa chỉ"].map(district_of)
+    for column in CARD_RECORD_FIELDS:
+        if column not in typed and column != BLOCKED_FIELD:
+            typed[column] = pd.Series(pd.NA, index=typed.index, dtype="string")
+    for column in TEXT_COLUMNS:
+        typed[column] = typed[column].astype("string")
+    for column in typed.columns:
+        # Category sets differ between snapshots; Parquet dictionary-encodes strings anyway
+        if isinstance(typed[column].dtype, pd.CategoricalDtype):
+            typed[column] = typed[column].astype("string")
+    return typed.drop(columns=[BLOCKED_FIELD], errors="ignore")
+
+
+def _merge_cards(new, previous, known):
+    """Card rows of listings already in previous only refresh the fields a card carries"""
+    cards = known & new["source"].eq("card").fillna(False)
+    if not cards.any():
+        return new
+    merged = previous.loc[new.loc[cards, "Mã tin"]].reset_index().reindex(columns=new.columns)
+    merged.index = new.index[cards]
+    for column in CARD_COLUMNS:
+        if column in new:
+            card_values = new.loc[cards, column]
+            merged[column] = card_values.where(card_values.notna(), merged[column])
+    merged["last_seen"] = new.loc[cards, "last_seen"]
+    return pd.concat([new[~cards], merged]).sort_index()
+
+
+def _changed(old, new):
+    both_missing = old.isna() & new.isna()
+    return ~both_missing & (old.isna() | new.isna() | (old != new).fillna(True))
+
+
+class ListingStore:
+    """
+    Partitioned Parquet store of every compacted snapshot plus the latest state and
+    the change history of each listing (keyed by Mã tin).
+    """
+
+    def __init__(self, root=DEFAULT_STORE_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.latest_path = os.path.join(root, "latest.parquet")
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()  # one upsert of latest.parquet at a time
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS listing_files (
+                listing_id INTEGER NOT NULL,
+                scrape_date TEXT NOT NULL,
+                district TEXT,
+                path TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS listing_files_id ON listing_files (listing_id, scrape_date);
+            CREATE INDEX IF NOT EXISTS listing_files_date ON listing_files (scrape_date);
+            CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                source TEXT,
+                scrape_date TEXT,
+                rows INTEGER,
+                compacted_at TEXT
+            );"""
+        )
+        self._conn.commit()
+
+    def compacted(self, name):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM snapshots WHERE name = ?", (name,)).fetchone() is not None
+
+    def compact(self, path, scrape_date=None, force=False):
+        """
+        Fold one snapshot (a run's output file) into the store; returns the number of
+        listings written, or 0 if it was compacted before (unless force).
+        Blocked rows and rows without a Mã tin are skipped.
+        """
+        with self._compact_lock:
+            return self._compact(path, scrape_date, force)
+
+    def _compact(self, path, scrape_date, force):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if not force and self.compacted(name):
+            logging.info(f"{path} is already in the listing store")
+            return 0
+        scrape_date = (scrape_date or snapshot_date(path)).isoformat()
+        try:
+            df = read_output(path)
+        except pd.errors.EmptyDataError:
+            logging.info(f"Skipping empty snapshot {path}")
+            return 0
+        if BLOCKED_FIELD in df:
+            df = df[~df[BLOCKED_FIELD].astype("string").str.lower().eq("true").fillna(False)]
+        typed = _conform(normalize_properties(df))
+        typed = typed[typed["Mã tin"].notna()].drop_duplicates("Mã tin", keep="last")
+        typed = typed.reset_index(drop=True)
+
+        # A re-compacted snapshot (e.g. after its run was resumed) replaces its earlier files
+        for stale_path in glob.glob(os.path.join(self.root, "snapshots", "*", "*", f"{name}.parquet")):
+            os.remove(stale_path)
+        index_rows = []
+        for district, rows in typed.groupby(typed["district"].map(slugify), sort=True):
+            directory = os.path.join(self.root, "snapshots", f"scrape_date={scrape_date}", f"district={district}")
+            os.makedirs(directory, exist_ok=True)
+            file_path = os.path.join(directory, f"{name}.parquet")
+            rows.sort_values("Mã tin").to_parquet(file_path, index=False, compression="zstd",
+                                                  row_group_size=10_000)
+            relative = os.path.relpath(file_path, self.root)
+            index_rows += [(int(listing_id), scrape_date, district, relative) for listing_id in rows["Mã tin"]]
+
+        changes = self._upsert_latest(typed, scrape_date)
+        if not changes.empty:
+            directory = os.path.join(self.root, "history", f"scrape_date={scrape_date}")
+            os.makedirs(directory, exist_ok=True)
+            history_path = os.path.join(directory, f"{name}.parquet")
+            if os.path.exists(history_path):
+                changes = pd.concat([pd.read_parquet(history_path), changes], ignore_index=True)
+            changes.to_parquet(history_path, index=False, compression="zstd")
+
+        with self._lock:
+            self._conn.execute("DELETE FROM listing_files WHERE path LIKE ?", (f"%/{name}.parquet",))
+            self._conn.executemany("INSERT INTO listing_files VALUES (?, ?, ?, ?)", index_rows)
+            self._conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)",
+                               (name, os.path.abspath(path), scrape_date, len(typed),
+                                datetime.now().isoformat(timespec="seconds")))
+            self._conn.commit()
+        logging.info(f"Compacted {path} ({scrape_date}): {len(typed)} listings, "
+                     f"{len(changes)} history rows")
+        return len(typed)
+
+    def _upsert_latest(self, typed, scrape_date):
+        """
+        Replace listings seen in typed (unless the store already has a newer scrape);
+        a card row only updates a known listing's card fields. Returns the history rows.
+        """
+        new = typed.assign(first_seen=scrape_date, last_seen=scrape_date)
+        if not os.path.exists(self.latest_path):
+            latest = new
+            changes = self._history_rows(new, None, scrape_date)
+        else:
+            current = pd.read_parquet(self.latest_path)
+            previous = current.set_index("Mã tin")
+            known = new["Mã tin"].isin(previous.index)
+            older = known & (new["Mã tin"].map(previous["last_seen"]) > scrape_date).fillna(False)
+            new, known = new[~older].copy(), known[~older]
+            new.loc[known, "first_seen"] = new.loc[known, "Mã tin"].map(previous["first_seen"])
+            new = _merge_cards(new, previous, known)
+            changes = self._history_rows(new, previous, scrape_date)
+            latest = pd.concat([current[~current["Mã tin"].isin(new["Mã tin"])], new], ignore_index=True)
+        tmp_path = self.latest_path + ".tmp"
+        latest.sort_values("Mã tin").to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, self.latest_path)
+        return changes
+
+    @staticmethod
+    def _history_rows(new, previous, scrape_date):
+        columns = ["Mã tin", "scrape_date", "change", "price_old", "price_new", "expiry_old", "expiry_new"]
+        frames = []
+        ids = new["Mã tin"]
+        if previous is None:
+            is_new = pd.Series(True, index=new.index)
+        else:
+            is_new = ~ids.isin(previous.index)
+        frames.append(pd.DataFrame({
+            "Mã tin": ids[is_new], "change": "new",
+            "price_new": new.loc[is_new, "Mức giá"], "expiry_new": new.loc[is_new, "Ngày hết hạn"],
+        }))
+        if previous is not None:
+            known = new[~is_new]
+            for change, column in TRACKED_CHANGES.items():
+                old = known["Mã tin"].map(previous[column])
+                moved = _changed(old, known[column])
+                rows = {"Mã tin": known.loc[moved, "Mã tin"], "change": change}
+                rows[f"{change}_old"] = old[moved]
+                rows[f"{change}_new"] = known.loc[moved, column]
+                frames.append(pd.DataFrame(rows))
+        history = pd.concat(frames, ignore_index=True).reindex(columns=columns)
+        history["scrape_date"] = scrape_date
+        history["change"] = history["change"].astype("string")
+        history["price_old"] = history["price_old"].astype("float64")
+        history["price_new"] = history["price_new"].astype("float64")
+        for column in ("expiry_old", "expiry_new"):
+            history[column] = pd.to_datetime(history[column])
+        return history
+
+    def compact_all(self, pattern=SNAPSHOT_PATTERN):
+        """Compact every snapshot matching pattern that is not in the store yet, oldest first"""
+        paths = [path for path in glob.glob(pattern) if not path.endswith(("_typed.csv", "_merged.csv"))]
+        paths.sort(key=lambda path: (snapshot_date(path), os.path.basename(path)))
+        return sum(self.compact(path) for path in paths)
+
+    def latest(self, columns=None):
+        """Current state of every listing"""
+        if not os.path.exists(self.latest_path):
+            return pd.DataFrame()
+        return pd.read_parquet(self.latest_path, columns=columns)
+
+    def listing_history(self, listing_id):
+        """Every stored snapshot row of one listing, oldest first"""
+        listing_id = int(listing_id)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT scrape_date, path FROM listing_files WHERE listing_id = ? ORDER BY scrape_date",
+                (listing_id,),
+            ).fetchall()
+        frames = []
+        for scrape_date, path in rows:
+            frame = pd.read_parquet(os.path.join(self.root, path), filters=[("Mã tin", "==", listing_id)])
+            frames.append(frame.assign(scrape_date=scrape_date))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def changes(self, listing_id=None, start=None, end=None):
+        """Price/expiry history rows, optionally of one listing and within [start, end] scrape dates"""
+        filters = [("Mã tin", "==", int(listing_id))] if listing_id is not None else None
+        frames = [pd.read_parquet(path, filters=filters)
+                  for path in self._partition_files("history", start, end)]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True).sort_values(["scrape_date", "Mã tin"], ignore_index=True)
+
+    def snapshots_between(self, start=None, end=None, districts=None, columns=None):
+        """Snapshot rows scraped between start and end (ISO dates or date objects), optionally only some districts"""
+        wanted = {slugify(district) for district in districts} if districts else None
+        frames = []
+        for path in self._partition_files("snapshots", start, end):
+            district = os.path.basename(os.path.dirname(path)).split("=", 1)[1]
+            if wanted is not None and district not in wanted:
+                continue
+            scrape_date = os.path.basename(os.path.dirname(os.path.dirname(path))).split("=", 1)[1]
+            frames.append(pd.read_parquet(path, columns=columns).assign(scrape_date=scrape_date))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _partition_files(self, kind, start, end):
+        start = str(start) if start is not None else None
+        end = str(end) if end is not None else None
+        paths = []
+        for directory in sorted(glob.glob(os.path.join(self.root, kind, "scrape_date=*"))):
+            scrape_date = os.path.basename(directory).split("=", 1)[1]
+            if (start and scrape_date < start) or (end and scrape_date > end):
+                continue
+            paths += sorted(glob.glob(os.path.join(directory, "**", "*.parquet"), recursive=True))
+        return paths
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("command", choices=["compact", "history"])
+    arg_parser.add_argument("args", nargs="*", help="snapshot files to compact, or the Mã tin to look up")
+    arg_parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    # The Mã tin or snapshot paths may come after --store, as in the usage above
+    args = arg_parser.parse_intermixed_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    store = ListingStore(args.store)
+    try:
+        if args.command == "compact":
+            count = sum(store.compact(path) for path in args.args) if args.args else store.compact_all()
+            print(f"Compacted {count} listings into {args.store}")
+        else:
+            if len(args.args) != 1:
+                arg_parser.error("history needs one Mã tin")
+            with pd.option_context("display.width", 200, "display.max_columns", 12):
+                print(store.listing_history(args.args[0]))
+                print(store.changes(args.args[0]))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
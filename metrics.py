@@ -0,0 +1,287 @@
+# metrics.py
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_PREFIX = "scraper_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_key(key):
+    """('fetch_seconds', (('source', 'http'),)) -> 'fetch_seconds{source=http}'"""
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+class Histogram:
+    """Fixed-bucket histogram: constant memory, O(log buckets) per observation"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def copy(self):
+        other = Histogram(self.buckets)
+        other.counts = list(self.counts)
+        other.count, other.sum, other.max = self.count, self.sum, self.max
+        return other
+
+    def minus(self, earlier):
+        """Observations made since the earlier copy (max is kept from this histogram)"""
+        other = self.copy()
+        if earlier is not None:
+            other.counts = [a - b for a, b in zip(self.counts, earlier.counts)]
+            other.count -= earlier.count
+            other.sum -= earlier.sum
+        return other
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, capped at the observed max"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe counters, gauges and latency histograms keyed by name and labels.
+    Counters only go up, so a run's figures are the difference between a snapshot
+    taken at its start and the current values (see summary(since=...)).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._snapshot_thread = None
+        self._stop_snapshots = threading.Event()
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge (e.g. a current limit) to value"""
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the block into histogram name; exceptions are counted in errors_total and re-raised"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc("errors_total", where=name, error=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {key: h.copy() for key, h in self._histograms.items()},
+                "time": time.time(),
+            }
+
+    def summary(self, since=None):
+        """JSON-friendly counters and histogram stats, optionally only since an earlier snapshot"""
+        current = self.snapshot()
+        earlier = since or {"counters": {}, "histograms": {}, "time": None}
+        counters = {}
+        for key, value in sorted(current["counters"].items()):
+            delta = value - earlier["counters"].get(key, 0)
+            if delta:
+                counters[format_key(key)] = round(delta, 4) if isinstance(delta, float) else delta
+        histograms = {}
+        for key, histogram in sorted(current["histograms"].items()):
+            delta = histogram.minus(earlier["histograms"].get(key))
+            if delta.count:
+                histograms[format_key(key)] = delta.as_dict()
+        gauges = {format_key(key): value for key, value in sorted(current["gauges"].items())}
+        summary = {"counters": counters, "gauges": gauges, "latency_seconds": histograms}
+        if earlier["time"] is not None:
+            summary["seconds"] = round(current["time"] - earlier["time"], 3)
+        return summary
+
+    def prometheus_text(self):
+        """Current values in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        typed = set()
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            metric = PROMETHEUS_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+        for (name, labels), value in sorted(snapshot["gauges"].items()):
+            metric = PROMETHEUS_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+        for (name, labels), histogram in sorted(snapshot["histograms"].items()):
+            metric = PROMETHEUS_PREFIX + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_sum{labels_text(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{labels_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port=9108, host="127.0.0.1"):
+        """Serve /metrics (Prometheus text) and /metrics.json from a background thread"""
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.summary(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = metrics.prometheus_text().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def start_snapshots(self, path, interval=30, since=None):
+        """Rewrite path with a JSON summary (since the given snapshot) every interval seconds until stop()"""
+        if self._snapshot_thread is not None:
+            logging.warning(f"Metrics snapshots are already being written; not writing {path}")
+            return
+
+        def write_snapshots():
+            while not self._stop_snapshots.wait(interval):
+                self.write_snapshot(path, since)
+            self.write_snapshot(path, since)
+
+        self._stop_snapshots.clear()
+        self._snapshot_thread = threading.Thread(target=write_snapshots, name="metrics-snapshots", daemon=True)
+        self._snapshot_thread.start()
+
+    def write_snapshot(self, path, since=None):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.summary(since), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Error writing metrics snapshot {path}: {str(e)}")
+
+    def stop_snapshots(self):
+        if self._snapshot_thread is not None:
+            self._stop_snapshots.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
+    def stop(self):
+        self.stop_snapshots()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def format_summary(summary):
+    """Human-readable table of a summary() for the end-of-run log"""
+    lines = []
+    if summary["latency_seconds"]:
+        lines.append(f"{'stage':<58}{'count':>7}{'total s':>10}{'mean ms':>10}{'p95 ms':>9}{'max ms':>9}")
+        for key, stats in summary["latency_seconds"].items():
+            lines.append(f"{key:<58}{stats['count']:>7}{stats['total']:>10.2f}{stats['mean'] * 1000:>10.1f}"
+                         f"{stats['p95'] * 1000:>9.1f}{stats['max'] * 1000:>9.1f}")
+    for key, value in summary["counters"].items():
+        lines.append(f"{key:<58}{value:>7}")
+    for key, value in summary.get("gauges", {}).items():
+        lines.append(f"{key:<58}{value:>7.4g}")
+    return "\n".join(lines)
+
+
+# Shared registry used when no Metrics instance is passed explicitly
+METRICS = Metrics()
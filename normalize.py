@@ -0,0 +1,90 @@
+# normalize.py
+import logging
+
+import numpy as np
+import pandas as pd
+
+PRICE_UNITS = {"tỷ": 1e9, "triệu": 1e6, "nghìn": 1e3, "ngàn": 1e3}
+NEGOTIABLE = "thỏa thuận"
+
+AREA_COLUMNS = ["Diện tích", "Mặt tiền", "Đường vào"]
+COUNT_COLUMNS = ["Số tầng", "Số phòng ngủ", "Số toilet"]
+DATE_COLUMNS = ["Ngày đăng", "Ngày hết hạn"]
+CATEGORY_COLUMNS = ["Hướng nhà", "Hướng ban công", "Pháp lý", "Nội thất", "Loại tin", "source"]
+
+
+def parse_vn_number(series):
+    """'1.234,5 m²' -> 1234.5: '.' groups thousands and ',' is the decimal mark"""
+    number = series.astype("string").str.extract(r"(\d[\d.,]*)", expand=False)
+    number = number.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(number, errors="coerce").astype("float64")
+
+
+def parse_price(price, area):
+    """
+    Price strings to VND: 'x tỷ', 'x triệu', 'x triệu/m²' (multiplied by area) and
+    'x triệu/tháng'. 'Thỏa thuận' becomes NaN. Returns (price_vnd, per_month flag).
+    """
+    text = price.astype("string").str.strip().str.lower()
+    parts = text.str.extract(r"(?P<number>\d[\d.,]*)\s*(?P<unit>tỷ|triệu|nghìn|ngàn)?\s*(?P<per>/\s*m²|/\s*m2|/\s*tháng)?")
+    value = parse_vn_number(parts["number"])
+    multiplier = parts["unit"].map(PRICE_UNITS).astype("float64").fillna(1.0)
+    vnd = value * multiplier
+    per = parts["per"].fillna("").str.replace(" ", "", regex=False)
+    per_m2 = per.isin(["/m²", "/m2"]).to_numpy(dtype=bool)
+    vnd = pd.Series(np.where(per_m2, vnd * area, vnd), index=price.index, dtype="float64")
+    vnd = vnd.mask(text.eq(NEGOTIABLE).fillna(False))
+    return vnd, per.eq("/tháng").fillna(False).astype(bool)
+
+
+def normalize_properties(df):
+    """
+    Typed copy of a scraped DataFrame: areas in m² and prices in VND as float64,
+    counts as nullable Int64, dates as datetime64 and low-cardinality text as
+    categoricals. Adds 'Giá/m²' (VND per m²) and 'Giá theo tháng' (rental price).
+    """
+    typed = df.copy()
+
+    for column in AREA_COLUMNS:
+        if column in typed:
+            typed[column] = parse_vn_number(typed[column])
+
+    if "Mức giá" in typed:
+        area = typed["Diện tích"] if "Diện tích" in typed else pd.Series(np.nan, index=typed.index)
+        typed["Mức giá"], typed["Giá theo tháng"] = parse_price(typed["Mức giá"], area)
+        typed["Giá/m²"] = typed["Mức giá"] / area.where(area > 0)
+
+    for column in COUNT_COLUMNS:
+        if column in typed:
+            typed[column] = parse_vn_number(typed[column]).round().astype("Int64")
+
+    for column in DATE_COLUMNS:
+        if column in typed:
+            typed[column] = pd.to_datetime(typed[column], format="%d/%m/%Y", errors="coerce")
+
+    for column in CATEGORY_COLUMNS:
+        if column in typed:
+            typed[column] = typed[column].astype("string").str.strip().astype("category")
+
+    if "Mã tin" in typed:
+        typed["Mã tin"] = pd.to_numeric(typed["Mã tin"], errors="coerce").astype("Int64")
+    for column in ("latitude", "longitude"):
+        if column in typed:
+            typed[column] = pd.to_numeric(typed[column], errors="coerce").astype("float64")
+    if "blocked" in typed:
+        typed["blocked"] = typed["blocked"].astype("string").str.lower().eq("true").fillna(False).astype(bool)
+    for column in ("Địa chỉ", "Tiêu đề", "url"):
+        if column in typed:
+            typed[column] = typed[column].astype("string")
+
+    return typed
+
+
+def write_typed_parquet(df, path, compression="zstd"):
+    """Normalize df and write it as a compressed Parquet file; returns the typed DataFrame"""
+    typed = normalize_properties(df)
+    try:
+        typed.to_parquet(path, index=False, compression=compression)
+    except ImportError as e:
+        logging.error(f"Cannot write typed Parquet {path}: {str(e)}")
+    return typed
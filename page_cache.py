@@ -0,0 +1,178 @@
+# page_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_DIR = "scraped_data/page_cache"
+
+
+class PageNotCached(LookupError):
+    """Raised in replay mode when a page is not in the cache"""
+
+
+class PageCache:
+    """
+    Disk cache of raw page HTML, keyed by URL.
+    Bodies are zlib-compressed and stored once per SHA-256 digest under
+    objects/<2 hex>/<digest>.z; index.sqlite maps URLs to digests. Entries older
+    than ttl seconds are treated as misses, and once the stored bytes exceed
+    max_bytes the least recently used URLs are evicted.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, ttl=None, max_bytes=None, evict_every=200):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS objects (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        self._conn.commit()
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".z")
+
+    def get(self, url, ignore_ttl=False, max_age=None):
+        """
+        Cached HTML for url, or None on a miss or expired entry.
+        max_age: seconds after which this entry counts as expired, instead of ttl.
+        """
+        ttl = max_age if max_age is not None else self.ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None or (ttl and not ignore_ttl and time.time() - row[1] > ttl):
+                self.misses += 1
+                return None
+            if not ignore_ttl:  # replay reads do not count towards LRU order
+                self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+                self._conn.commit()
+        try:
+            with open(self._object_path(row[0]), "rb") as f:
+                html_content = zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error) as e:
+            logging.warning(f"Dropping unreadable cache entry for {url}: {str(e)}")
+            self.delete(url)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return html_content
+
+    def put(self, url, html_content):
+        body = html_content.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        compressed = zlib.compress(body, 6)
+        now = time.time()
+        # Written under the lock so eviction cannot remove an object before it is indexed
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(compressed)
+                os.replace(tmp_path, path)
+            self._conn.execute("INSERT OR REPLACE INTO objects (digest, size) VALUES (?, ?)",
+                               (digest, len(compressed)))
+            self._conn.execute(
+                """INSERT INTO pages (url, digest, fetched_at, accessed_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(url) DO UPDATE SET digest = excluded.digest,
+                       fetched_at = excluded.fetched_at, accessed_at = excluded.accessed_at""",
+                (url, digest, now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            evict = self.max_bytes and self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def delete(self, url):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._conn.commit()
+        self._remove_orphans()
+
+    def urls(self, pattern=None):
+        """Cached URLs, optionally filtered with a SQL LIKE pattern"""
+        with self._lock:
+            if pattern:
+                rows = self._conn.execute("SELECT url FROM pages WHERE url LIKE ? ORDER BY url", (pattern,))
+            else:
+                rows = self._conn.execute("SELECT url FROM pages ORDER BY url")
+            return [row[0] for row in rows.fetchall()]
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        with self._lock:
+            if self.ttl:
+                self._conn.execute("DELETE FROM pages WHERE fetched_at < ?", (time.time() - self.ttl,))
+                self._conn.commit()
+        self._remove_orphans()
+        if not self.max_bytes:
+            return
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT pages.url, pages.digest, objects.size FROM pages
+                   JOIN objects ON objects.digest = pages.digest ORDER BY pages.accessed_at"""
+            ).fetchall()
+            victims, freed_digests, freed = [], set(), 0
+            for url, digest, size in rows:
+                if freed >= excess:
+                    break
+                victims.append((url,))
+                if digest not in freed_digests:
+                    freed_digests.add(digest)
+                    freed += size
+            self._conn.executemany("DELETE FROM pages WHERE url = ?", victims)
+            self._conn.commit()
+        self._remove_orphans()
+
+    def _remove_orphans(self):
+        with self._lock:
+            orphans = [row[0] for row in self._conn.execute(
+                "SELECT digest FROM objects WHERE digest NOT IN (SELECT digest FROM pages)"
+            ).fetchall()]
+            self._conn.executemany("DELETE FROM objects WHERE digest = ?", [(d,) for d in orphans])
+            self._conn.commit()
+            for digest in orphans:
+                try:
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,369 @@
+# parsers.py
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urljoin
+import re
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+PROPERTY_FIELDS = [
+    "Diện tích", "Mức giá", "Mặt tiền", "Đường vào", "Hướng nhà", "Hướng ban công",
+    "Số tầng", "Số phòng ngủ", "Số toilet", "Pháp lý", "Nội thất", "Ngày đăng",
+    "Ngày hết hạn", "Loại tin", "Mã tin", "Địa chỉ", "latitude", "longitude", "url",
+    "blocked",
+]
+# Set by the scraper: True when the page was a block/captcha page, so the record is a retry candidate
+BLOCKED_FIELD = "blocked"
+# Extra columns of card-mode runs: the card's title and where the record came from ('card' or 'detail')
+TITLE_FIELD = "Tiêu đề"
+SOURCE_FIELD = "source"
+CARD_RECORD_FIELDS = PROPERTY_FIELDS + [TITLE_FIELD, SOURCE_FIELD]
+
+# Exact class strings of the four regions read from a detail page
+SPECS_CLASS = 're__pr-specs-content js__other-info'
+ADDRESS_CLASS = 're__pr-short-description js__pr-address'
+MAP_CLASS = 're__section re__pr-map js__section js__li-other'
+SHORT_INFO_CLASS = 're__pr-short-info re__pr-config js__pr-config'
+LISTING_LINK_CLASS = 'js__product-link-for-product-id'
+PAGINATION_CLASS = 're__pagination'
+PAGINATION_NUMBER_CLASS = 're__pagination-number'
+CARD_CLASS = 'js__card'
+CARD_FIELDS = {
+    'title': 're__card-title',
+    'price': 're__card-config-price',
+    'area': 're__card-config-area',
+    'location': 're__card-location',
+}
+LISTING_ID_PATTERN = re.compile(r'-pr(\d+)')
+
+COORDINATES_PATTERN = re.compile(r'place\?q=([-+]?\d*\.\d+),([-+]?\d*\.\d+)')
+
+
+def empty_record(property_url):
+    record = dict.fromkeys(PROPERTY_FIELDS)
+    record["url"] = property_url
+    return record
+
+
+def extract_coordinates(html_content):
+    match = COORDINATES_PATTERN.search(html_content)
+    if match:
+        return [float(match.group(1)), float(match.group(2))]
+    return [None, None]
+
+
+def listing_id_from_url(url):
+    match = LISTING_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def _card(url, listing_id, texts):
+    """Listing card dict; texts maps CARD_FIELDS keys to raw text (or None)"""
+    card = {"url": url, "listing_id": listing_id or listing_id_from_url(url)}
+    for field in CARD_FIELDS:
+        text = texts.get(field)
+        card[field] = " ".join(text.split()) if text else None
+    return card
+
+
+def card_record(card):
+    """Record built from a search-result card alone; fields only shown on the detail page stay empty"""
+    record = empty_record(card["url"])
+    record["Mức giá"] = card.get("price")
+    record["Diện tích"] = card.get("area")
+    record["Địa chỉ"] = card.get("location")
+    record["Mã tin"] = card.get("listing_id")
+    record[BLOCKED_FIELD] = False
+    record[TITLE_FIELD] = card.get("title")
+    record[SOURCE_FIELD] = "card"
+    return record
+
+
+def _has_class(class_name):
+    """XPath predicate matching one class token, like BeautifulSoup's class_ filter"""
+    return f'contains(concat(" ", normalize-space(@class), " "), " {class_name} ")'
+
+
+def _max_page_number(texts):
+    numbers = [int(text) for text in texts if text.isdigit()]
+    return max(numbers) if numbers else 1
+
+
+class PropertyParser:
+    """
+    Extraction backend for batdongsan pages.
+    parse_property returns the record dict for a detail page, listing_urls the
+    absolute detail links of a listing page and last_page the highest page
+    number visible in its pagination block.
+    """
+    name = None
+
+    def parse_property(self, html_content, property_url):
+        raise NotImplementedError
+
+    def listing_urls(self, html_content, page_url):
+        raise NotImplementedError
+
+    def last_page(self, html_content):
+        raise NotImplementedError
+
+    def listing_cards(self, html_content, page_url):
+        """One dict per result card: url, listing_id and the CARD_FIELDS texts"""
+        raise NotImplementedError
+
+
+class BeautifulSoupParser(PropertyParser):
+    """Reference backend: whole-document BeautifulSoup parse"""
+    name = 'bs4'
+
+    def __init__(self, features='html.parser'):
+        self.features = features
+
+    def _soup(self, html_content):
+        return BeautifulSoup(html_content, self.features)
+
+    def parse_property(self, html_content, property_url):
+        soup = self._soup(html_content)
+        property_data = empty_record(property_url)
+
+        specs_div = soup.find('div', class_=SPECS_CLASS)
+        if specs_div:
+            titles = specs_div.find_all('span', class_='re__pr-specs-content-item-title')
+            values = specs_div.find_all('span', class_='re__pr-specs-content-item-value')
+            for title, value in zip(titles, values):
+                property_data[title.get_text().strip()] = value.get_text().strip()
+
+        address = soup.find('span', class_=ADDRESS_CLASS)
+        if address and address.text.strip():
+            property_data["Địa chỉ"] = address.text.strip()
+
+        map_div = soup.find('div', class_=MAP_CLASS)
+        if map_div:
+            property_data["latitude"], property_data["longitude"] = extract_coordinates(str(map_div))
+
+        short_info = soup.find('div', class_=SHORT_INFO_CLASS)
+        if short_info:
+            info_titles = short_info.find_all('span', class_='title')
+            info_values = short_info.find_all('span', class_='value')
+            for title, value in zip(info_titles, info_values):
+                property_data[title.get_text().strip()] = value.get_text().strip()
+
+        return property_data
+
+    def listing_urls(self, html_content, page_url):
+        soup = self._soup(html_content)
+        return [urljoin(page_url, element.get('href'))
+                for element in soup.select('.' + LISTING_LINK_CLASS)
+                if element.get('href')]
+
+    def listing_cards(self, html_content, page_url):
+        cards = []
+        for link in self._soup(html_content).select('.' + LISTING_LINK_CLASS):
+            if not link.get('href'):
+                continue
+            scope = link.find_parent(class_=CARD_CLASS) or link
+            texts = {}
+            for field, class_name in CARD_FIELDS.items():
+                element = scope.find(class_=class_name)
+                texts[field] = element.get_text() if element else None
+            cards.append(_card(urljoin(page_url, link.get('href')), link.get('data-product-id'), texts))
+        return cards
+
+    def last_page(self, html_content):
+        pagination = self._soup(html_content).find('div', class_=PAGINATION_CLASS)
+        if not pagination:
+            return 1
+        return _max_page_number(
+            item.text for item in pagination.find_all('a', class_=PAGINATION_NUMBER_CLASS)
+        )
+
+
+DETAIL_REGIONS = SoupStrainer(['div', 'span'],
+                              class_=[SPECS_CLASS, ADDRESS_CLASS, MAP_CLASS, SHORT_INFO_CLASS])
+
+
+class StrainedSoupParser(BeautifulSoupParser):
+    """BeautifulSoup that only builds the detail-page regions we read (SoupStrainer)"""
+    name = 'bs4-strainer'
+
+    def parse_property(self, html_content, property_url):
+        soup = BeautifulSoup(html_content, self.features, parse_only=DETAIL_REGIONS)
+        return BeautifulSoupParser.parse_property(self, soup, property_url)
+
+    def _soup(self, html_content):
+        if isinstance(html_content, BeautifulSoup):
+            return html_content
+        return BeautifulSoup(html_content, self.features)
+
+
+class LxmlParser(PropertyParser):
+    """libxml2 parse with XPath lookups of the four detail regions"""
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("lxml is required for the lxml parser backend")
+
+    def parse_property(self, html_content, property_url):
+        root = lxml.html.fromstring(html_content)
+        property_data = empty_record(property_url)
+
+        specs_div = root.xpath(f'//div[@class="{SPECS_CLASS}"]')
+        if specs_div:
+            titles = specs_div[0].xpath(f'.//span[{_has_class("re__pr-specs-content-item-title")}]')
+            values = specs_div[0].xpath(f'.//span[{_has_class("re__pr-specs-content-item-value")}]')
+            for title, value in zip(titles, values):
+                property_data[title.text_content().strip()] = value.text_content().strip()
+
+        address = root.xpath(f'//span[@class="{ADDRESS_CLASS}"]')
+        if address and address[0].text_content().strip():
+            property_data["Địa chỉ"] = address[0].text_content().strip()
+
+        map_div = root.xpath(f'//div[@class="{MAP_CLASS}"]')
+        if map_div:
+            # Search attribute values in place instead of re-serializing the subtree
+            for value in map_div[0].xpath('.//@*'):
+                coords = extract_coordinates(value)
+                if coords[0] is not None:
+                    property_data["latitude"], property_data["longitude"] = coords
+                    break
+
+        short_info = root.xpath(f'//div[@class="{SHORT_INFO_CLASS}"]')
+        if short_info:
+            info_titles = short_info[0].xpath(f'.//span[{_has_class("title")}]')
+            info_values = short_info[0].xpath(f'.//span[{_has_class("value")}]')
+            for title, value in zip(info_titles, info_values):
+                property_data[title.text_content().strip()] = value.text_content().strip()
+
+        return property_data
+
+    def listing_urls(self, html_content, page_url):
+        root = lxml.html.fromstring(html_content)
+        return [urljoin(page_url, href)
+                for href in root.xpath(f'//*[{_has_class(LISTING_LINK_CLASS)}]/@href') if href]
+
+    def listing_cards(self, html_content, page_url):
+        cards = []
+        for link in lxml.html.fromstring(html_content).xpath(f'//*[{_has_class(LISTING_LINK_CLASS)}]'):
+            if not link.get('href'):
+                continue
+            scope = (link.xpath(f'ancestor::*[{_has_class(CARD_CLASS)}][1]') or [link])[0]
+            texts = {}
+            for field, class_name in CARD_FIELDS.items():
+                element = scope.xpath(f'.//*[{_has_class(class_name)}]')
+                texts[field] = element[0].text_content() if element else None
+            cards.append(_card(urljoin(page_url, link.get('href')), link.get('data-product-id'), texts))
+        return cards
+
+    def last_page(self, html_content):
+        root = lxml.html.fromstring(html_content)
+        pagination = root.xpath(f'//div[{_has_class(PAGINATION_CLASS)}]')
+        if not pagination:
+            return 1
+        return _max_page_number(
+            item.text_content()
+            for item in pagination[0].xpath(f'.//a[{_has_class(PAGINATION_NUMBER_CLASS)}]')
+        )
+
+
+class SelectolaxParser(PropertyParser):
+    """Lexbor-based parse with CSS lookups; fastest when selectolax is installed"""
+    name = 'selectolax'
+
+    def __init__(self):
+        if HTMLParser is None:
+            raise ImportError("selectolax is required for the selectolax parser backend")
+
+    def parse_property(self, html_content, property_url):
+        tree = HTMLParser(html_content)
+        property_data = empty_record(property_url)
+
+        specs_div = tree.css_first(f'div[class="{SPECS_CLASS}"]')
+        if specs_div:
+            titles = specs_div.css('span.re__pr-specs-content-item-title')
+            values = specs_div.css('span.re__pr-specs-content-item-value')
+            for title, value in zip(titles, values):
+                property_data[title.text().strip()] = value.text().strip()
+
+        address = tree.css_first(f'span[class="{ADDRESS_CLASS}"]')
+        if address and address.text().strip():
+            property_data["Địa chỉ"] = address.text().strip()
+
+        map_div = tree.css_first(f'div[class="{MAP_CLASS}"]')
+        if map_div:
+            for node in [map_div] + map_div.css('*'):
+                coords = next((extract_coordinates(value) for value in node.attributes.values()
+                               if value and 'place?q=' in value), None)
+                if coords and coords[0] is not None:
+                    property_data["latitude"], property_data["longitude"] = coords
+                    break
+
+        short_info = tree.css_first(f'div[class="{SHORT_INFO_CLASS}"]')
+        if short_info:
+            info_titles = short_info.css('span.title')
+            info_values = short_info.css('span.value')
+            for title, value in zip(info_titles, info_values):
+                property_data[title.text().strip()] = value.text().strip()
+
+        return property_data
+
+    def listing_urls(self, html_content, page_url):
+        tree = HTMLParser(html_content)
+        return [urljoin(page_url, node.attributes.get('href'))
+                for node in tree.css('.' + LISTING_LINK_CLASS) if node.attributes.get('href')]
+
+    def listing_cards(self, html_content, page_url):
+        cards = []
+        for link in HTMLParser(html_content).css('.' + LISTING_LINK_CLASS):
+            href = link.attributes.get('href')
+            if not href:
+                continue
+            scope = link.parent
+            while scope is not None and CARD_CLASS not in (scope.attributes.get('class') or '').split():
+                scope = scope.parent
+            scope = scope or link
+            texts = {}
+            for field, class_name in CARD_FIELDS.items():
+                element = scope.css_first('.' + class_name)
+                texts[field] = element.text() if element else None
+            cards.append(_card(urljoin(page_url, href), link.attributes.get('data-product-id'), texts))
+        return cards
+
+    def last_page(self, html_content):
+        pagination = HTMLParser(html_content).css_first('div.' + PAGINATION_CLASS)
+        if not pagination:
+            return 1
+        return _max_page_number(item.text() for item in pagination.css('a.' + PAGINATION_NUMBER_CLASS))
+
+
+PARSERS = {
+    parser.name: parser
+    for parser in (BeautifulSoupParser, StrainedSoupParser, LxmlParser, SelectolaxParser)
+}
+
+
+def available_parsers():
+    names = ['bs4', 'bs4-strainer']
+    if lxml is not None:
+        names.append('lxml')
+    if HTMLParser is not None:
+        names.append('selectolax')
+    return names
+
+
+def get_parser(parser=None):
+    """Return a parser instance; by name, or the fastest installed backend by default"""
+    if isinstance(parser, PropertyParser):
+        return parser
+    if parser is None:
+        parser = available_parsers()[-1]
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown parser backend: {parser} (choose from {', '.join(PARSERS)})")
+    return PARSERS[parser]()
@@ -0,0 +1,279 @@
+# pipeline.py
+from queue import Queue
+from threading import Condition, Event, Lock, Thread
+import logging
+import random
+import time
+
+_STOP = object()
+PAGE, DETAIL = "page", "detail"
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter: the retry after failed attempt n waits
+    base_delay * 2**(n-1) seconds, capped at max_delay and scaled by a random
+    factor in [1 - jitter, 1 + jitter] so failed URLs do not come back in lockstep.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=2.0, max_delay=60.0, jitter=0.5, rng=None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class FailedRecord(Exception):
+    """
+    Raised by handle_detail for a record that should be retried (e.g. scraped from a
+    block page); if every attempt fails the last record is written anyway.
+    """
+
+    def __init__(self, message, record):
+        super().__init__(message)
+        self.record = record
+
+
+class ScrapeProgress:
+    """
+    Thread-safe progress counters of one scrape run, read by UIs while it runs.
+    Pages are counted as they are planned and scraped; listings as they are queued
+    for the detail stage and finished (failed listings also count as errors).
+    """
+
+    def __init__(self):
+        self.pages_total = 0
+        self.pages_done = 0
+        self.listings_total = 0
+        self.listings_done = 0
+        self.records = 0
+        self.errors = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self._lock = Lock()
+
+    def add_pages(self, count):
+        with self._lock:
+            self.pages_total += count
+
+    def add_listings(self, count):
+        with self._lock:
+            self.listings_total += count
+
+    def page_done(self, listings=0, failed=False):
+        with self._lock:
+            self.pages_done += 1
+            self.listings_total += listings
+            self.errors += failed
+
+    def listing_done(self, ok=True):
+        with self._lock:
+            self.listings_done += 1
+            self.records += ok
+            self.errors += not ok
+
+    def cards_done(self, count):
+        """Listings written straight from their cards, without a detail stage"""
+        with self._lock:
+            self.listings_total += count
+            self.listings_done += count
+            self.records += count
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def as_dict(self):
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            rate = self.listings_done / elapsed if elapsed > 0 else 0.0
+            # Listings still to come: queued ones plus an estimate for unscraped pages
+            per_page = self.listings_total / self.pages_done if self.pages_done else 0
+            remaining = (self.listings_total - self.listings_done
+                         + (self.pages_total - self.pages_done) * per_page)
+            return {
+                "pages_total": self.pages_total, "pages_done": self.pages_done,
+                "listings_total": self.listings_total, "listings_done": self.listings_done,
+                "records": self.records, "errors": self.errors,
+                "elapsed": elapsed, "listings_per_sec": rate,
+                "eta_seconds": remaining / rate if rate and self.finished_at is None else None,
+                "fraction": (self.listings_done / (self.listings_done + remaining)
+                             if self.listings_done + remaining else 0.0),
+            }
+
+
+class ScrapePipeline:
+    """
+    Two-stage producer/consumer pipeline: listing pages -> detail pages.
+    Any idle detail worker picks up the next detail URL, and the bounded detail
+    queue makes the listing stage wait when the detail stage falls behind.
+    The page queue is unbounded so listing workers can add pages while running.
+
+    handle_page(page_url) returns the detail URLs found on a listing page; it may
+    call add_pages() for listing pages it discovers.
+    handle_detail(detail_url) returns a record (or None); records go to on_record.
+    Setting cancel_event stops the producer and makes workers drain their queues
+    without processing, so run() returns promptly.
+
+    A URL whose handler raises is put back on its queue after retry_policy's
+    backoff, so any idle worker (and a fresh pooled driver) takes the retry.
+    An error with a true `permanent` attribute (e.g. FetchError for a 404) is not retried.
+    on_failure(stage, url, error, attempts, final) is called for every failed
+    attempt; final is True once the URL has run out of attempts.
+    """
+
+    def __init__(self, handle_page, handle_detail, on_record,
+                 listing_workers=1, detail_workers=2, queue_size=100, cancel_event=None,
+                 retry_policy=None, on_failure=None):
+        self.handle_page = handle_page
+        self.handle_detail = handle_detail
+        self.on_record = on_record
+        self.listing_workers = max(1, listing_workers)
+        self.detail_workers = max(1, detail_workers)
+        self.page_queue = Queue()
+        self.detail_queue = Queue(maxsize=queue_size)
+        self.cancel_event = cancel_event or Event()
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=1)
+        self.on_failure = on_failure
+        self._attempts = {}
+        self._waiting = {PAGE: 0, DETAIL: 0}  # retries sleeping before going back on the queue
+        self._retry_cond = Condition()
+
+    def _listing_worker(self):
+        while True:
+            page_url = self.page_queue.get()
+            if page_url is _STOP:
+                self.page_queue.task_done()
+                return
+            if self.cancel_event.is_set():
+                self.page_queue.task_done()
+                continue
+            try:
+                for detail_url in self.handle_page(page_url) or []:
+                    self.detail_queue.put(detail_url)
+            except Exception as e:
+                self._failed(PAGE, page_url, e)
+            finally:
+                self.page_queue.task_done()
+
+    def _detail_worker(self):
+        while True:
+            detail_url = self.detail_queue.get()
+            if detail_url is _STOP:
+                self.detail_queue.task_done()
+                return
+            if self.cancel_event.is_set():
+                self.detail_queue.task_done()
+                continue
+            try:
+                record = self.handle_detail(detail_url)
+                if record:
+                    self.on_record(record)
+            except Exception as e:
+                self._failed(DETAIL, detail_url, e)
+            finally:
+                self.detail_queue.task_done()
+
+    def _failed(self, stage, url, error):
+        with self._retry_cond:
+            attempts = self._attempts[stage, url] = self._attempts.get((stage, url), 0) + 1
+        final = attempts >= self.retry_policy.max_attempts or getattr(error, "permanent", False)
+        if not final and self.cancel_event.is_set():
+            logging.error(f"Error processing {stage} {url}, not retried as the run is cancelled: {str(error)}")
+            return
+        if final:
+            logging.error(f"Error processing {stage} {url}, giving up after {attempts} attempts: {str(error)}")
+            record = getattr(error, "record", None)
+            if record:
+                try:
+                    self.on_record(record)
+                except Exception as e:
+                    logging.error(f"Error writing record of {url}: {str(e)}")
+        else:
+            delay = self.retry_policy.delay(attempts)
+            logging.warning(f"Error processing {stage} {url} (attempt {attempts}), "
+                            f"retrying in {delay:.1f}s: {str(error)}")
+            self._retry_later(stage, url, delay)
+        if self.on_failure:
+            try:
+                self.on_failure(stage, url, error, attempts, final)
+            except Exception as e:
+                logging.error(f"Error recording failure of {url}: {str(e)}")
+
+    def _retry_later(self, stage, url, delay):
+        queue = self.page_queue if stage == PAGE else self.detail_queue
+        with self._retry_cond:
+            self._waiting[stage] += 1
+
+        def requeue():
+            try:
+                if not self.cancel_event.wait(delay):
+                    queue.put(url)
+            finally:
+                with self._retry_cond:
+                    self._waiting[stage] -= 1
+                    self._retry_cond.notify_all()
+
+        Thread(target=requeue, name=f"retry-{stage}", daemon=True).start()
+
+    def _drain(self, stage):
+        """Wait until a stage's queue is empty and none of its retries are still sleeping"""
+        queue = self.page_queue if stage == PAGE else self.detail_queue
+        while True:
+            queue.join()
+            with self._retry_cond:
+                while self._waiting[stage]:
+                    self._retry_cond.wait()
+            if not queue.unfinished_tasks:
+                return
+
+    def _produce(self, page_urls, detail_urls):
+        try:
+            for detail_url in detail_urls:
+                if self.cancel_event.is_set():
+                    return
+                self.detail_queue.put(detail_url)
+            for page_url in page_urls:
+                if self.cancel_event.is_set():
+                    return
+                self.page_queue.put(page_url)
+        except Exception as e:
+            logging.error(f"Error producing page URLs: {str(e)}")
+
+    def add_pages(self, page_urls):
+        """Queue more listing pages; called from handle_page they are done before run() returns"""
+        for page_url in page_urls:
+            self.page_queue.put(page_url)
+
+    def run(self, page_urls, detail_urls=()):
+        """
+        Feed page_urls (any iterable, consumed lazily by a producer thread) through both
+        stages and block until drained.
+        detail_urls are queued for the detail stage directly (e.g. left over from a resumed run).
+        """
+        listing_threads = [Thread(target=self._listing_worker, name=f"listing-{i}", daemon=True)
+                           for i in range(self.listing_workers)]
+        detail_threads = [Thread(target=self._detail_worker, name=f"detail-{i}", daemon=True)
+                          for i in range(self.detail_workers)]
+        for t in listing_threads + detail_threads:
+            t.start()
+
+        producer = Thread(target=self._produce, args=(page_urls, detail_urls), name="producer", daemon=True)
+        producer.start()
+        producer.join()
+
+        self._drain(PAGE)
+        for _ in listing_threads:
+            self.page_queue.put(_STOP)
+        for t in listing_threads:
+            t.join()
+
+        self._drain(DETAIL)
+        for _ in detail_threads:
+            self.detail_queue.put(_STOP)
+        for t in detail_threads:
+            t.join()
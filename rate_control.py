@@ -0,0 +1,173 @@
+# rate_control.py
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import logging
+import threading
+import time
+
+from metrics import METRICS
+
+OK, SLOW, ERROR, BLOCKED = "ok", "slow", "error", "blocked"
+NEUTRAL = "neutral"  # finished without telling anything about the host's health
+
+
+class _HostState:
+    def __init__(self, concurrency, rate):
+        self.concurrency = float(concurrency)
+        self.rate = float(rate)
+        self.in_flight = 0
+        self.next_send = 0.0
+        self.cooldown_until = 0.0
+        self.last_decrease = 0.0
+        self.baseline = None  # moving average latency of healthy responses
+        self.slow_streak = 0  # consecutive slow responses
+        self.slow_start = True  # until the first backoff, limits grow per response rather than per round
+        self.ceiling = float("inf")  # just under the rate of the last block; growth stops there
+
+
+class _Ticket:
+    def __init__(self):
+        self.outcome = OK
+
+    def done(self, outcome):
+        self.outcome = outcome
+
+
+class AdaptiveRateLimiter:
+    """
+    AIMD control of page fetches per host, like TCP congestion control.
+    Each host has a limit on in-flight requests and a request rate (requests are
+    spaced 1/rate seconds apart). Healthy responses raise both additively, by about
+    one request and rate_step req/s per round of `limit` responses; until a host's
+    first backoff (slow start) every healthy response raises them by that much, and
+    that first backoff cuts by backoff squared to undo the overshoot. The rate never
+    grows back past 90% of the rate at which the host last blocked us (half of it
+    during slow start). Errors (callers
+    report throttling such as 429/503 as errors or blocks), block/captcha pages and
+    sustained slowness cut both by `backoff`, at most once per latency period so one
+    burst of failures counts once. A response is slow when it takes at least
+    min_slow_seconds and slow_factor x the host's moving average latency, so jitter
+    on a fast host is not slowness; slow_streak slow responses in a row are needed
+    for a backoff. A block also pauses the host for block_cooldown seconds.
+    One limiter is one per-host budget: share it between scrapers that run side by
+    side, and give each of N processes crawling the same hosts share=1/N, which
+    scales the starting and maximum concurrency and rate (and the step) down.
+    """
+
+    def __init__(self, initial_concurrency=4, min_concurrency=1, max_concurrency=32,
+                 initial_rate=8.0, min_rate=0.2, max_rate=50.0, rate_step=1.0,
+                 backoff=0.5, slow_factor=3.0, min_slow_seconds=1.0, slow_streak=3,
+                 block_cooldown=30.0, metrics=None, share=1.0):
+        self.share = share
+        self.initial_concurrency = max(min_concurrency, initial_concurrency * share)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency * share)
+        self.initial_rate = max(min_rate, initial_rate * share)
+        self.min_rate = min_rate
+        self.max_rate = max(min_rate, max_rate * share)
+        self.rate_step = rate_step * share
+        self.backoff = backoff
+        self.slow_factor = slow_factor
+        self.min_slow_seconds = min_slow_seconds
+        self.slow_streak = slow_streak
+        self.block_cooldown = block_cooldown
+        self.metrics = metrics or METRICS
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.initial_concurrency, self.initial_rate)
+        return state
+
+    def acquire(self, host):
+        """Block until host has a free request slot, then until its rate allows the request"""
+        wait_start = time.monotonic()
+        with self._cond:
+            state = self._state(host)
+            while True:
+                now = time.monotonic()
+                if now < state.cooldown_until:
+                    self._cond.wait(state.cooldown_until - now)
+                elif state.in_flight >= int(state.concurrency):
+                    self._cond.wait()
+                else:
+                    break
+            state.in_flight += 1
+            send_at = max(now, state.next_send)
+            state.next_send = send_at + 1.0 / state.rate
+        delay = send_at - now
+        if delay > 0:
+            time.sleep(delay)
+        self.metrics.observe("rate_limit_wait_seconds", time.monotonic() - wait_start)
+
+    def release(self, host, latency, outcome):
+        """Record a finished request and adjust the host's limits"""
+        with self._cond:
+            state = self._state(host)
+            state.in_flight -= 1
+            if outcome == NEUTRAL:
+                self._cond.notify_all()
+                return
+            if outcome == OK and state.baseline is not None and \
+                    latency >= max(self.min_slow_seconds, self.slow_factor * state.baseline):
+                outcome = SLOW
+            now = time.monotonic()
+            state.slow_streak = state.slow_streak + 1 if outcome == SLOW else 0
+            sustained = outcome != SLOW or state.slow_streak >= self.slow_streak
+            if outcome == OK:
+                state.baseline = latency if state.baseline is None else 0.9 * state.baseline + 0.1 * latency
+                step = 1.0 if state.slow_start else 1.0 / state.concurrency
+                state.concurrency = min(self.max_concurrency, state.concurrency + step)
+                state.rate = min(self.max_rate, state.ceiling, state.rate + self.rate_step * step)
+            elif sustained and now - state.last_decrease >= max(latency, state.baseline or 0.0, 1.0):
+                state.last_decrease = now
+                state.slow_streak = 0
+                # Slow start roughly doubles the limits per round, so the host's limit may be
+                # half the current rate: its first backoff cuts twice
+                backoff = self.backoff ** 2 if state.slow_start else self.backoff
+                if outcome == BLOCKED:
+                    limit = state.rate * (self.backoff if state.slow_start else 0.9)
+                    state.ceiling = max(self.min_rate, min(state.ceiling, limit))
+                state.slow_start = False
+                state.concurrency = max(self.min_concurrency, state.concurrency * backoff)
+                state.rate = max(self.min_rate, state.rate * backoff)
+                if outcome == BLOCKED:
+                    state.cooldown_until = now + self.block_cooldown
+                logging.warning(f"{host}: {outcome} response, backing off to {int(state.concurrency)} "
+                                f"concurrent requests at {state.rate:.1f} req/s")
+            concurrency, rate = state.concurrency, state.rate
+            self._cond.notify_all()
+        self.metrics.inc("rate_limit_outcomes_total", outcome=outcome)
+        self.metrics.set("rate_limit_concurrency", int(concurrency), host=host)
+        self.metrics.set("rate_limit_rate", round(rate, 3), host=host)
+
+    @contextmanager
+    def request(self, url):
+        """
+        Hold a request slot for url's host. The block should call ticket.done(outcome)
+        with ok/error/blocked/neutral; an exception counts as an error.
+        """
+        host = urlsplit(url).netloc
+        self.acquire(host)
+        ticket = _Ticket()
+        start = time.monotonic()
+        try:
+            yield ticket
+        except Exception:
+            ticket.outcome = ERROR
+            raise
+        finally:
+            self.release(host, time.monotonic() - start, ticket.outcome)
+
+    def limits(self):
+        """Current {host: (concurrency limit, rate)}"""
+        with self._cond:
+            return {host: (int(state.concurrency), state.rate) for host, state in self._hosts.items()}
+
+
+@contextmanager
+def unlimited(url):
+    """Stand-in for AdaptiveRateLimiter.request when rate control is off"""
+    yield _Ticket()
@@ -0,0 +1,285 @@
+# resource_blocking.py
+from fnmatch import fnmatchcase
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import aiohttp
+
+# CDP Network.ResourceType values a profile can deny or allow
+RESOURCE_TYPES = (
+    "Document", "Stylesheet", "Image", "Media", "Font", "Script", "TextTrack", "XHR", "Fetch",
+    "Prefetch", "EventSource", "WebSocket", "Manifest", "SignedExchange", "Ping",
+    "CSPViolationReport", "Preflight", "Other",
+)
+# File-extension patterns standing in for resource types where the type is unknown:
+# Network.setBlockedURLs (the fallback when interception is unavailable) only matches URLs
+TYPE_PATTERNS = {
+    "Image": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico"],
+    "Media": ["*.mp4", "*.webm", "*.m3u8", "*.mp3"],
+    "Font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"],
+    "Stylesheet": ["*.css"],
+}
+# Everything we read is in the server-rendered DOM, so styling, media, ads, trackers and
+# map/video embeds are dead weight (coordinates come from the map link in the HTML)
+DEFAULT_DENY_TYPES = ("Image", "Media", "Font", "Stylesheet")
+DEFAULT_DENY_PATTERNS = (
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*googleadservices.com*", "*adservice.google.*",
+    "*connect.facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*clarity.ms*",
+    "*analytics.tiktok.com*", "*criteo.*", "*adnxs.com*", "*admicro.vn*", "*ants.vn*",
+    "*google.com/maps/embed*", "*maps.googleapis.com*", "*maps.gstatic.com*",
+    "*youtube.com/embed*", "*ytimg.com*",
+)
+# The anti-bot challenge must load all of its assets to pass
+DEFAULT_ALLOW_PATTERNS = ("*challenges.cloudflare.com*", "*/cdn-cgi/*")
+
+_PAGE_WEIGHT_SCRIPT = """
+const resources = performance.getEntriesByType('resource');
+const navigation = performance.getEntriesByType('navigation')[0];
+let bytes = navigation ? (navigation.transferSize || navigation.encodedBodySize || 0) : 0;
+for (const entry of resources) {
+    bytes += entry.transferSize || entry.encodedBodySize || 0;
+}
+return [resources.length + 1, bytes, resources.map(entry => entry.name)];
+"""
+
+
+class BlockingProfile:
+    """
+    Requests a pooled Chrome never makes. deny_types/allow_types are CDP resource
+    types and deny_patterns/allow_patterns URL wildcards; a request is blocked when
+    it matches a deny entry and no allow entry (allow wins).
+    apply() enforces this with Fetch-domain interception (see RequestInterceptor),
+    which sees each request's resource type. Where interception cannot be set up it
+    falls back to Network.setBlockedURLs with the deny patterns and the deny types'
+    file extensions; that fallback cannot express allow entries.
+    """
+
+    def __init__(self, deny_patterns=DEFAULT_DENY_PATTERNS, allow_patterns=DEFAULT_ALLOW_PATTERNS,
+                 deny_types=DEFAULT_DENY_TYPES, allow_types=(), intercept=True):
+        unknown = (set(deny_types) | set(allow_types)) - set(RESOURCE_TYPES)
+        if unknown:
+            raise ValueError(f"Unsupported resource types: {', '.join(sorted(unknown))}")
+        self.deny_patterns = list(deny_patterns)
+        self.allow_patterns = list(allow_patterns)
+        self.deny_types = [kind for kind in deny_types if kind not in set(allow_types)]
+        self.allow_types = list(allow_types)
+        self.intercept = intercept
+
+    def blocked_patterns(self):
+        """URL wildcards for Network.setBlockedURLs"""
+        patterns = list(self.deny_patterns)
+        for kind in self.deny_types:
+            for pattern in TYPE_PATTERNS.get(kind, []):
+                # Also match versioned URLs such as style.css?v=3
+                patterns += [pattern, pattern + "?*"]
+        return patterns
+
+    def fetch_patterns(self):
+        """Fetch.enable patterns pausing every request that a deny entry may block"""
+        return ([{"urlPattern": "*", "resourceType": kind, "requestStage": "Request"} for kind in self.deny_types]
+                + [{"urlPattern": pattern, "requestStage": "Request"} for pattern in self.deny_patterns])
+
+    def is_blocked(self, url, resource_type=None):
+        """Whether a request for url (of resource_type, if known; else judged by extension) is blocked"""
+        if any(fnmatchcase(url, pattern) for pattern in self.allow_patterns):
+            return False
+        if resource_type is not None:
+            if resource_type in self.allow_types:
+                return False
+            if resource_type in self.deny_types:
+                return True
+        else:
+            path = url.split("?", 1)[0].split("#", 1)[0]
+            if any(fnmatchcase(path, pattern) for kind in self.deny_types for pattern in TYPE_PATTERNS.get(kind, [])):
+                return True
+        return any(fnmatchcase(url, pattern) for pattern in self.deny_patterns)
+
+    def apply(self, driver):
+        """Start blocking on driver; returns the RequestInterceptor, or None with the URL-list fallback"""
+        BlockingProfile.clear(driver)
+        if self.intercept:
+            try:
+                interceptor = RequestInterceptor(driver, self).start()
+                driver._request_interceptor = interceptor
+                return interceptor
+            except Exception as e:
+                logging.warning(f"Request interception unavailable, blocking by URL pattern only: {str(e)}")
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_patterns()})
+        return None
+
+    @staticmethod
+    def clear(driver):
+        interceptor = getattr(driver, "_request_interceptor", None)
+        if interceptor is not None:
+            interceptor.stop()
+            driver._request_interceptor = None
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+
+
+class RequestInterceptor:
+    """
+    Fetch-domain interception of one Chrome tab. Selenium cannot receive CDP events,
+    so this opens its own DevTools websocket to the tab (from the debuggerAddress
+    chromedriver reports) on a background event loop. Requests matching the
+    profile's fetch_patterns() are paused and failed or continued according to
+    profile.is_blocked(url, resourceType). Closing the connection ends the
+    interception.
+    """
+
+    def __init__(self, driver, profile, timeout=10):
+        self.driver = driver
+        self.profile = profile
+        self.timeout = timeout
+        self.blocked = 0
+        self.allowed = 0
+        self.counts = {}  # (resource type, 'blocked' or 'allowed') -> paused requests
+        self._counts_lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._ws = None
+        self._reader = None
+        self._ids = 0
+        self._replies = {}
+
+    def start(self):
+        address = self.driver.capabilities.get("goog:chromeOptions", {}).get("debuggerAddress")
+        if not address:
+            raise RuntimeError("chromedriver reports no DevTools debugger address")
+        target_id = self.driver.execute_cdp_cmd("Target.getTargetInfo", {})["targetInfo"]["targetId"]
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="request-interceptor", daemon=True)
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._connect(f"ws://{address}/devtools/page/{target_id}"), self._loop).result(self.timeout)
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    async def _connect(self, url):
+        self._session = aiohttp.ClientSession()
+        self._ws = await self._session.ws_connect(url, max_msg_size=0)
+        self._reader = asyncio.ensure_future(self._read())
+        await self._send("Fetch.enable", {"patterns": self.profile.fetch_patterns()}, wait=True)
+
+    async def _send(self, method, params, wait=False):
+        self._ids += 1
+        reply = None
+        if wait:
+            reply = self._replies[self._ids] = asyncio.get_running_loop().create_future()
+        await self._ws.send_str(json.dumps({"id": self._ids, "method": method, "params": params}))
+        if wait:
+            message = await reply
+            if "error" in message:
+                raise RuntimeError(f"{method} failed: {message['error']}")
+            return message.get("result")
+
+    async def _read(self):
+        async for message in self._ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(message.data)
+            reply = self._replies.pop(data.get("id"), None)
+            if reply is not None:
+                reply.set_result(data)
+            elif data.get("method") == "Fetch.requestPaused":
+                await self._paused(data["params"])
+        for reply in self._replies.values():
+            if not reply.done():
+                reply.set_result({"error": "DevTools connection closed"})
+
+    def take_counts(self):
+        """counts since the last call"""
+        with self._counts_lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    async def _paused(self, params):
+        resource_type = params.get("resourceType")
+        blocked = self.profile.is_blocked(params["request"]["url"], resource_type)
+        with self._counts_lock:
+            if blocked:
+                self.blocked += 1
+            else:
+                self.allowed += 1
+            key = (resource_type or "Other", "blocked" if blocked else "allowed")
+            self.counts[key] = self.counts.get(key, 0) + 1
+        try:
+            if blocked:
+                await self._send("Fetch.failRequest", {"requestId": params["requestId"],
+                                                       "errorReason": "BlockedByClient"})
+            else:
+                await self._send("Fetch.continueRequest", {"requestId": params["requestId"]})
+        except Exception as e:
+            logging.debug(f"Error answering a paused request: {str(e)}")
+
+    async def _close(self):
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(self.timeout)
+        except Exception as e:
+            logging.debug(f"Error closing the DevTools connection: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+
+def page_weight(driver):
+    """
+    (requests, bytes, resource URLs) the current page loaded, from the Resource Timing
+    API. Cross-origin resources without Timing-Allow-Origin report size 0, so bytes
+    is a lower bound.
+    """
+    requests, size, urls = driver.execute_script(_PAGE_WEIGHT_SCRIPT)
+    return int(requests), int(size), list(urls)
+
+
+def measure_savings(driver, url, profile, wait_for=None):
+    """
+    Load url once without and once with profile, with the browser cache disabled
+    for both loads, and compare requests, bytes (see page_weight) and load time. wait_for(driver) may wait for the page to be
+    ready before it is measured. The driver is left with profile applied.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+    results = {}
+    try:
+        for label, blocking in (("without", None), ("with", profile)):
+            if blocking is None:
+                BlockingProfile.clear(driver)
+            else:
+                blocking.apply(driver)
+            start = time.perf_counter()
+            driver.get(url)
+            if wait_for is not None:
+                wait_for(driver)
+            seconds = time.perf_counter() - start
+            requests, size, urls = page_weight(driver)
+            results[label] = {"requests": requests, "bytes": size, "seconds": round(seconds, 3)}
+            if blocking is None:
+                results["blockable_urls"] = [resource for resource in urls if profile.is_blocked(resource)]
+    finally:
+        driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": False})
+        if "with" not in results:
+            profile.apply(driver)
+    results["requests_saved"] = results["without"]["requests"] - results["with"]["requests"]
+    results["bytes_saved"] = results["without"]["bytes"] - results["with"]["bytes"]
+    results["seconds_saved"] = round(results["without"]["seconds"] - results["with"]["seconds"], 3)
+    logging.info(f"Resource blocking on {url}: {results['requests_saved']} requests, "
+                 f"{results['bytes_saved'] / 1024:.0f} KiB and {results['seconds_saved']:.2f}s saved")
+    return results
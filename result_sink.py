@@ -0,0 +1,326 @@
+# result_sink.py
+import csv
+import glob
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from parsers import BLOCKED_FIELD, PROPERTY_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# JSON object of a record's fields outside the sink's schema (e.g. spec titles the site
+# adds later); read_output turns them back into columns
+EXTRA_FIELD = "extra"
+
+
+class ResultSink:
+    """
+    Thread-safe batching writer for scraped records.
+    Records are written every batch_size records; on_flush(records) is called
+    after each batch is on disk so the run journal can mark them done.
+    Fields outside fieldnames are kept as JSON in the extra column; fields whose
+    name starts with an underscore are the caller's bookkeeping and not written.
+    """
+
+    def __init__(self, path, fieldnames=PROPERTY_FIELDS, batch_size=50, on_flush=None):
+        self.path = path
+        self.fieldnames = [name for name in fieldnames if name != EXTRA_FIELD] + [EXTRA_FIELD]
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.count = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def row(self, record):
+        """The record as written: schema fields, plus the rest as JSON under extra"""
+        row = {name: record.get(name) for name in self.fieldnames if name != EXTRA_FIELD}
+        extra = {name: value for name, value in record.items()
+                 if name not in row and not name.startswith("_")}
+        row[EXTRA_FIELD] = json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+        return row
+
+    def write(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch, self._buffer = self._buffer, []
+            self._write_batch(batch)
+            self.count += len(batch)
+        if self.on_flush:
+            self.on_flush(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            if batch:
+                self._write_batch(batch)
+                self.count += len(batch)
+        if batch and self.on_flush:
+            self.on_flush(batch)
+
+    def close(self):
+        self.flush()
+
+    def _write_batch(self, batch):
+        raise NotImplementedError
+
+
+class CsvResultSink(ResultSink):
+    """Append-only CSV; the UTF-8 BOM is written once when the file is created"""
+
+    def close(self):
+        self.flush()
+        if not os.path.exists(self.path):
+            with self._lock:
+                self._write_batch([])
+
+    def _write_batch(self, batch):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        # A resumed run keeps appending in the columns its file was created with
+        fieldnames = self.fieldnames if new_file else self._header()
+        with open(self.path, 'a', encoding='utf-8-sig' if new_file else 'utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerows(self.row(record) for record in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _header(self):
+        with open(self.path, encoding='utf-8-sig', newline='') as f:
+            return next(csv.reader(f), self.fieldnames)
+
+
+class ParquetResultSink(ResultSink):
+    """
+    Parquet file with one row group per batch. A Parquet file cannot be appended
+    to once closed, so a resumed run writes to the next free `.partN` file.
+    """
+
+    def __init__(self, path, fieldnames=PROPERTY_FIELDS, batch_size=500, on_flush=None):
+        if pa is None:
+            raise ImportError("pyarrow is required for Parquet output")
+        super().__init__(path, fieldnames, batch_size, on_flush)
+        self.schema = pa.schema([
+            (name, pa.float64() if name in ("latitude", "longitude")
+             else pa.bool_() if name == BLOCKED_FIELD else pa.string())
+            for name in self.fieldnames
+        ])
+        self._writer = None
+
+    def _next_part_path(self):
+        stem, ext = os.path.splitext(self.path)
+        if not os.path.exists(self.path):
+            return self.path
+        part = 1
+        while os.path.exists(f"{stem}.part{part}{ext}"):
+            part += 1
+        return f"{stem}.part{part}{ext}"
+
+    def _write_batch(self, batch):
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._next_part_path(), self.schema, compression='zstd')
+        rows = [self.row(record) for record in batch]
+        columns = {name: [row[name] for row in rows] for name in self.fieldnames}
+        self._writer.write_table(pa.table(columns, schema=self.schema))
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class RunJournal:
+    """
+    Append-only JSON-lines log of a run's progress:
+      page / page_done      listing pages planned and fully queued
+      base_done             base URL whose pagination has been discovered
+      detail / detail_done  detail URLs queued and durably written
+    Reloading the journal gives the remaining work for a resumed run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        self.pages_done = set()
+        self.bases_done = set()
+        self.details = set()
+        self.details_done = set()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn final line after a crash
+                self._apply(entry)
+
+    def _apply(self, entry):
+        kind, url = entry.get("kind"), entry.get("url")
+        if kind == "page":
+            self.pages[url] = entry.get("base")
+        elif kind == "page_done":
+            self.pages_done.add(url)
+        elif kind == "base_done":
+            self.bases_done.add(url)
+        elif kind == "detail":
+            self.details.add(url)
+        elif kind == "detail_done":
+            self.details_done.add(url)
+
+    def _append(self, entries):
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+                self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def plan_pages(self, page_bases):
+        self._append({"kind": "page", "url": url, "base": base} for url, base in page_bases.items())
+
+    def mark_base_discovered(self, base_url):
+        self._append([{"kind": "base_done", "url": base_url}])
+
+    def mark_page_done(self, page_url, detail_urls):
+        entries = [{"kind": "detail", "url": url} for url in detail_urls]
+        entries.append({"kind": "page_done", "url": page_url})
+        self._append(entries)
+
+    def mark_details_done(self, detail_urls):
+        self._append({"kind": "detail_done", "url": url} for url in detail_urls)
+
+    def pending_pages(self):
+        return [url for url in self.pages if url not in self.pages_done]
+
+    def pending_details(self):
+        return sorted(self.details - self.details_done)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class DeadLetterFile:
+    """
+    JSON lines of URLs that failed every retry: stage ('page' or 'detail'), url, the
+    base URL of listing pages, attempts and the last error. A URL is listed again each
+    time a run gives up on it; entries() keeps the latest entry per URL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, stage, url, error, attempts, base=None):
+        entry = {"stage": stage, "url": url, "base": base, "attempts": attempts,
+                 "error": f"{type(error).__name__}: {error}", "time": time.time()}
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self):
+        """{url: latest entry}"""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["url"]] = entry
+        return entries
+
+    def keep(self, urls):
+        """Rewrite the file with only the entries of urls, e.g. those a re-run still failed on"""
+        urls = set(urls)
+        with self._lock:
+            entries = [entry for url, entry in self.entries().items() if url in urls]
+            if not entries:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+
+def output_paths(local_path):
+    """Files holding a run's streamed output: local_path plus, for Parquet, any resumed .partN files"""
+    if not local_path.endswith('.parquet'):
+        return [local_path] if os.path.exists(local_path) else []
+    stem = local_path[:-len('.parquet')]
+    return [path for path in [local_path] + sorted(glob.glob(f"{stem}.part*.parquet"))
+            if os.path.exists(path)]
+
+
+def read_output(local_path):
+    """Read a run's streamed output (including any resumed .partN files) into a DataFrame"""
+    if local_path.endswith('.parquet'):
+        paths = output_paths(local_path)
+        if not paths:
+            return pd.DataFrame(columns=PROPERTY_FIELDS)
+        return drop_superseded_blocked(expand_extra(
+            pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)))
+
+    df = pd.read_csv(local_path, encoding='utf-8-sig', dtype=str)
+    for column in ("latitude", "longitude"):
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return drop_superseded_blocked(expand_extra(df))
+
+
+def expand_extra(df):
+    """Replace the extra JSON column with one column per field found in it"""
+    if EXTRA_FIELD not in df:
+        return df
+    extra = [json.loads(value) if isinstance(value, str) and value else {} for value in df[EXTRA_FIELD]]
+    df = df.drop(columns=EXTRA_FIELD)
+    if not any(extra):
+        return df
+    extra = pd.DataFrame(extra, index=df.index)
+    return df.join(extra[[name for name in extra.columns if name not in df]])
+
+
+def drop_superseded_blocked(df):
+    """
+    Drop rows scraped from block pages once the listing has been scraped successfully
+    (or blocked again later), so retries do not leave duplicates behind.
+    """
+    if BLOCKED_FIELD not in df or 'url' not in df or df.empty:
+        return df
+    blocked = df[BLOCKED_FIELD].astype('string').str.lower().eq('true').fillna(False).astype(bool)
+    df[BLOCKED_FIELD] = blocked
+    if not blocked.any():
+        return df
+    scraped_urls = df.loc[~blocked, 'url']
+    superseded = blocked & (df['url'].isin(scraped_urls) | df.duplicated('url', keep='last'))
+    return df[~superseded].reset_index(drop=True)
@@ -0,0 +1,144 @@
+# scrape_jobs.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import itertools
+import logging
+import threading
+import time
+
+from metrics import Metrics
+from pipeline import ScrapeProgress
+from rate_control import AdaptiveRateLimiter
+
+QUEUED, RUNNING, CANCELLING, CANCELLED, DONE, FAILED = (
+    "queued", "running", "cancelling", "cancelled", "done", "failed")
+FINISHED = (CANCELLED, DONE, FAILED)
+
+
+class ScrapeJob:
+    """One background scrape_properties call and its live progress"""
+
+    def __init__(self, job_id, urls, run_id, options):
+        self.id = job_id
+        self.urls = list(urls)
+        self.run_id = run_id
+        self.options = options
+        self.status = QUEUED
+        self.progress = ScrapeProgress()
+        self.cancel_event = threading.Event()
+        self.submitted_at = time.time()
+        self.error = None
+        self.output_path = None
+        self.typed_path = None
+        self.records = None
+        self.metrics = None
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def as_dict(self):
+        return dict(self.progress.as_dict(), id=self.id, status=self.status, run_id=self.run_id,
+                    urls=self.urls, error=self.error, output_path=self.output_path,
+                    typed_path=self.typed_path)
+
+
+class JobManager:
+    """
+    Runs scrape jobs on a thread pool owned by the manager rather than by a UI
+    request, so jobs keep going while the Streamlit script reruns. At most
+    max_workers jobs run at once; the rest wait in the executor's queue.
+    scraper_factory(**kwargs) builds a fresh PropertyScraper for every job, with its
+    own Metrics registry (unless scraper_kwargs passes one) so concurrent jobs do
+    not count into each other's metrics. All jobs share rate_limiter (one is
+    created by default), so running jobs side by side does not multiply the
+    request rate any host sees; its own metrics go to the shared registry.
+    """
+
+    def __init__(self, max_workers=2, scraper_factory=None, keep_finished=20, rate_limiter=None):
+        if scraper_factory is None:
+            from scraper import PropertyScraper
+            scraper_factory = PropertyScraper
+        self.scraper_factory = scraper_factory
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="scrape-job")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, urls, run_id=None, scraper_kwargs=None, **options):
+        """
+        Queue scrape_properties(urls, run_id=..., **options) on a new scraper built
+        with scraper_kwargs; returns the ScrapeJob. run_id defaults to a unique
+        timestamp so concurrent jobs never share output files or journals.
+        """
+        with self._lock:
+            job_id = next(self._ids)
+            run_id = run_id or f"{datetime.now().strftime('%d_%m_%Y_%H_%M_%S')}_job{job_id}"
+            job = ScrapeJob(job_id, urls, run_id, options)
+            self._jobs[job_id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, scraper_kwargs or {})
+        return job
+
+    def _run(self, job, scraper_kwargs):
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        job.progress.started_at = time.time()
+        scraper = None
+        try:
+            defaults = {"metrics": Metrics()}
+            if scraper_kwargs.get("adaptive_rate", True) and not scraper_kwargs.get("replay"):
+                defaults["rate_limiter"] = self.rate_limiter
+            scraper = self.scraper_factory(**dict(defaults, **scraper_kwargs))
+            df = scraper.scrape_properties(job.urls, run_id=job.run_id, progress=job.progress,
+                                           cancel_event=job.cancel_event, **job.options)
+            job.records = len(df)
+            job.output_path = scraper.last_output_path
+            job.typed_path = scraper.last_typed_path
+            job.metrics = scraper.last_run_metrics
+            job.status = CANCELLED if job.cancel_event.is_set() else DONE
+        except Exception as e:
+            logging.error(f"Scrape job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.progress.finish()
+            if scraper is not None:
+                try:
+                    scraper.close()
+                except Exception as e:
+                    logging.error(f"Error closing scraper of job {job.id}: {str(e)}")
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.status == RUNNING:
+            job.status = CANCELLING
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All known jobs, newest first"""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.id, reverse=True)
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.id)
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            for job in self.jobs():
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True)
@@ -1,211 +1,743 @@
 # scraper.py
-from seleniumbase import Driver
-from threading import Thread
-from bs4 import BeautifulSoup
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from driver_pool import DriverPool
+from http_fetcher import FetchError, HttpFetcher, is_blocked_page
+from listing_index import card_fingerprint
+from metrics import METRICS, format_summary
+from normalize import write_typed_parquet
+from page_cache import PageNotCached
+from parsers import (BLOCKED_FIELD, CARD_RECORD_FIELDS, PROPERTY_FIELDS, SOURCE_FIELD, card_record,
+                     extract_coordinates, get_parser)
+from pipeline import PAGE, FailedRecord, RetryPolicy, ScrapePipeline, ScrapeProgress
+from resource_blocking import measure_savings, page_weight
+from rate_control import BLOCKED, NEUTRAL, SLOW, AdaptiveRateLimiter, unlimited
+from result_sink import CsvResultSink, DeadLetterFile, ParquetResultSink, RunJournal, output_paths, read_output
 import pandas as pd
 import json
 import logging
 import os
 import re
+import threading
 import time
 
+# Elements whose presence means a page has rendered the parts we extract
+LISTING_READY_SELECTOR = '.js__product-link-for-product-id'
+DETAIL_READY_SELECTOR = '.re__pr-specs-content, .re__pr-short-info'
+SCRAPE_MODES = ('detail', 'cards', 'hydrate')
+# Seconds a cached detail page is reused in live runs
+DETAIL_CACHE_TTL = 24 * 3600
+
+
+class CardPages:
+    """
+    Listing pages whose card records are not all on disk yet. Each card record
+    carries its page under PAGE_KEY (underscore keys are not written by the sink);
+    a page is only marked done in the journal once all of its records are flushed.
+    """
+
+    PAGE_KEY = "_page"
+
+    def __init__(self):
+        self._pending = {}  # page URL -> [records not yet flushed, its detail URLs]
+        self._lock = threading.Lock()
+
+    def add(self, page_url, records, detail_urls):
+        for record in records:
+            record[self.PAGE_KEY] = page_url
+        with self._lock:
+            self._pending[page_url] = [len(records), detail_urls]
+
+    def flushed(self, records):
+        """(page URL, detail URLs) of every page this flushed batch completes"""
+        done = []
+        with self._lock:
+            for record in records:
+                entry = self._pending.get(record.get(self.PAGE_KEY))
+                if entry is None:
+                    continue
+                entry[0] -= 1
+                if not entry[0]:
+                    done.append((record[self.PAGE_KEY], self._pending.pop(record[self.PAGE_KEY])[1]))
+        return done
+
+
+def build_page_url(base_url, page):
+    """URL of listing page `page` of base_url (page 1 is base_url itself)"""
+    if page == 1:
+        return base_url
+    if '/p' in base_url:
+        # If URL already has a page number, replace it
+        return re.sub(r'/p\d+', f'/p{page}', base_url)
+    # Add page number before any query parameters
+    if '?' in base_url:
+        base, params = base_url.split('?', 1)
+        return f"{base}/p{page}?{params}"
+    return f"{base_url}/p{page}"
+
+
 class PropertyScraper:
-    def __init__(self, gcs_module=None):
+    def __init__(self, gcs_module=None, fetcher=None, use_http=True, driver_pool=None,
+                 page_ready_timeout=10, parser=None, listing_index=None, page_cache=None,
+                 replay=False, browser_fallback=True, metrics=None, rate_limiter=None,
+                 adaptive_rate=True, retry_policy=None, listing_store=None, duplicate_detector=None,
+                 listing_cache_ttl=0, detail_cache_ttl=DETAIL_CACHE_TTL, measure_blocking=False):
+        """
+        fetcher: HttpFetcher used for static pages; one is created when use_http is True.
+        driver_pool: DriverPool for Selenium, which is only used when the HTTP response
+        is a challenge page (or always, with use_http=False). Browsers start on first use;
+        a pool created here is grown to one browser per listing and detail worker.
+        measure_blocking: in browser-only runs (use_http=False), load the first page of
+        each kind twice more, without and with the pool's blocking profile, to measure
+        what blocking saves (see measure_blocking_savings). Off by default: the extra
+        loads cost time and look bot-like, so it is never done on a challenge fallback.
+        What blocking does on every page is counted anyway, as
+        browser_requests_{blocked,allowed}_total per resource type.
+        page_ready_timeout: max seconds to wait for a browser page's ready selector.
+        parser: extraction backend name from parsers.PARSERS (default: fastest installed).
+        listing_index: ListingIndex of already scraped listings; when given, unchanged
+        listings are not fetched again.
+        page_cache: PageCache consulted before any fetch and filled with fetched pages.
+        listing_cache_ttl: seconds a cached listing (and pagination) page may be reused
+        outside replay mode; 0 always fetches them again, so new listings and pages show
+        up.
+        detail_cache_ttl: seconds a cached detail page may be reused outside replay mode
+        (0 never reuses them). Listings the listing_index reports as new or changed are
+        always fetched again.
+        replay: serve every page from page_cache only (no network, no browsers).
+        browser_fallback: load challenge pages served over HTTP in a browser; when False
+        they raise FetchError instead. Other failed fetches (connection errors, 4xx, 5xx)
+        always raise FetchError, which retry_policy retries unless it is a permanent 4xx.
+        metrics: Metrics registry for per-stage timings and counters (default: shared registry).
+        rate_limiter: AdaptiveRateLimiter shared by all fetches; one is created when
+        adaptive_rate is True. It caps in-flight requests and request rate per host and
+        backs off on errors, slow responses and block pages, so worker counts are an
+        upper bound rather than the actual concurrency.
+        retry_policy: RetryPolicy for listing and detail pages that fail to load or parse
+        (default: 3 attempts with exponential backoff; 1 attempt in replay mode).
+        listing_store: ListingStore that each finished run's output is compacted into.
+        duplicate_detector: DuplicateDetector that adds a cluster_id column (probable
+        reposts share one) to each run's returned DataFrame and typed Parquet.
+        """
+        if replay and page_cache is None:
+            raise ValueError("replay mode needs a page_cache")
         self.gcs = gcs_module
-        
-    def create_chrome_driver(self, num_chrome):
-        chrome_drivers = []
-        for _ in range(num_chrome):
-            driver = Driver(uc_cdp=True, incognito=True, block_images=True, headless=True)
-            driver.set_page_load_timeout(30)
-            chrome_drivers.append(driver)
-        return chrome_drivers
+        self.metrics = metrics or METRICS
+        if rate_limiter is None and adaptive_rate and not replay:
+            rate_limiter = AdaptiveRateLimiter(metrics=self.metrics)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=1 if replay else 3)
+        use_http = use_http and not replay
+        self.fetcher = fetcher if fetcher is not None else (HttpFetcher() if use_http else None)
+        # A pool created here is sized to each run's worker count (see scrape_properties)
+        self._owns_pool = driver_pool is None
+        self.driver_pool = driver_pool if driver_pool is not None else DriverPool(metrics=self.metrics)
+        self.page_ready_timeout = page_ready_timeout
+        self.parser = get_parser(parser)
+        self.listing_index = listing_index
+        self.listing_store = listing_store
+        self.duplicate_detector = duplicate_detector
+        self.page_cache = page_cache
+        self.listing_cache_ttl = listing_cache_ttl
+        self.detail_cache_ttl = detail_cache_ttl
+        self.replay = replay
+        self.browser_fallback = browser_fallback
+        self.last_run_id = None
+        self.last_output_path = None
+        self.last_typed_path = None
+        self.last_run_metrics = None
+        self.last_progress = None
+        self.last_dead_letters = []  # dead-letter entries left by the last run
+        self.measure_blocking = measure_blocking
+        self.blocking_savings = {}  # kind -> measure_savings() comparison
+        self._measured_kinds = set()  # kinds measured or being measured
+        self._measure_lock = threading.Lock()
 
-    def extract_coordinates(self, html_content):
-        pattern = r'place\?q=([-+]?\d*\.\d+),([-+]?\d*\.\d+)'
-        match = re.search(pattern, html_content)
-        if match:
-            latitude = float(match.group(1))
-            longitude = float(match.group(2))
-            return [latitude, longitude]
-        else:
-            return [None, None]
 
-    def safe_find(self, soup, selector, class_name, default=None):
+    def close_drivers(self):
+        self.driver_pool.close()
+
+    def close(self):
+        self.close_drivers()
+        if self.fetcher is not None:
+            self.fetcher.close()
+
+    def wait_until_ready(self, chrome_driver, ready_selector):
+        """Wait until ready_selector is present; returns seconds waited"""
+        start = time.perf_counter()
         try:
-            element = soup.find(selector, class_=class_name)
-            return element.text.strip() if element else default
-        except Exception:
-            return default
+            WebDriverWait(chrome_driver, self.page_ready_timeout, poll_frequency=0.1).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ready_selector))
+            )
+        except TimeoutException:
+            logging.warning(f"'{ready_selector}' not present after {self.page_ready_timeout}s "
+                            f"on {chrome_driver.current_url}")
+        return time.perf_counter() - start
 
-    def get_pagination_urls(self, base_url, max_pages=None):
-        """Get URLs for all pages"""
+    def ready_time_summary(self, since=None):
+        """Seconds-to-ready stats per page kind from the browser_ready_seconds histogram, optionally since a snapshot"""
+        earlier = (since or {}).get("histograms", {})
+        summary = {}
+        for (name, labels), histogram in self.metrics.snapshot()["histograms"].items():
+            if name == "browser_ready_seconds":
+                delta = histogram.minus(earlier.get((name, labels)))
+                if delta.count:
+                    summary[dict(labels)["kind"]] = delta.as_dict()
+        return summary
+
+    def fetch_with_driver(self, url, chrome_driver, ready_selector=DETAIL_READY_SELECTOR):
+        kind = 'listing' if ready_selector == LISTING_READY_SELECTOR else 'detail'
+        if self._claim_measurement(kind):
+            try:
+                self.measure_blocking_savings(url, kind, chrome_driver)
+            except Exception as e:
+                logging.warning(f"Could not measure resource blocking savings on {url}: {str(e)}")
+        start = time.perf_counter()
+        chrome_driver.get(url)
+        self.wait_until_ready(chrome_driver, ready_selector)
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("browser_ready_seconds", elapsed, kind=kind)
+        logging.debug(f"{kind} page ready in {elapsed:.2f}s: {url}")
+        self.record_page_weight(chrome_driver, kind)
+        return chrome_driver.page_source
+
+    def record_page_weight(self, chrome_driver, kind):
+        """
+        Count the requests and bytes a browser page loaded (bytes only of resources
+        whose size Resource Timing exposes) and the requests interception blocked and
+        let through, per resource type
+        """
+        interceptor = getattr(chrome_driver, "_request_interceptor", None)
+        if interceptor is not None:
+            for (resource_type, decision), count in interceptor.take_counts().items():
+                self.metrics.inc(f"browser_requests_{decision}_total", count, kind=kind, type=resource_type)
         try:
-            driver = Driver(uc_cdp=True, incognito=True, block_images=True, headless=True)
-            driver.get(base_url)
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            
-            # Find the last page number
-            pagination = soup.find('div', class_='re__pagination')
-            if pagination:
-                page_items = pagination.find_all('a', class_='re__pagination-number')
-                if page_items:
-                    try:
-                        last_page = max([int(item.text) for item in page_items if item.text.isdigit()])
-                    except ValueError:
-                        last_page = 1
-                else:
-                    last_page = 1
+            requests, size, _ = page_weight(chrome_driver)
+        except Exception as e:
+            logging.debug(f"Could not read page weight: {str(e)}")
+            return
+        self.metrics.inc("browser_requests_total", requests, kind=kind)
+        self.metrics.inc("browser_bytes_total", size, kind=kind)
+
+    def _claim_measurement(self, kind):
+        """Whether the caller should measure blocking savings on this page kind (true once per kind)"""
+        if not self.measure_blocking or self.fetcher is not None or self.driver_pool.blocking_profile is None:
+            return False
+        with self._measure_lock:
+            if kind in self._measured_kinds:
+                return False
+            self._measured_kinds.add(kind)
+            return True
+
+    def measure_blocking_savings(self, url, kind='detail', chrome_driver=None):
+        """
+        Load url without and with the pool's blocking profile, both with the browser
+        cache disabled, and record the difference for this page kind ('listing' or
+        'detail') in blocking_savings and the browser_blocking_*_saved gauges. Uses
+        chrome_driver, or a leased pool driver. Returns measure_savings()'s comparison.
+        """
+        profile = self.driver_pool.blocking_profile
+        if profile is None:
+            raise ValueError("The driver pool has no resource blocking profile")
+        ready_selector = LISTING_READY_SELECTOR if kind == 'listing' else DETAIL_READY_SELECTOR
+        wait_for = lambda d: self.wait_until_ready(d, ready_selector)
+        if chrome_driver is not None:
+            results = measure_savings(chrome_driver, url, profile, wait_for=wait_for)
+        else:
+            with self.driver_pool.lease() as driver:
+                results = measure_savings(driver, url, profile, wait_for=wait_for)
+        with self._measure_lock:
+            self._measured_kinds.add(kind)
+            self.blocking_savings[kind] = results
+        self.metrics.set("browser_blocking_requests_saved", results["requests_saved"], kind=kind)
+        self.metrics.set("browser_blocking_bytes_saved", results["bytes_saved"], kind=kind)
+        self.metrics.set("browser_blocking_seconds_saved", results["seconds_saved"], kind=kind)
+        return results
+
+    def fetch_html(self, url, chrome_driver=None, ready_selector=DETAIL_READY_SELECTOR, refresh=False):
+        """
+        Fetch page HTML over HTTP, falling back to Selenium on anti-bot pages only.
+        ready_selector is what the browser waits for before reading the DOM.
+        Pages are served from page_cache when present (within listing_cache_ttl or
+        detail_cache_ttl, and never with refresh); in replay mode a miss raises
+        PageNotCached.
+        """
+        if self.page_cache is not None:
+            max_age = self.listing_cache_ttl if ready_selector == LISTING_READY_SELECTOR else self.detail_cache_ttl
+            if self.replay or (max_age and not refresh):
+                html_content = self.page_cache.get(url, ignore_ttl=self.replay, max_age=max_age)
+                if html_content is not None:
+                    self.metrics.inc("pages_total", source="cache", outcome="ok")
+                    return html_content
+            if self.replay:
+                raise PageNotCached(f"{url} is not in the page cache")
+
+        html_content = self._fetch_live(url, chrome_driver, ready_selector)
+        if self.page_cache is not None and not is_blocked_page(html_content):
+            self.page_cache.put(url, html_content)
+        return html_content
+
+    def _request_slot(self, url):
+        return self.rate_limiter.request(url) if self.rate_limiter is not None else unlimited(url)
+
+    def _fetch_live(self, url, chrome_driver, ready_selector):
+        if self.fetcher is not None:
+            with self._request_slot(url) as ticket:
+                result = self.fetcher.fetch(url)
+                if result.error:
+                    # Timeouts and dropped connections count towards sustained slowness
+                    ticket.done(SLOW)
+                elif result.status != 200 and not result.blocked:
+                    # A 404 or a one-off 500 says nothing about load; 429/503 are block statuses
+                    ticket.done(NEUTRAL)
+                elif result.blocked:
+                    # With a browser to fall back on, the browser's outcome is what counts
+                    ticket.done(NEUTRAL if self.browser_fallback else BLOCKED)
+            self.metrics.observe("fetch_seconds", result.elapsed, source="http")
+            if result.ok:
+                self.metrics.inc("pages_total", source="http", outcome="ok")
+                return result.html
+            if result.error:
+                reason = f"HTTP fetch failed ({result.error})"
+                outcome = "error"
+            elif result.blocked:
+                reason = f"challenge page detected (status {result.status})"
+                outcome = "blocked"
+            else:
+                reason = f"HTTP {result.status}"
+                outcome = f"http_{result.status}"
+            self.metrics.inc("pages_total", source="http", outcome=outcome)
+            if not (result.blocked and self.browser_fallback):
+                raise FetchError(f"{url}: {reason}", status=result.status)
+            logging.info(f"{url}: {reason}, using browser")
+        # The slot is taken first so fetch_seconds covers the page load, not the wait for the limiter
+        with self._request_slot(url) as ticket, self.metrics.timer("fetch_seconds", source="browser"):
+            if chrome_driver is not None:
+                html_content = self.fetch_with_driver(url, chrome_driver, ready_selector)
             else:
-                last_page = 1
-                
-            driver.quit()
+                with self.driver_pool.lease() as driver:
+                    html_content = self.fetch_with_driver(url, driver, ready_selector)
+            if is_blocked_page(html_content):
+                ticket.done(BLOCKED)
+        if is_blocked_page(html_content):
+            logging.warning(f"Browser also received a challenge page for {url}")
+            self.metrics.inc("pages_total", source="browser", outcome="blocked")
+        else:
+            self.metrics.inc("pages_total", source="browser", outcome="ok")
+        return html_content
 
-            # Limit the number of pages if specified
-            if max_pages:
-                last_page = min(last_page, max_pages)
+    def extract_listing_urls(self, html_content, page_url):
+        with self.metrics.timer("parse_seconds", kind="listing"):
+            return self.parser.listing_urls(html_content, page_url)
+
+    def extract_listing_cards(self, html_content, page_url):
+        with self.metrics.timer("parse_seconds", kind="listing"):
+            return self.parser.listing_cards(html_content, page_url)
 
-            # Generate URLs for all pages
-            urls = []
-            for page in range(1, last_page + 1):
-                if page == 1:
-                    urls.append(base_url)
-                else:
-                    if '/p' in base_url:
-                        # If URL already has a page number, replace it
-                        urls.append(re.sub(r'/p\d+', f'/p{page}', base_url))
-                    else:
-                        # Add page number before any query parameters
-                        if '?' in base_url:
-                            base, params = base_url.split('?', 1)
-                            urls.append(f"{base}/p{page}?{params}")
-                        else:
-                            urls.append(f"{base_url}/p{page}")
-            
-            return urls
+    def extract_coordinates(self, html_content):
+        return extract_coordinates(html_content)
+
+    def get_pagination_urls(self, base_url, max_pages=None):
+        """Get URLs for all pages"""
+        try:
+            return self.discover_pages(base_url, max_pages)[1]
         except Exception as e:
             logging.error(f"Error getting pagination URLs: {str(e)}")
             return [base_url]  # Return only the base URL if something goes wrong
 
-    def process_single_property(self, property_url, chrome_driver):
-        # [Previous process_single_property code remains the same]
+    def discover_pages(self, base_url, max_pages=None):
+        """Fetch the first listing page of base_url; returns (its HTML, URLs of all visible pages)"""
+        with self.metrics.timer("stage_seconds", stage="pagination"):
+            html_content = self.fetch_html(base_url, ready_selector=LISTING_READY_SELECTOR)
+            last_page = self.parser.last_page(html_content)
+
+        # Limit the number of pages if specified
+        if max_pages:
+            last_page = min(last_page, max_pages)
+
+        return html_content, [build_page_url(base_url, page) for page in range(1, last_page + 1)]
+
+    def iter_pagination(self, base_urls, max_pages=None, workers=8, prefetched=None):
+        """
+        Discover the pages of all base_urls concurrently (over the pooled HTTP client,
+        or leased browsers) and yield (base_url, page URLs) as each one finishes, so
+        scraping can start before discovery is complete. First-page HTML is stored in
+        the prefetched dict, if given, so it is not fetched twice. A base URL whose
+        discovery fails yields just itself.
+        """
+        base_urls = list(dict.fromkeys(base_urls))
+        if not base_urls:
+            return
+        executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(base_urls))),
+                                      thread_name_prefix="pagination")
         try:
-            chrome_driver.get(property_url)
-            time.sleep(1)  # Reduced delay to 1 second
-            html_content = chrome_driver.page_source
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            property_data = {
-                "Diện tích": None, "Mức giá": None,
-                "Mặt tiền": None, "Đường vào": None,
-                "Hướng nhà": None, "Hướng ban công": None,
-                "Số tầng": None, "Số phòng ngủ": None,
-                "Số toilet": None, "Pháp lý": None,
-                "Nội thất": None, "Ngày đăng": None,
-                "Ngày hết hạn": None, "Loại tin": None,
-                "Mã tin": None, "Địa chỉ": None,
-                "latitude": None, "longitude": None,
-                "url": property_url
-            }
-
-            specs_div = soup.find('div', class_='re__pr-specs-content js__other-info')
-            if specs_div:
-                titles = specs_div.find_all('span', class_='re__pr-specs-content-item-title')
-                values = specs_div.find_all('span', class_='re__pr-specs-content-item-value')
-                
-                for title, value in zip(titles, values):
-                    property_data[title.get_text().strip()] = value.get_text().strip()
-
-            address = self.safe_find(soup, 'span', 're__pr-short-description js__pr-address')
-            if address:
-                property_data["Địa chỉ"] = address
-
-            map_div = soup.find('div', class_='re__section re__pr-map js__section js__li-other')
-            if map_div:
-                coords = self.extract_coordinates(str(map_div))
-                property_data["latitude"] = coords[0]
-                property_data["longitude"] = coords[1]
-
-            short_info = soup.find('div', class_='re__pr-short-info re__pr-config js__pr-config')
-            if short_info:
-                info_titles = short_info.find_all('span', class_='title')
-                info_values = short_info.find_all('span', class_='value')
-                
-                for title, value in zip(info_titles, info_values):
-                    property_data[title.get_text().strip()] = value.get_text().strip()
+            futures = {executor.submit(self.discover_pages, base_url, max_pages): base_url
+                       for base_url in base_urls}
+            for future in as_completed(futures):
+                base_url = futures[future]
+                try:
+                    html_content, urls = future.result()
+                except Exception as e:
+                    logging.error(f"Error getting pagination URLs for {base_url}: {str(e)}")
+                    yield base_url, [base_url]
+                    continue
+                if prefetched is not None:
+                    prefetched[base_url] = html_content
+                yield base_url, urls
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            return property_data
+    def scrape_property(self, property_url, chrome_driver=None, refresh=False):
+        """Fetch and parse one detail page (bypassing page_cache with refresh); errors propagate so the caller can retry"""
+        html_content = self.fetch_html(property_url, chrome_driver, refresh=refresh)
+        record = self.parse_property(html_content, property_url)
+        record[BLOCKED_FIELD] = is_blocked_page(html_content)
+        if record[BLOCKED_FIELD]:
+            logging.warning(f"{property_url} was a block page; record marked for retry")
+            self.metrics.inc("blocked_records_total")
+        return record
 
+    def process_single_property(self, property_url, chrome_driver=None):
+        try:
+            return self.scrape_property(property_url, chrome_driver)
         except Exception as e:
             logging.error(f"Error processing property {property_url}: {str(e)}")
+            self.metrics.inc("errors_total", where="detail", error=type(e).__name__)
             return None
 
-    def scrape_properties(self, base_urls, num_threads=2, max_pages=None):
-        all_page_urls = []
-        for base_url in base_urls:
-            all_page_urls.extend(self.get_pagination_urls(base_url, max_pages))
+    def parse_property(self, html_content, property_url):
+        with self.metrics.timer("parse_seconds", kind="detail"):
+            return self.parser.parse_property(html_content, property_url)
 
-        chrome_drivers = self.create_chrome_driver(num_threads)
-        results = []
-        
-        def worker(driver, url_list):
-            for url in url_list:
-                try:
-                    driver.get(url)
-                    time.sleep(1)
-                    html_content = driver.page_source
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    property_urls = ['https://batdongsan.com.vn' + element.get('href') 
-                                   for element in soup.select('.js__product-link-for-product-id')]
-                    
-                    for property_url in property_urls:
-                        property_data = self.process_single_property(property_url, driver)
-                        if property_data:
-                            results.append(property_data)
-                            
-                except Exception as e:
-                    logging.error(f"Error processing {url}: {str(e)}")
-                    continue
+    def scrape_properties(self, base_urls, num_threads=2, max_pages=None,
+                          listing_workers=1, detail_workers=None, queue_size=100,
+                          stop_when_known=True, run_id=None, output_format='csv', batch_size=50,
+                          metrics_snapshot_interval=None, pages=None, discovery_workers=8,
+                          progress=None, cancel_event=None, mode='detail', retry_failed=False):
+        """
+        listing_workers/detail_workers: concurrency of each pipeline stage
+        (detail_workers defaults to num_threads). queue_size bounds the queue of
+        detail URLs so a slow detail stage applies backpressure upstream.
+        Pagination of base_urls is discovered by discovery_workers threads at once and
+        its pages are scraped as they are found; when a page shows page numbers past
+        the known last page (hidden behind an ellipsis), those pages are added too.
+        stop_when_known: with a listing index, stop paginating a base URL once one
+        of its pages contains only listings that were already scraped.
+        run_id: names the output file and run journal (default: current timestamp).
+        Passing the run_id of an interrupted run resumes it from its journal.
+        output_format: 'csv' (append-only) or 'parquet' (one row group per batch);
+        records are streamed to disk every batch_size records.
+        metrics_snapshot_interval: if set, rewrite scraped_data/runs/<run_id>_metrics.json
+        with the run's metrics every that many seconds (it is always written at the end).
+        pages: explicit {listing page URL: base URL} to scrape instead of paginating
+        base_urls, e.g. one shard's page range.
+        progress: ScrapeProgress updated as pages and listings finish (one is created
+        if not given; see last_progress). cancel_event: threading.Event that stops the
+        run early; the output so far is kept, nothing is uploaded and the run can be
+        resumed with the same run_id.
+        mode: 'detail' fetches every listing's detail page; 'cards' builds records
+        from the search-result cards alone (price, area, location, title) and loads
+        no detail pages; 'hydrate' does the same for known, unchanged listings and
+        fetches detail pages only for new or changed ones (all of them without a
+        listing index). Card modes add the title and a source column to the output.
+        Pages that still fail after the scraper's retry_policy are written to
+        scraped_data/runs/<run_id>_dead_letter.jsonl. retry_failed: re-run only those
+        URLs of run_id; their records are added to that run's output.
+        """
+        if mode not in SCRAPE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(SCRAPE_MODES)}")
+        self.last_dead_letters = []
+        run_id = run_id or datetime.now().strftime("%d_%m_%Y_%H_%M")
+        run_start = self.metrics.snapshot()
+        metrics_path = f"scraped_data/runs/{run_id}_metrics.json"
+        if metrics_snapshot_interval:
+            self.metrics.start_snapshots(metrics_path, metrics_snapshot_interval, since=run_start)
+        os.makedirs("scraped_data", exist_ok=True)
+        local_path = f"scraped_data/properties_{run_id}.{output_format}"
+        journal = RunJournal(f"scraped_data/runs/{run_id}.jsonl")
+        self.last_run_id = run_id
+        self.last_output_path = local_path
+        self.last_typed_path = None
+        progress = progress or ScrapeProgress()
+        self.last_progress = progress
 
-        # Split URLs among threads
-        url_chunks = [all_page_urls[i::num_threads] for i in range(num_threads)]
-        threads = []
-        
-        for i, chunk in enumerate(url_chunks):
-            t = Thread(target=worker, args=(chrome_drivers[i], chunk))
-            threads.append(t)
-            t.start()
+        dead_letters = DeadLetterFile(f"scraped_data/runs/{run_id}_dead_letter.jsonl")
+
+        if retry_failed:
+            if not journal.pages:
+                raise ValueError(f"Run {run_id} has no journal to retry")
+            failed = dead_letters.entries()
+            page_bases = dict(journal.pages)
+            pending_pages = [url for url in journal.pending_pages() if url in failed]
+            pending_details = [url for url in journal.pending_details() if url in failed]
+            logging.info(f"Retrying {len(pending_pages)} pages and {len(pending_details)} listings "
+                         f"that failed in run {run_id}")
+            progress.add_pages(len(pending_pages))
+            progress.add_listings(len(pending_details))
+        elif journal.pages:
+            page_bases = dict(journal.pages)
+            pending_pages = journal.pending_pages()
+            pending_details = journal.pending_details()
+            logging.info(f"Resuming run {run_id}: {len(pending_pages)} pages and "
+                         f"{len(pending_details)} listings left")
+            progress.add_pages(len(pending_pages))
+            progress.add_listings(len(pending_details))
+        else:
+            page_bases = dict(pages or {})
+            journal.plan_pages(page_bases)
+            pending_pages = list(page_bases)
+            pending_details = []
+            progress.add_pages(len(pending_pages))
+        # Explicit page ranges are scraped as given; otherwise discover (the rest of) each base URL
+        extend = pages is None and not retry_failed
+        undiscovered = [base_url for base_url in base_urls if base_url not in journal.bases_done] if extend else []
+        known_last = {}  # base URL -> number of its pages planned so far
+        for base_url in page_bases.values():
+            known_last[base_url] = known_last.get(base_url, 0) + 1
+        pages_lock = threading.Lock()
+        prefetched = {}
+
+        def plan(base_url, urls):
+            with pages_lock:
+                new_pages = {url: base_url for url in urls if url not in page_bases}
+                page_bases.update(new_pages)
+                known_last[base_url] = max(known_last.get(base_url, 0), len(urls))
+            journal.plan_pages(new_pages)
+            progress.add_pages(len(new_pages))
+            return list(new_pages)
 
-        for t in threads:
-            t.join()
+        def page_stream():
+            yield from pending_pages
+            for base_url, urls in self.iter_pagination(undiscovered, max_pages, discovery_workers, prefetched):
+                new_pages = plan(base_url, urls)
+                journal.mark_base_discovered(base_url)
+                yield from new_pages
 
-        for driver in chrome_drivers:
+        def extend_pagination(base_url, html_content):
+            last_page = self.parser.last_page(html_content)
+            if max_pages:
+                last_page = min(last_page, max_pages)
+            if last_page <= known_last.get(base_url, 1):
+                return
+            new_pages = plan(base_url, [build_page_url(base_url, page) for page in range(1, last_page + 1)])
+            if new_pages:
+                logging.info(f"Pagination of {base_url} extends to page {last_page}")
+                pipeline.add_pages(new_pages)
+
+        card_pages = CardPages()
+
+        def on_flush(records):
+            for page_url, detail_urls in card_pages.flushed(records):
+                journal.mark_page_done(page_url, detail_urls)
+            # Records from block pages stay pending, so resuming the run retries them
+            journal.mark_details_done(record['url'] for record in records
+                                      if not record.get(BLOCKED_FIELD) and record.get(SOURCE_FIELD) != 'card')
+
+        sink_class = ParquetResultSink if output_format == 'parquet' else CsvResultSink
+        sink = sink_class(local_path, fieldnames=PROPERTY_FIELDS if mode == 'detail' else CARD_RECORD_FIELDS,
+                          batch_size=batch_size, on_flush=on_flush)
+        exhausted_bases = set()
+        fingerprints = {}
+        hydrating = {}  # detail URL -> its card, merged into the detail record
+
+        def handle_page(page_url):
+            with self.metrics.timer("stage_seconds", stage="listing",
+                                    worker=threading.current_thread().name):
+                detail_urls = scrape_page(page_url)
+            progress.page_done(len(detail_urls))
+            return detail_urls
+
+        def scrape_page(page_url):
+            base_url = page_bases.get(page_url)
+            if base_url in exhausted_bases:
+                journal.mark_page_done(page_url, [])
+                return []
+            html_content = prefetched.pop(page_url, None)
+            if html_content is None:
+                html_content = self.fetch_html(page_url, ready_selector=LISTING_READY_SELECTOR)
+            if is_blocked_page(html_content):
+                # Not marked done: the page is retried when the run is resumed
+                raise FetchError(f"{page_url}: listing page is a block page")
+            if extend:
+                extend_pagination(base_url, html_content)
+            if self.listing_index is None and mode == 'detail':
+                detail_urls = self.extract_listing_urls(html_content, page_url)
+                journal.mark_page_done(page_url, detail_urls)
+                return detail_urls
+
+            cards = self.extract_listing_cards(html_content, page_url)
+            if self.listing_index is not None:
+                # Card records do not count as scraped: a later detail run still fetches them
+                self.listing_index.mark_seen([card['url'] for card in cards])
+            if mode == 'cards':
+                write_cards(page_url, cards, [])
+                return []
+            changed = cards if self.listing_index is None else self.listing_index.changed_cards(cards)
+
+            if self.listing_index is not None:
+                for card in changed:
+                    fingerprints[card['url']] = card_fingerprint(card)
+            detail_urls = [card['url'] for card in changed]
+            if mode == 'hydrate':
+                for card in changed:
+                    hydrating[card['url']] = card
+                known = set(detail_urls)
+                write_cards(page_url, [card for card in cards if card['url'] not in known], detail_urls)
+                return detail_urls
+            if cards and not changed and stop_when_known:
+                logging.info(f"All listings on {page_url} already scraped, "
+                             f"stopping pagination of {base_url}")
+                exhausted_bases.add(base_url)
+            journal.mark_page_done(page_url, detail_urls)
+            return detail_urls
+
+        def write_cards(page_url, cards, detail_urls):
+            records = [card_record(card) for card in cards]
+            if not records:
+                journal.mark_page_done(page_url, detail_urls)
+                return
+            card_pages.add(page_url, records, detail_urls)
+            for record in records:
+                write_record(record)
+            progress.cards_done(len(records))
+
+        def handle_detail(property_url):
+            with self.metrics.timer("stage_seconds", stage="detail", worker=threading.current_thread().name):
+                # A new or changed listing's cached page would bring back its old data
+                property_data = self.scrape_property(property_url, refresh=property_url in fingerprints)
+            card = hydrating.get(property_url)
+            if mode != 'detail':
+                # Detail fields win; the card fills in the title and anything the page lacked
+                for field, value in (card_record(card) if card else {}).items():
+                    if property_data.get(field) is None:
+                        property_data[field] = value
+                property_data[SOURCE_FIELD] = 'detail'
+            if property_data.get(BLOCKED_FIELD):
+                # Retried by the pipeline; if every attempt is blocked the record is still written
+                raise FailedRecord(f"{property_url} was a block page", property_data)
+            if self.listing_index is not None:
+                self.listing_index.mark_scraped(property_url, property_data.get("Mã tin"),
+                                                fingerprints.pop(property_url, None))
+            hydrating.pop(property_url, None)
+            progress.listing_done()
+            return property_data
+
+        def on_failure(stage, url, error, attempts, final):
+            if not final:
+                self.metrics.inc("retries_total", stage=stage)
+                return
+            self.metrics.inc("dead_letters_total", stage=stage)
+            dead_letters.add(stage, url, error, attempts, base=page_bases.get(url) if stage == PAGE else None)
+            if stage == PAGE:
+                progress.page_done(failed=True)
+            else:
+                progress.listing_done(ok=False)
+
+        def write_record(record):
+            with self.metrics.timer("write_seconds", format=output_format):
+                sink.write(record)
+            self.metrics.inc("records_total")
+
+        if self._owns_pool:
+            self.driver_pool.ensure_size(listing_workers + (detail_workers or num_threads))
+        pipeline = ScrapePipeline(
+            handle_page,
+            handle_detail,
+            write_record,
+            listing_workers=listing_workers,
+            detail_workers=detail_workers or num_threads,
+            queue_size=queue_size,
+            cancel_event=cancel_event,
+            retry_policy=self.retry_policy,
+            on_failure=on_failure,
+        )
+        try:
+            pipeline.run(page_stream(), pending_details)
+        finally:
+            with self.metrics.timer("write_seconds", format=output_format):
+                sink.close()
+            journal.close()
+            progress.finish()
+        if os.path.exists(dead_letters.path):
+            # URLs recovered since they were given up on (by a resume or retry) leave the file
+            dead_letters.keep(set(journal.pending_pages()) | set(journal.pending_details()))
+            failed = self.last_dead_letters = dead_letters.entries()
+            if failed:
+                logging.warning(f"{len(failed)} URLs failed permanently or after {self.retry_policy.max_attempts} attempts "
+                                f"(listed in {dead_letters.path}); re-run them with "
+                                f"run_id={run_id} and retry_failed=True")
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if cancelled:
+            logging.info(f"Run {run_id} cancelled after {progress.records} records; "
+                         f"resume it with run_id={run_id}")
+        ready_times = self.ready_time_summary(since=run_start)
+        if ready_times:
+            logging.info(f"Browser page readiness (seconds): {ready_times}")
+
+        self.close_drivers()
+
+        df = self.load_output(local_path)
+        if self.duplicate_detector is not None and not df.empty:
             try:
-                driver.quit()
-            except Exception:
-                pass
+                with self.metrics.timer("stage_seconds", stage="dedup"):
+                    df = self.duplicate_detector.annotate(df)
+            except Exception as e:
+                logging.error(f"Error clustering duplicate listings: {str(e)}")
 
-        # Convert results to DataFrame
-        df = pd.DataFrame(results)
-        
-        # Save to CSV locally
-        os.makedirs("scraped_data", exist_ok=True)
-        timestamp = datetime.now().strftime("%d_%m_%Y_%H_%M")
-        local_path = f"scraped_data/properties_{timestamp}.csv"
-        
-        # Save with UTF-8-BOM encoding
-        with open(local_path, 'w', encoding='utf-8-sig') as f:
-            df.to_csv(f, index=False)
+        # Typed, compressed copy for downstream consumers (numeric prices/areas, dates, categories)
+        typed_path = f"scraped_data/properties_{run_id}_typed.parquet"
+        try:
+            with self.metrics.timer("stage_seconds", stage="normalize"):
+                write_typed_parquet(df, typed_path)
+            self.last_typed_path = typed_path
+        except Exception as e:
+            logging.error(f"Error writing typed Parquet: {str(e)}")
         
-        if self.gcs:
+        if self.listing_store is not None and not cancelled:
+            try:
+                with self.metrics.timer("stage_seconds", stage="compact"):
+                    self.listing_store.compact(local_path, force=True)
+            except Exception as e:
+                logging.error(f"Error compacting {local_path} into the listing store: {str(e)}")
+
+        if self.gcs and not cancelled:
             try:
-                csv_content = df.to_csv(index=False, encoding='utf-8-sig')
-                self.gcs.upload_file_to_bucket(
-                    csv_content,
-                    f"scraped_data/properties_{timestamp}.csv"
-                )
+                # Every part of a resumed Parquet run, not just the first file
+                uploads = output_paths(local_path) + [path for path in [self.last_typed_path] if path]
+                with self.metrics.timer("stage_seconds", stage="upload"):
+                    self.gcs.upload_many(uploads, prefix="scraped_data")
             except Exception as e:
                 logging.error(f"Error uploading to GCS: {str(e)}")
-        
-        return df
\ No newline at end of file
+
+        if metrics_snapshot_interval:
+            self.metrics.stop_snapshots()
+        self.last_run_metrics = self.metrics.summary(since=run_start)
+        self.metrics.write_snapshot(metrics_path, since=run_start)
+        logging.info(f"Run {run_id} metrics:\n{format_summary(self.last_run_metrics)}")
+        return df
+
+    def replay_from_cache(self, url_pattern='%-pr%'):
+        """
+        Re-run detail extraction over every cached page matching url_pattern (SQL LIKE;
+        the default matches detail URLs) without touching the network.
+        """
+        if self.page_cache is None:
+            raise ValueError("replay_from_cache needs a page_cache")
+        records = []
+        for property_url in self.page_cache.urls(url_pattern):
+            html_content = self.page_cache.get(property_url, ignore_ttl=True)
+            if html_content is None:
+                continue
+            try:
+                records.append(self.parse_property(html_content, property_url))
+            except Exception as e:
+                logging.error(f"Error processing cached property {property_url}: {str(e)}")
+        return pd.DataFrame(records) if records else pd.DataFrame(columns=PROPERTY_FIELDS)
+
+    def load_output(self, local_path):
+        """Read a run's streamed output (including any resumed .partN files) into a DataFrame"""
+        return read_output(local_path)
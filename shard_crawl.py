@@ -0,0 +1,370 @@
+# shard_crawl.py
+"""
+Sharded batch crawling across processes and machines.
+
+    python shard_crawl.py plan  --db crawl.sqlite [--pages-per-task 5] [--max-pages N] URL [URL ...]
+    python shard_crawl.py work  --db crawl.sqlite [--processes 4] [--threads 4] [--workdir DIR]
+                                [--rate-share 0.25]
+    python shard_crawl.py merge --db crawl.sqlite --output merged.csv
+    python shard_crawl.py status --db crawl.sqlite
+    python shard_crawl.py run   --db crawl.sqlite --output merged.csv [...] URL [URL ...]
+
+`plan` discovers the page count of every base URL and splits the pages into
+tasks of pages_per_task pages in a SQLite task table. Any number of `work`
+processes, on one machine or on several machines sharing the database file
+(and the workdir, for `merge`), claim tasks with a lease, scrape them with
+PropertyScraper.scrape_properties and record the shard output. Tasks whose worker
+died are re-claimed once the lease expires and resume from their run journal; a
+worker that loses its lease stops scraping the task. A task with URLs left in its
+dead-letter file is retried like a failed one, and after --max-attempts it ends up
+`partial` (its output is merged, the gaps show in `status`).
+`merge` concatenates the finished and partial shards and drops duplicate listings by Mã tin.
+SQLite needs working file locks, so on network filesystems without them run the
+coordinating database on a local disk of one node.
+
+Every worker process has its own adaptive rate limiter, so the per-host request
+budget is split between processes: each gets --rate-share of it (default
+1/--processes). When workers on several machines crawl the same site, pass
+--rate-share 1/<total processes on all machines>.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import argparse
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from normalize import write_typed_parquet
+from result_sink import read_output
+
+DEFAULT_TASK_DB = "scraped_data/crawl_tasks.sqlite"
+
+
+class TaskTable:
+    """
+    SQLite table of crawl tasks (a page range of one base URL each).
+    A task is pending, running (leased by a worker until lease_until), done,
+    partial (finished with URLs that failed) or failed; claims happen inside
+    BEGIN IMMEDIATE so two workers never get the same task. Only the worker holding
+    a task's lease can finish it.
+    """
+
+    def __init__(self, path=DEFAULT_TASK_DB, timeout=60):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                base_url TEXT NOT NULL,
+                first_page INTEGER NOT NULL,
+                last_page INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output_path TEXT,
+                records INTEGER,
+                error TEXT,
+                finished_at REAL,
+                UNIQUE (base_url, first_page)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)")
+
+    def add_tasks(self, base_url, last_page, pages_per_task):
+        """Split pages 1..last_page of base_url into tasks; existing ranges are kept"""
+        ranges = [(base_url, first, min(last_page, first + pages_per_task - 1))
+                  for first in range(1, last_page + 1, pages_per_task)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (base_url, first_page, last_page) VALUES (?, ?, ?)", ranges
+            )
+            self._conn.execute("COMMIT")
+        return len(ranges)
+
+    def claim(self, worker, lease_seconds=1800):
+        """Lease the next pending (or expired) task to worker; returns a task dict or None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """SELECT id, base_url, first_page, last_page, attempts FROM tasks
+                       WHERE status = 'pending' OR (status = 'running' AND lease_until < ?)
+                       ORDER BY id LIMIT 1""",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        """UPDATE tasks SET status = 'running', worker = ?, lease_until = ?,
+                           attempts = attempts + 1 WHERE id = ?""",
+                        (worker, now + lease_seconds, row[0]),
+                    )
+            finally:
+                self._conn.execute("COMMIT")
+        if row is None:
+            return None
+        return {"id": row[0], "base_url": row[1], "first_page": row[2], "last_page": row[3],
+                "attempts": row[4] + 1}
+
+    def renew(self, task_id, worker, lease_seconds=1800):
+        """Extend a running task's lease; False if another worker has taken it over"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease_seconds, task_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, output_path, records):
+        """Mark worker's task done; False if worker no longer holds it"""
+        with self._lock:
+            cursor = self._conn.execute(
+                """UPDATE tasks SET status = 'done', output_path = ?, records = ?, error = NULL,
+                   lease_until = NULL, finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'""",
+                (output_path, records, time.time(), task_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker, error, max_attempts=3, output_path=None, records=None):
+        """
+        Return worker's task to the queue, or after max_attempts mark it failed (or
+        partial, when it has an output_path); False if worker no longer holds it
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                """UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending'
+                                                  WHEN ? IS NULL THEN 'failed' ELSE 'partial' END,
+                   error = ?, output_path = COALESCE(?, output_path), records = ?, lease_until = NULL,
+                   finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'""",
+                (max_attempts, output_path, error, output_path, records, time.time(), task_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def status(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*), COALESCE(SUM(records), 0) FROM tasks "
+                                      "GROUP BY status").fetchall()
+        return {status: {"tasks": count, "records": records} for status, count, records in rows}
+
+    def outputs(self):
+        """Output paths of finished (done or partial) tasks, in completion order"""
+        with self._lock:
+            rows = self._conn.execute("SELECT output_path FROM tasks WHERE status IN ('done', 'partial') "
+                                      "ORDER BY finished_at, id").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def plan(task_db, base_urls, pages_per_task=5, max_pages=None, scraper=None):
+    """Discover each base URL's page count and add its page ranges to the task table"""
+    from scraper import PropertyScraper
+
+    own_scraper = scraper is None
+    scraper = scraper or PropertyScraper()
+    tasks = TaskTable(task_db)
+    try:
+        total = 0
+        for base_url in base_urls:
+            last_page = len(scraper.get_pagination_urls(base_url, max_pages))
+            total += tasks.add_tasks(base_url, last_page, pages_per_task)
+            logging.info(f"Planned {last_page} pages of {base_url}")
+        return total
+    finally:
+        tasks.close()
+        if own_scraper:
+            scraper.close()
+
+
+def _keep_lease(tasks, task_id, worker, lease_seconds, stop, lost):
+    """Renew the lease until stop is set; sets lost (cancelling the scrape) if another worker took the task"""
+    while not stop.wait(lease_seconds / 3):
+        try:
+            renewed = tasks.renew(task_id, worker, lease_seconds)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not renew the lease on task {task_id}: {str(e)}")
+            continue
+        if not renewed:
+            logging.warning(f"Lost the lease on task {task_id}; stopping it")
+            lost.set()
+            return
+
+
+def work(task_db, workdir=".", num_threads=4, output_format="csv", lease_seconds=1800,
+         max_attempts=3, worker=None, mode="detail", rate_share=1.0):
+    """
+    Claim and scrape tasks until none are left; returns the number of tasks completed.
+    Shard outputs go to <workdir>/scraped_data/properties_<task run id>.<format>.
+    mode is passed to scrape_properties ('cards' sweeps listing pages only).
+    rate_share: fraction of the per-host request budget this process may use.
+    """
+    from rate_control import AdaptiveRateLimiter
+    from scraper import PropertyScraper, build_page_url
+
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    task_db = os.path.abspath(task_db)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # scrape_properties writes under ./scraped_data
+    tasks = TaskTable(task_db)
+    db_name = os.path.splitext(os.path.basename(task_db))[0]
+    completed = 0
+    # One limiter across this process's tasks, so consecutive scrapers share the budget and what it learned
+    rate_limiter = AdaptiveRateLimiter(share=rate_share)
+    try:
+        while True:
+            task = tasks.claim(worker, lease_seconds)
+            if task is None:
+                return completed
+            pages = {build_page_url(task["base_url"], page): task["base_url"]
+                     for page in range(task["first_page"], task["last_page"] + 1)}
+            run_id = f"{db_name}_task{task['id']}"
+            logging.info(f"{worker} scraping task {task['id']}: pages {task['first_page']}-"
+                         f"{task['last_page']} of {task['base_url']} (attempt {task['attempts']})")
+            stop, lost = threading.Event(), threading.Event()
+            heartbeat = threading.Thread(target=_keep_lease, daemon=True,
+                                         args=(tasks, task["id"], worker, lease_seconds, stop, lost))
+            heartbeat.start()
+            scraper = PropertyScraper(rate_limiter=rate_limiter)
+            try:
+                df = scraper.scrape_properties([task["base_url"]], num_threads=num_threads, run_id=run_id,
+                                               output_format=output_format, pages=pages, mode=mode,
+                                               cancel_event=lost)
+                output_path = os.path.abspath(scraper.last_output_path)
+                failed = len(scraper.last_dead_letters)
+                if lost.is_set():
+                    finished = False
+                elif failed:
+                    logging.warning(f"Task {task['id']}: {failed} URLs failed")
+                    finished = tasks.fail(task["id"], worker, f"{failed} URLs failed (see the run's dead-letter file)",
+                                          max_attempts, output_path, len(df))
+                else:
+                    finished = tasks.complete(task["id"], worker, output_path, len(df))
+                    completed += finished
+                if not finished:
+                    logging.warning(f"Task {task['id']} was taken over by another worker; its result is dropped")
+            except Exception as e:
+                logging.error(f"Task {task['id']} failed: {str(e)}")
+                if not tasks.fail(task["id"], worker, str(e), max_attempts):
+                    logging.warning(f"Task {task['id']} was taken over by another worker")
+            finally:
+                stop.set()
+                heartbeat.join()
+                scraper.close()
+    finally:
+        tasks.close()
+
+
+def work_parallel(task_db, processes=4, **kwargs):
+    """
+    Run `processes` workers in separate processes; returns tasks completed per worker.
+    Unless rate_share is given, each worker gets 1/processes of the request budget.
+    """
+    if kwargs.get("rate_share") is None:
+        kwargs["rate_share"] = 1.0 / max(1, processes)
+    if processes <= 1:
+        return [work(task_db, **kwargs)]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as executor:
+        futures = [executor.submit(work, task_db, **kwargs) for _ in range(processes)]
+        return [future.result() for future in futures]
+
+
+def merge_outputs(paths, output_path):
+    """
+    Concatenate shard outputs and keep one row per listing: the last one scraped by
+    Mã tin, or by URL for rows without an ID. Writes CSV (or Parquet by extension)
+    plus a typed Parquet copy next to it; returns the merged DataFrame.
+    """
+    frames = [read_output(path) for path in paths if os.path.exists(path)]
+    if not frames:
+        raise ValueError("No shard outputs to merge")
+    df = pd.concat(frames, ignore_index=True)
+    before = len(df)
+    if "Mã tin" in df:
+        has_id = df["Mã tin"].notna() & df["Mã tin"].astype(str).str.strip().ne("")
+    else:
+        has_id = pd.Series(False, index=df.index)
+    df = pd.concat([
+        df[has_id].drop_duplicates(subset="Mã tin", keep="last"),
+        df[~has_id].drop_duplicates(subset="url", keep="last"),
+    ]).sort_index().reset_index(drop=True)
+    logging.info(f"Merged {len(frames)} shards: {before} rows, {len(df)} unique listings")
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if output_path.endswith(".parquet"):
+        df.to_parquet(output_path, index=False, compression="zstd")
+        typed_path = output_path[:-len(".parquet")] + "_typed.parquet"
+    else:
+        df.to_csv(output_path, index=False, encoding="utf-8-sig")
+        typed_path = os.path.splitext(output_path)[0] + "_typed.parquet"
+    write_typed_parquet(df, typed_path)
+    return df
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("command", choices=["plan", "work", "merge", "status", "run"])
+    arg_parser.add_argument("urls", nargs="*", help="base URLs to plan")
+    arg_parser.add_argument("--db", default=DEFAULT_TASK_DB, help="SQLite task table shared by all workers")
+    arg_parser.add_argument("--pages-per-task", type=int, default=5)
+    arg_parser.add_argument("--max-pages", type=int)
+    arg_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--threads", type=int, default=4, help="detail workers per process")
+    arg_parser.add_argument("--workdir", default=".", help="directory shard outputs are written under")
+    arg_parser.add_argument("--output-format", choices=["csv", "parquet"], default="csv")
+    arg_parser.add_argument("--mode", choices=["detail", "cards", "hydrate"], default="detail",
+                            help="cards: build records from listing cards without loading detail pages")
+    arg_parser.add_argument("--rate-share", type=float,
+                            help="fraction of the per-host request budget per process (default 1/--processes)")
+    arg_parser.add_argument("--lease-seconds", type=int, default=1800)
+    arg_parser.add_argument("--max-attempts", type=int, default=3)
+    arg_parser.add_argument("--output", default="scraped_data/properties_merged.csv")
+    # URLs may come after the options, as in the usage above
+    args = arg_parser.parse_intermixed_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    # Workers change into workdir, so resolve paths first
+    args.db, args.output = os.path.abspath(args.db), os.path.abspath(args.output)
+
+    if args.command in ("plan", "run"):
+        if not args.urls:
+            arg_parser.error(f"{args.command} needs at least one base URL")
+        print(f"Planned {plan(args.db, args.urls, args.pages_per_task, args.max_pages)} tasks")
+    if args.command in ("work", "run"):
+        done = work_parallel(args.db, args.processes, workdir=os.path.abspath(args.workdir),
+                             num_threads=args.threads, output_format=args.output_format,
+                             lease_seconds=args.lease_seconds, max_attempts=args.max_attempts,
+                             mode=args.mode, rate_share=args.rate_share)
+        print(f"Completed {sum(done)} tasks in {len(done)} processes")
+    if args.command in ("merge", "run"):
+        tasks = TaskTable(args.db)
+        try:
+            paths = tasks.outputs()
+        finally:
+            tasks.close()
+        df = merge_outputs(paths, args.output)
+        print(f"Wrote {len(df)} listings to {args.output}")
+    if args.command in ("status", "run"):
+        tasks = TaskTable(args.db)
+        try:
+            for status, counts in sorted(tasks.status().items()):
+                print(f"{status:<8}{counts['tasks']:>6} tasks{counts['records']:>8} records")
+        finally:
+            tasks.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# spatial_index.py
+import math
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_M = 6_371_008.8
+# ~550 m cells: a 2 km radius query touches about 8x8 cells
+DEFAULT_CELL_DEGREES = 0.005
+# Larger key stride than any cell row, so (column, row) pairs sort column by column
+_ROWS = 1 << 20
+
+
+def haversine_m(lat, lon, lats, lons):
+    """Great-circle distance in metres from (lat, lon) to each of lats/lons"""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (np.sin((lats - lat) / 2) ** 2
+         + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """
+    Uniform lat/lon grid over listing coordinates, kept as one sorted NumPy array of
+    cell keys: a query turns its bounding box into one key range per grid column,
+    finds them with searchsorted and checks only the points in those cells.
+    Points added later go to a small unsorted delta that is scanned directly and
+    merged into the sorted part once it grows past merge_fraction of it.
+    Keys (e.g. Mã tin) are unique: adding a key again moves its point.
+    """
+
+    def __init__(self, cell_degrees=DEFAULT_CELL_DEGREES, merge_fraction=0.1):
+        self.cell_degrees = cell_degrees
+        self.merge_fraction = merge_fraction
+        self._keys = np.empty(0, dtype=object)
+        self._lats = np.empty(0)
+        self._lons = np.empty(0)
+        self._alive = np.empty(0, dtype=bool)
+        self._positions = {}  # key -> position in the arrays above
+        self._sorted_cells = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)  # positions in cell order
+        self._indexed = 0  # points [0, _indexed) are in the sorted part
+
+    @classmethod
+    def from_frame(cls, df, key="Mã tin", **kwargs):
+        index = cls(**kwargs)
+        index.update(df, key)
+        return index
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def _cells(self, lats, lons):
+        columns = np.floor(np.asarray(lons) / self.cell_degrees).astype(np.int64)
+        rows = np.floor(np.asarray(lats) / self.cell_degrees).astype(np.int64)
+        return columns * _ROWS + rows
+
+    def update(self, df, key="Mã tin"):
+        """Add or move the rows of df that have coordinates; returns the number of points added"""
+        rows = df[df["latitude"].notna() & df["longitude"].notna() & df[key].notna()]
+        return self.add(rows[key].to_numpy(), rows["latitude"].to_numpy(dtype="float64"),
+                        rows["longitude"].to_numpy(dtype="float64"))
+
+    def add(self, keys, lats, lons):
+        keys = np.asarray(keys, dtype=object)
+        lats = np.asarray(lats, dtype="float64")
+        lons = np.asarray(lons, dtype="float64")
+        if not len(keys):
+            return 0
+        # Last occurrence wins within the batch as well as against existing points
+        _, last = np.unique(keys[::-1].astype(str), return_index=True)
+        keep = np.sort(len(keys) - 1 - last)
+        keys, lats, lons = keys[keep], lats[keep], lons[keep]
+        start = len(self._keys)
+        for key in keys:
+            old = self._positions.get(key)
+            if old is not None:
+                self._alive[old] = False
+        self._positions.update(zip(keys, range(start, start + len(keys))))
+        self._keys = np.concatenate([self._keys, keys])
+        self._lats = np.concatenate([self._lats, lats])
+        self._lons = np.concatenate([self._lons, lons])
+        self._alive = np.concatenate([self._alive, np.ones(len(keys), dtype=bool)])
+        if len(self._keys) - self._indexed > self.merge_fraction * max(self._indexed, 1000):
+            self._rebuild()
+        return len(keys)
+
+    def remove(self, keys):
+        for key in keys:
+            position = self._positions.pop(key, None)
+            if position is not None:
+                self._alive[position] = False
+
+    def _rebuild(self):
+        """Drop dead points and sort everything by cell"""
+        alive = np.flatnonzero(self._alive)
+        self._keys, self._lats, self._lons = self._keys[alive], self._lats[alive], self._lons[alive]
+        self._alive = np.ones(len(alive), dtype=bool)
+        self._positions = dict(zip(self._keys, range(len(alive))))
+        cells = self._cells(self._lats, self._lons)
+        self._order = np.argsort(cells, kind="stable")
+        self._sorted_cells = cells[self._order]
+        self._indexed = len(alive)
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Positions of live points in the grid cells overlapping the box, plus the unsorted delta"""
+        first_column, last_column = (int(math.floor(value / self.cell_degrees)) for value in (min_lon, max_lon))
+        first_row, last_row = (int(math.floor(value / self.cell_degrees)) for value in (min_lat, max_lat))
+        columns = np.arange(first_column, last_column + 1, dtype=np.int64)
+        if len(columns) * (last_row - first_row + 1) > self._indexed:
+            positions = np.arange(self._indexed)  # box covers more cells than points: scan
+        else:
+            starts = np.searchsorted(self._sorted_cells, columns * _ROWS + first_row, side="left")
+            ends = np.searchsorted(self._sorted_cells, columns * _ROWS + last_row, side="right")
+            lengths = ends - starts
+            total = int(lengths.sum())
+            # Concatenated aranges of every [start, end) without a Python loop
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            positions = self._order[offsets + np.arange(total)]
+        positions = np.concatenate([positions, np.arange(self._indexed, len(self._keys))])
+        return positions[self._alive[positions]]
+
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Keys of the points inside the box"""
+        positions = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lats, lons = self._lats[positions], self._lons[positions]
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        return self._keys[positions[inside]]
+
+    def within_radius(self, lat, lon, radius_m):
+        """(keys, distances in metres) of the points within radius_m, nearest first"""
+        positions, distances = self._within(lat, lon, radius_m)
+        order = np.argsort(distances, kind="stable")
+        return self._keys[positions[order]], distances[order]
+
+    def _within(self, lat, lon, radius_m):
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = math.degrees(radius_m / (EARTH_RADIUS_M * max(math.cos(math.radians(lat)), 1e-6)))
+        positions = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = haversine_m(lat, lon, self._lats[positions], self._lons[positions])
+        inside = distances <= radius_m
+        return positions[inside], distances[inside]
+
+    def nearest(self, lat, lon, k=10):
+        """(keys, distances in metres) of the k points nearest to (lat, lon)"""
+        k = min(k, len(self))
+        if k <= 0:
+            return self._keys[:0], np.empty(0)
+        radius = self.cell_degrees * 111_000
+        while True:
+            positions, distances = self._within(lat, lon, radius)
+            # Every point closer than radius is found, so the k nearest inside it are exact
+            if len(positions) >= k or radius > math.pi * EARTH_RADIUS_M:
+                break
+            radius *= 2 if len(positions) else 4
+        nearest = np.argsort(distances, kind="stable")[:k]
+        return self._keys[positions[nearest]], distances[nearest]
+
+    def filter_frame(self, df, keys, key="Mã tin", distances=None):
+        """Rows of df for keys, in the order of keys (with a distance_m column if given)"""
+        order = pd.Series(np.arange(len(keys)), index=pd.Index(keys, dtype=object))
+        rows = df[df[key].isin(order.index)]
+        rows = rows.assign(_order=rows[key].map(order)).sort_values("_order")
+        if distances is not None:
+            rows = rows.assign(distance_m=np.asarray(distances)[rows["_order"].to_numpy()])
+        return rows.drop(columns="_order")
@@ -1,25 +1,177 @@
 # streamlit_app.py
 import streamlit as st
 import pandas as pd
-from datetime import datetime
 import os
-from scraper import PropertyScraper
+import threading
 from gcs_module import GCSModule
-import io
+from listing_index import ListingIndex
+from dedup import DuplicateDetector
+from listing_store import ListingStore
+from spatial_index import SpatialIndex
+from result_sink import read_output
+from scrape_jobs import QUEUED, RUNNING, CANCELLING, DONE, CANCELLED, JobManager
 
-def get_current_time_str():
-    current_datetime = datetime.now()
-    formatted_datetime = current_datetime.strftime("%d_%m_%Y_%H_%M")
-    return formatted_datetime
+PAGE_SIZES = [50, 100, 500]
+MAP_COLUMNS = ["Mã tin", "latitude", "longitude", "Mức giá", "Diện tích", "Địa chỉ", "district", "url", "last_seen"]
+MAX_MAP_POINTS = 5000
+SCRAPE_MODES_LABELS = {
+    "detail": "Every listing",
+    "hydrate": "New or changed listings only",
+    "cards": "None (listing cards only)",
+}
 
-def convert_df_to_csv(df):
-    buffer = io.StringIO()
-    buffer.write('\ufeff')
-    df.to_csv(buffer, index=False, encoding='utf-8')
-    return buffer.getvalue()
+@st.cache_resource
+def get_job_manager():
+    """One job executor per server process, shared by every rerun and session"""
+    return JobManager(max_workers=3)
+
+@st.cache_resource
+def get_listing_store():
+    """Historical store every finished job is compacted into"""
+    return ListingStore()
+
+@st.cache_resource
+def get_duplicate_detector():
+    """Persistent repost clustering shared by all jobs"""
+    return DuplicateDetector()
+
+@st.cache_resource
+def get_map_state():
+    """Spatial index of the store's latest listings, shared by all sessions and updated in place"""
+    return {"index": SpatialIndex(), "frame": None, "version": None, "lock": threading.Lock()}
+
+def load_map_data(store):
+    """Latest listings and their spatial index; only listings seen since the last load are re-indexed"""
+    state = get_map_state()
+    with state["lock"]:
+        version = os.path.getmtime(store.latest_path) if os.path.exists(store.latest_path) else None
+        if version is not None and version != state["version"]:
+            latest = store.latest(columns=MAP_COLUMNS)
+            previous = state["frame"]
+            fresh = latest if previous is None else latest[latest["last_seen"] >= previous["last_seen"].max()]
+            state["index"].update(fresh)
+            state["frame"], state["version"] = latest, version
+        return state["frame"], state["index"]
+
+@st.cache_data(max_entries=8)
+def load_results(path, modified_at):
+    """Read a job's output once per file version (modified_at is part of the cache key)"""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return read_output(path)
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "–"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+def show_job(manager, job):
+    progress = job.progress.as_dict()
+    st.markdown(f"**Job {job.id}** · `{job.run_id}` · {job.status}")
+    st.progress(min(1.0, progress["fraction"]),
+                text=f"{progress['listings_done']}/{progress['listings_total']} listings, "
+                     f"{progress['pages_done']}/{progress['pages_total']} pages")
+    pages, listings, rate, eta, errors = st.columns(5)
+    pages.metric("Pages", progress["pages_done"])
+    listings.metric("Listings", progress["records"])
+    rate.metric("Listings/s", f"{progress['listings_per_sec']:.2f}")
+    eta.metric("ETA", format_seconds(progress["eta_seconds"]) if not job.finished
+               else format_seconds(progress["elapsed"]))
+    errors.metric("Errors", progress["errors"])
+    if job.error:
+        st.error(f"Job failed: {job.error}")
+    if job.status in (QUEUED, RUNNING):
+        if st.button("Cancel", key=f"cancel_{job.id}"):
+            manager.cancel(job.id)
+    elif job.status == CANCELLING:
+        st.caption("Cancelling…")
+    elif job.status == CANCELLED:
+        st.caption(f"Cancelled; resume it with run ID {job.run_id}")
+
+def show_results(job):
+    path = job.typed_path or job.output_path
+    if not path or not os.path.exists(path):
+        st.warning("No output file for this job")
+        return
+    df = load_results(path, os.path.getmtime(path))
+    st.write(f"Total properties scraped: {len(df)}")
+    if "cluster_id" in df:
+        st.write(f"Distinct properties after removing probable reposts: {df['cluster_id'].nunique()}")
+    if job.metrics:
+        with st.expander("Run metrics"):
+            st.json(job.metrics)
+
+    # Only one page of rows is sent to the browser
+    size_column, page_column = st.columns(2)
+    page_size = size_column.selectbox("Rows per page", PAGE_SIZES, key=f"page_size_{job.id}")
+    page_count = max(1, -(-len(df) // page_size))
+    page = page_column.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count,
+                                    value=1, key=f"page_{job.id}")
+    st.dataframe(df.iloc[(page - 1) * page_size:page * page_size])
+
+    if job.output_path and os.path.exists(job.output_path):
+        with open(job.output_path, 'rb') as f:
+            st.download_button(
+                label=f"Download {os.path.splitext(job.output_path)[1][1:].upper()}",
+                data=f.read(),
+                file_name=os.path.basename(job.output_path),
+                key=f"download_{job.id}"
+            )
+    st.info(f"Data has been saved locally in: {job.output_path} (run ID {job.run_id})")
+
+def show_history(store):
+    listing_id = st.text_input("Mã tin", help="Price and expiry history of one listing").strip()
+    if not listing_id:
+        return
+    if not listing_id.isdigit():
+        st.error("Mã tin is a number")
+        return
+    snapshots = store.listing_history(listing_id)
+    if snapshots.empty:
+        st.warning(f"Listing {listing_id} is not in the history store")
+        return
+    st.write(f"Seen in {snapshots['scrape_date'].nunique()} scrapes")
+    st.line_chart(snapshots.groupby("scrape_date")["Mức giá"].last())
+    changes = store.changes(listing_id)
+    if not changes.empty:
+        st.dataframe(changes)
+
+def show_map(store):
+    listings, index = load_map_data(store)
+    if listings is None or not len(index):
+        st.info("No listings with coordinates in the history store yet")
+        return
+    center_id = st.text_input("Centre on Mã tin (optional)", key="map_center").strip()
+    lat_column, lon_column = st.columns(2)
+    lat = lat_column.number_input("Latitude", value=float(listings["latitude"].median()), format="%.6f")
+    lon = lon_column.number_input("Longitude", value=float(listings["longitude"].median()), format="%.6f")
+    if center_id:
+        row = listings[listings["Mã tin"].astype("string") == center_id]
+        if row.empty or row["latitude"].isna().all():
+            st.warning(f"Listing {center_id} has no coordinates in the store")
+        else:
+            lat, lon = float(row["latitude"].iloc[0]), float(row["longitude"].iloc[0])
+    query = st.radio("Find", ["Within radius", "Nearest"], horizontal=True)
+    if query == "Within radius":
+        radius_km = st.slider("Radius (km)", 0.1, 20.0, 2.0, 0.1)
+        keys, distances = index.within_radius(lat, lon, radius_km * 1000)
+    else:
+        k = st.number_input("Number of listings", min_value=1, max_value=MAX_MAP_POINTS, value=20)
+        keys, distances = index.nearest(lat, lon, k)
+    nearby = index.filter_frame(listings, keys, distances=distances)
+    max_price = st.number_input("Maximum price (tỷ VND, 0 = any)", min_value=0.0, value=0.0, step=0.5)
+    if max_price:
+        nearby = nearby[nearby["Mức giá"] <= max_price * 1e9]
+    st.write(f"{len(nearby)} of {len(index)} listings"
+             + (f" (map shows the nearest {MAX_MAP_POINTS})" if len(nearby) > MAX_MAP_POINTS else ""))
+    st.map(nearby.head(MAX_MAP_POINTS), latitude="latitude", longitude="longitude")
+    st.dataframe(nearby.head(MAX_MAP_POINTS))
 
 def main():
     st.title("Batdongsan.com.vn Web Scraper")
+    manager = get_job_manager()
     
     # GCS credentials configuration
     gcs_json_path = st.text_input(
@@ -57,54 +209,93 @@ def main():
         help="Leave blank or set to a higher number to scrape all available pages"
     )
     
+    incremental = st.checkbox(
+        "Skip listings already scraped",
+        value=True,
+        help="Uses the listing index in scraped_data/ to avoid re-fetching unchanged listings"
+    )
+    
+    scrape_mode = st.selectbox(
+        "Detail pages",
+        list(SCRAPE_MODES_LABELS),
+        format_func=SCRAPE_MODES_LABELS.get,
+        help="Listing cards only: price, area, location and title from the search results, "
+             "about 20x fewer page loads"
+    )
+    
+    resume_run_id = st.text_input(
+        "Resume run ID (optional)",
+        help="Run ID of an interrupted scrape, e.g. 25_10_2024_10_23, to continue where it stopped"
+    ).strip()
+    
+    retry_failed = st.checkbox(
+        "Only retry URLs that failed in that run",
+        value=False,
+        help="Re-scrapes the URLs listed in the run's dead-letter file and adds them to its output"
+    )
+    
     if st.button("Start Scraping"):
-        if not urls_input.strip():
+        if retry_failed and not resume_run_id:
+            st.error("Enter the run ID whose failed URLs should be retried")
+            return
+        if not urls_input.strip() and not retry_failed:
             st.error("Please enter at least one URL")
             return
         
         urls = [url.strip() for url in urls_input.strip().split('\n') if url.strip()]
         
-        with st.spinner("Scraping data..."):
-            try:
-                # Create progress bar
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                scraper = PropertyScraper(gcs_module)
-                df = scraper.scrape_properties(
-                    urls,
-                    num_threads=num_threads,
-                    max_pages=max_pages
-                )
-                
-                st.success("Scraping completed!")
-                
-                # Show summary statistics
-                st.subheader("Summary")
-                st.write(f"Total properties scraped: {len(df)}")
-                
-                # Display the data
-                st.subheader("Scraped Data")
-                st.dataframe(df)
-                
-                # Convert dataframe to CSV with proper encoding
-                csv = convert_df_to_csv(df)
-                
-                # Download button for CSV
-                st.download_button(
-                    label="Download CSV",
-                    data=csv,
-                    file_name=f"properties_{get_current_time_str()}.csv",
-                    mime="text/csv"
-                )
-                
-                # Show storage information
-                if gcs_module:
-                    st.info(f"Data has been saved to Google Cloud Storage bucket: {bucket_name}")
-                st.info(f"Data has been saved locally in: scraped_data/properties_{get_current_time_str()}.csv")
-                
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+        try:
+            listing_index = None
+            if incremental:
+                listing_index = ListingIndex()
+                if len(listing_index) == 0:
+                    listing_index.import_csv()
+            
+            job = manager.submit(
+                urls,
+                run_id=resume_run_id or None,
+                scraper_kwargs={"gcs_module": gcs_module, "listing_index": listing_index,
+                                "listing_store": get_listing_store(),
+                                "duplicate_detector": get_duplicate_detector()},
+                num_threads=num_threads,
+                max_pages=max_pages,
+                mode=scrape_mode,
+                retry_failed=retry_failed
+            )
+            st.success(f"Started job {job.id} (run ID {job.run_id})")
+            if gcs_module:
+                st.info(f"Data will be saved to Google Cloud Storage bucket: {bucket_name}")
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
+    
+    jobs = manager.jobs()
+    active = any(not job.finished for job in jobs)
+    
+    # Only this fragment reruns while jobs are active, so the page stays responsive
+    @st.fragment(run_every=2 if active else None)
+    def jobs_panel():
+        current = manager.jobs()
+        if active and not any(not job.finished for job in current):
+            st.rerun()  # last job just finished: refresh results and stop polling
+        for job in current:
+            with st.container(border=True):
+                show_job(manager, job)
+    
+    if jobs:
+        st.subheader("Scrape jobs")
+        jobs_panel()
+    
+    finished = [job for job in jobs if job.status in (DONE, CANCELLED)]
+    if finished:
+        st.subheader("Scraped Data")
+        job = st.selectbox("Job", finished, format_func=lambda job: f"Job {job.id} ({job.run_id})")
+        show_results(job)
+    
+    st.subheader("Listing history")
+    show_history(get_listing_store())
+    
+    st.subheader("Listings map")
+    show_map(get_listing_store())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,238 +1,362 @@
 from seleniumbase import Driver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import WebDriverException
+from contextlib import nullcontext
+from pathlib import Path
+import argparse
+import csv
+import os
 import time
 import logging
 
+ZALO_URL = "https://chat.zalo.me/"
+# Chrome profile kept between runs, so the QR code only has to be scanned once
+DEFAULT_PROFILE_DIR = "chrome_profiles/zalo"
+# Local stand-in for Zalo Web with the same markup (see the comment at its top)
+MOCK_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "zalo", "chat.html")
+
+# CSS selectors; every list passed to wait_for_any is raced at once
+CHAT_LIST_SELECTORS = [
+    "[class*='chat-list']",
+    "[class*='conv-list']",
+    "[class*='conversation-list']",
+    ".left-side [class*='list']",
+]
+LOGGED_IN_SELECTORS = CHAT_LIST_SELECTORS + ["[class*='conv-item']", "[class*='chat-item']"]
+QR_SELECTORS = ["[class*='qr-container']", "[class*='qrcode']", "[class*='qr-code']"]
+CHAT_ITEM_SELECTOR = "[class*='conv-item'], [class*='chat-item'], [class*='conversation-item']"
+MEMBER_BUTTON_SELECTORS = ["[class*='group-member-count']", "[class*='member-count']", "[class*='members-btn']"]
+MEMBER_LIST_SELECTORS = ["[class*='member-list']", "[class*='members-list']"]
+MEMBER_ROW_SELECTOR = "[class*='member-item'], [class*='member-row']"
+MEMBER_NAME_SELECTOR = "[class*='name']"
+MEMBER_ROLE_SELECTOR = "[class*='role']"
+MEMBER_FIELDS = ["id", "name", "role", "avatar"]
+
+_JS_HELPERS = """
+const visible = node => !!(node.offsetWidth || node.offsetHeight || node.getClientRects().length);
+// Matches not nested inside another match (e.g. an item, not its title)
+const outermost = (nodes, selector) =>
+    [...nodes].filter(node => !node.parentElement || !node.parentElement.closest(selector));
+// The element that actually scrolls: the list, a descendant (virtualized grid) or an ancestor
+const scrollerOf = node => {
+    const scrolls = el => el.scrollHeight > el.clientHeight + 1 && getComputedStyle(el).overflowY !== 'visible';
+    if (scrolls(node)) return node;
+    const inner = [...node.querySelectorAll('*')].find(scrolls);
+    if (inner) return inner;
+    for (let el = node.parentElement; el && el !== document.body; el = el.parentElement) {
+        if (scrolls(el)) return el;
+    }
+    return node;
+};
+const firstVisible = selectors =>
+    selectors.map(selector => document.querySelector(selector)).find(node => node && visible(node));
+// Resolves once node has stopped changing for settleMs, or after idleMs without any change
+const settle = (node, idleMs, settleMs = 100) => new Promise(resolve => {
+    const finish = () => { observer.disconnect(); resolve(); };
+    let timer = setTimeout(finish, idleMs);
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(finish, settleMs);
+    });
+    observer.observe(node, {childList: true, subtree: true, characterData: true});
+});
+"""
+
+# Resolves with [index of the first matching selector, element] as soon as any selector
+# matches a visible element, re-checking on DOM mutations; null after timeoutMs
+_WAIT_ANY_SCRIPT = _JS_HELPERS + """
+const [selectors, timeoutMs, done] = arguments;
+const match = () => {
+    for (let i = 0; i < selectors.length; i++) {
+        for (const node of document.querySelectorAll(selectors[i])) {
+            if (visible(node)) return [i, node];
+        }
+    }
+    return null;
+};
+const found = match();
+if (found) return done(found);
+let finished = false, pending = false;
+const finish = result => {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+};
+const observer = new MutationObserver(() => {
+    if (pending) return;
+    pending = true;
+    setTimeout(() => {
+        pending = false;
+        const found = match();
+        if (found) finish(found);
+    }, 25);
+});
+const timer = setTimeout(() => finish(null), timeoutMs);
+observer.observe(document, {childList: true, subtree: true, attributes: true});
+"""
+
+# Scrolls the chat list from the top and returns the conversation titled `name`
+# (or else the first one whose title contains it), null if there is none
+_FIND_CHAT_SCRIPT = _JS_HELPERS + """
+const [listSelectors, itemSelector, name, idleMs, done] = arguments;
+(async () => {
+    const list = firstVisible(listSelectors);
+    if (!list) return null;
+    const scroller = scrollerOf(list);
+    const wanted = name.trim().toLowerCase();
+    let partial = null, partialAt = 0;
+    const search = () => {
+        for (const item of outermost(list.querySelectorAll(itemSelector), itemSelector)) {
+            const title = (item.querySelector("[class*='title'], [class*='name']") || item)
+                .textContent.trim().toLowerCase();
+            if (title === wanted) return item;
+            if (!partial && title.includes(wanted)) {
+                partial = item;
+                partialAt = scroller.scrollTop;
+            }
+        }
+        return null;
+    };
+    if (scroller.scrollTop > 0) {
+        scroller.scrollTop = 0;
+        await settle(list, idleMs);
+    }
+    while (true) {
+        const found = search();
+        if (found) return found;
+        const before = scroller.scrollTop;
+        scroller.scrollTop = before + scroller.clientHeight * 0.8;
+        if (scroller.scrollTop === before) break;
+        await settle(list, idleMs);
+    }
+    if (partial && !partial.isConnected) {
+        // A virtualized list has dropped it since; scroll back to where it was rendered
+        scroller.scrollTop = partialAt;
+        await settle(list, idleMs);
+        partial = null;
+        search();
+    }
+    return partial;
+})().then(done, error => done(null));
+"""
+
+# Reads the member rows currently rendered, then scrolls the list one screen further
+# and waits for it to re-render; `end` is set once it cannot scroll any further
+_MEMBER_BATCH_SCRIPT = _JS_HELPERS + """
+const [listSelectors, rowSelector, nameSelector, roleSelector, idleMs, fromTop, done] = arguments;
+(async () => {
+    const list = firstVisible(listSelectors);
+    if (!list) return null;
+    const scroller = scrollerOf(list);
+    if (fromTop && scroller.scrollTop > 0) {
+        scroller.scrollTop = 0;
+        await settle(list, idleMs);
+    }
+    const text = node => node ? node.textContent.trim() : '';
+    const rows = outermost(list.querySelectorAll(rowSelector), rowSelector).map(row => {
+        const avatar = row.querySelector('img');
+        return {
+            id: row.dataset.id || row.getAttribute('data-uid') || row.id || '',
+            name: text(row.querySelector(nameSelector) || row),
+            role: text(row.querySelector(roleSelector)),
+            avatar: avatar ? avatar.src : '',
+        };
+    });
+    const before = scroller.scrollTop;
+    scroller.scrollTop = before + scroller.clientHeight * 0.8;
+    const end = scroller.scrollTop === before;
+    if (!end) await settle(list, idleMs);
+    return {rows, end};
+})().then(done, error => done({error: String(error)}));
+"""
+
+
 class ZaloGroupScraper:
-    def __init__(self):
+    def __init__(self, profile_dir=DEFAULT_PROFILE_DIR, url=ZALO_URL, headless=False, driver=None,
+                 page_timeout=60, idle_ms=1000):
+        """
+        profile_dir keeps Chrome's profile (and with it the Zalo session) between runs;
+        None starts from a fresh profile. idle_ms is how long a scrolled list may take
+        to render new rows before it is taken as fully loaded.
+        """
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s'
         )
         self.logger = logging.getLogger(__name__)
-        
-        # Enhanced driver options
-        self.driver = Driver(
-            browser="chrome",
-            uc=True,
-            headless2=False,
-            page_load_strategy="normal",  # Changed to normal for more reliable loading
-            #maximize_window=True  # Ensure window is maximized
-        )
-        # Maximizing window after initializing the driver
-        self.driver.maximize_window()
-        self.wait = WebDriverWait(self.driver, 20)
+        self.profile_dir = profile_dir
+        self.url = url
+        self.page_timeout = page_timeout
+        self.idle_ms = idle_ms
 
+        if driver is None:
+            driver = Driver(
+                browser="chrome",
+                uc=True,
+                headless2=headless,
+                page_load_strategy="normal",  # Changed to normal for more reliable loading
+                user_data_dir=os.path.abspath(profile_dir) if profile_dir else None,
+            )
+            # Maximizing window after initializing the driver
+            driver.maximize_window()
+        self.driver = driver
 
-    def check_login_status(self):
-        """Check if user is logged in"""
-        try:
-            # Multiple possible selectors for checking login status
-            login_indicators = [
-                "//div[contains(@class, 'avatar')]",
-                "//div[contains(@class, 'profile')]",
-                "//div[contains(@class, 'chat-list')]",
-                "//div[contains(@class, 'left-side')]",
-                "//div[contains(@class, 'conversation')]"
-            ]
-            
-            for selector in login_indicators:
-                try:
-                    element = self.wait_and_find_element(By.XPATH, selector, timeout=5)
-                    if element and element.is_displayed():
-                        return True
-                except:
-                    continue
-            return False
-        except:
-            return False
-
-    def wait_and_find_element(self, by, value, timeout=20, retry_count=3):
-        for attempt in range(retry_count):
+    def wait_for_any(self, selectors, timeout=20):
+        """
+        Wait until any of the CSS selectors matches a visible element, checking on
+        every DOM change rather than polling. Returns (index of the selector, element),
+        or (None, None) on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            self.driver.set_script_timeout(remaining + 5)
             try:
-                element = WebDriverWait(self.driver, timeout).until(
-                    EC.presence_of_element_located((by, value))
-                )
-                if element.is_displayed():
-                    return element
-            except Exception as e:
-                if attempt == retry_count - 1:
-                    self.logger.warning(f"Element not found: {value}")
-                time.sleep(2)
-        return None
-
-    def wait_for_chat_list_load(self, max_retries=8):
-        """Improved chat list detection with extended timeout and refined selectors"""
-        self.logger.info("Waiting for chat list to load...")
-
-        chat_list_selectors = [
-            "//div[contains(@class, 'chat-list')]",
-            "//div[contains(@class, 'conv-list')]",
-            "//div[contains(@class, 'conversation-list')]",
-            "//div[contains(@class, 'left-side')]//div[contains(@class, 'list')]"
-        ]
-
-        for attempt in range(max_retries):
-            # Check if login status is verified
-            if not self.check_login_status():
-                self.logger.warning("Login status check failed, retrying...")
-                time.sleep(10)
+                found = self.driver.execute_async_script(_WAIT_ANY_SCRIPT, selectors, int(remaining * 1000))
+            except WebDriverException as e:
+                # The page navigated away mid-wait (e.g. right after login): wait on the new one
+                self.logger.debug(f"Wait interrupted, retrying: {str(e)}")
+                time.sleep(0.2)
                 continue
+            return (found[0], found[1]) if found else (None, None)
 
-            for selector in chat_list_selectors:
-                try:
-                    # Adjusted timeout and detection for list elements
-                    element = WebDriverWait(self.driver, 15).until(
-                        EC.presence_of_element_located((By.XPATH, selector))
-                    )
-
-                    # Check for visible chat items
-                    chat_items = self.driver.find_elements(
-                        By.XPATH,
-                        ".//div[contains(@class, 'conv-item') or contains(@class, 'chat-item')]"
-                    )
-
-                    if element.is_displayed() or len(chat_items) > 0:
-                        self.logger.info("Chat list detected successfully")
-                        return True
-
-                except Exception as e:
-                    continue
-
-            self.logger.warning(f"Attempt {attempt + 1}/{max_retries}: Chat list not detected")
-
-            if attempt == 2:
-                self.logger.info("Clicking on chat list area...")
-                try:
-                    self.driver.execute_script(
-                        "document.querySelector('.left-side').click()"
-                    )
-                except:
-                    pass
-
-            elif attempt == 3:
-                self.logger.info("Refreshing page...")
-                self.driver.refresh()
-                time.sleep(12)
+    def check_login_status(self, timeout=5):
+        """Check if user is logged in"""
+        index, _ = self.wait_for_any(LOGGED_IN_SELECTORS, timeout)
+        return index is not None
 
-            elif attempt == 4:
-                self.logger.info("Clearing browser data and refreshing...")
-                self.driver.delete_all_cookies()
+    def wait_for_chat_list_load(self, login_timeout=300):
+        """
+        Wait for the chat list, or for the QR code and then for the chat list once
+        it has been scanned. Refreshes the page once if neither shows up.
+        """
+        self.logger.info("Waiting for chat list to load...")
+        selectors = LOGGED_IN_SELECTORS + QR_SELECTORS
+        for attempt in range(2):
+            index, _ = self.wait_for_any(selectors, self.page_timeout)
+            if index is None:
+                self.logger.warning(f"Attempt {attempt + 1}/2: neither chat list nor QR code appeared")
+                self.logger.info("Refreshing page...")
                 self.driver.refresh()
-                time.sleep(18)
-
-            time.sleep(8)
-
+                continue
+            if index >= len(LOGGED_IN_SELECTORS):
+                self.logger.info(f"Not logged in: scan the QR code within {login_timeout}s"
+                                 + (f" (the session is kept in {self.profile_dir})" if self.profile_dir else ""))
+                index, _ = self.wait_for_any(CHAT_LIST_SELECTORS, login_timeout)
+                if index is None:
+                    self.logger.warning("QR code was not scanned in time")
+                    return False
+            self.logger.info("Chat list detected successfully")
+            return True
         return False
 
-
     def find_group_element(self, group_name):
-        """Enhanced group finding with multiple strategies"""
-        selectors = [
-            f"//div[contains(@class, 'conv-item-title')]//span[contains(text(), '{group_name}')]",
-            f"//div[contains(@class, 'chat-list')]//span[contains(text(), '{group_name}')]",
-            f"//div[contains(@class, 'conversation-item')]//span[text()='{group_name}']",
-            f"//div[contains(@class, 'left-side')]//span[contains(text(), '{group_name}')]"
-        ]
-        
-        for selector in selectors:
-            element = self.wait_and_find_element(By.XPATH, selector)
-            if element and element.is_displayed():
-                return element
-                
-        # Try partial match if exact match fails
-        for selector in selectors:
-            try:
-                elements = self.driver.find_elements(By.XPATH, selector)
-                for element in elements:
-                    if group_name.lower() in element.text.lower() and element.is_displayed():
-                        return element
-            except:
-                continue
-                
-        return None
+        """Search the whole (virtualized) chat list for the group in one in-page script"""
+        self.driver.set_script_timeout(self.page_timeout + 5)
+        element = self.driver.execute_async_script(
+            _FIND_CHAT_SCRIPT, CHAT_LIST_SELECTORS, CHAT_ITEM_SELECTOR, group_name, self.idle_ms
+        )
+        if element is not None:
+            self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'})", element)
+        return element
+
+    def open_member_list(self):
+        _, button = self.wait_for_any(MEMBER_BUTTON_SELECTORS, self.page_timeout)
+        if button is None:
+            raise Exception("Could not find the group's member list button")
+        self.driver.execute_script("arguments[0].click()", button)
+        index, _ = self.wait_for_any(MEMBER_LIST_SELECTORS, self.page_timeout)
+        if index is None:
+            raise Exception("Member list failed to load")
 
-    def scrape_group_members(self, group_name):
+    def stream_members(self, max_batches=100000):
+        """
+        Yield the open member list's rows (id, name, role, avatar) as they are rendered,
+        scrolling the virtualized list one screen per step until it stops moving.
+        """
+        seen = set()
+        self.driver.set_script_timeout(self.idle_ms / 1000 * 2 + 30)
+        for batch_number in range(max_batches):
+            batch = self.driver.execute_async_script(
+                _MEMBER_BATCH_SCRIPT, MEMBER_LIST_SELECTORS, MEMBER_ROW_SELECTOR, MEMBER_NAME_SELECTOR,
+                MEMBER_ROLE_SELECTOR, self.idle_ms, batch_number == 0
+            )
+            if batch is None:
+                raise Exception("Member list is no longer on the page")
+            if "error" in batch:
+                raise Exception(f"Error reading member list: {batch['error']}")
+            for row in batch["rows"]:
+                key = row["id"] or row["name"]
+                if key and key not in seen:
+                    seen.add(key)
+                    if len(seen) % 500 == 0:
+                        self.logger.info(f"{len(seen)} members read...")
+                    yield row
+            # Rows are read before scrolling, so an end batch already holds the last screen
+            if batch["end"]:
+                break
+
+    def scrape_group_members(self, group_name, output_path=None):
+        """Open the group and return its members, also written to output_path (CSV) as they stream in"""
         try:
             self.logger.info("Accessing Zalo Web...")
-            self.driver.get("https://chat.zalo.me/")
-            
-            # Initial page load wait
-            time.sleep(10)
-            
-            self.logger.info("Waiting for QR code scan...")
-            input("Please scan the QR code and press Enter after logging in...")
-            
-            # Additional wait after login
-            time.sleep(10)
-            
+            self.driver.get(self.url)
+
             if not self.wait_for_chat_list_load():
                 raise Exception("Chat list failed to load. Please try again.")
-            
+
             self.logger.info("Chat list loaded successfully. Looking for group...")
-            self.scroll_chat_list()
-            
             group_element = self.find_group_element(group_name)
             if not group_element:
-                self.logger.info("Group not found on first attempt, trying again...")
-                self.scroll_chat_list()
-                group_element = self.find_group_element(group_name)
-            
-            if group_element:
-                self.logger.info(f"Found group: {group_name}")
-                group_element.click()
-                # Continue with member scraping...
-            else:
                 raise Exception(f"Could not find group: {group_name}")
-                
+
+            self.logger.info(f"Found group: {group_name}")
+            group_element.click()
+            self.open_member_list()
+
+            members = []
+            if output_path and os.path.dirname(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8-sig', newline='') if output_path else nullcontext() as f:
+                writer = csv.DictWriter(f, fieldnames=MEMBER_FIELDS) if f else None
+                if writer:
+                    writer.writeheader()
+                for member in self.stream_members():
+                    members.append(member)
+                    if writer:
+                        writer.writerow(member)
+                        f.flush()
+            self.logger.info(f"Read {len(members)} members of {group_name}")
+            return members
+
         except Exception as e:
             self.logger.error(f"Error occurred: {str(e)}")
             raise
-            
-    def scroll_chat_list(self, scroll_attempts=8):
-        """Enhanced scrolling with better progress detection"""
-        try:
-            chat_list = self.wait_and_find_element(
-                By.XPATH, 
-                "//div[contains(@class, 'chat-list') or contains(@class, 'conv-list')]"
-            )
-            if chat_list:
-                self.logger.info("Scrolling through chat list...")
-                previous_height = 0
-                
-                for i in range(scroll_attempts):
-                    current_height = self.driver.execute_script(
-                        "return arguments[0].scrollHeight", 
-                        chat_list
-                    )
-                    
-                    if current_height == previous_height:
-                        break
-                        
-                    self.driver.execute_script(
-                        "arguments[0].scrollTop = arguments[0].scrollHeight", 
-                        chat_list
-                    )
-                    time.sleep(2)  # Increased delay
-                    previous_height = current_height
-                    
-        except Exception as e:
-            self.logger.error(f"Error while scrolling: {str(e)}")
 
     def quit(self):
         self.logger.info("Closing browser...")
         self.driver.quit()
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export the members of a Zalo group")
+    arg_parser.add_argument("group", nargs="?", default="ECOXUAN A-B-C")
+    arg_parser.add_argument("--output", default="scraped_data/zalo_members.csv")
+    arg_parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                            help="Chrome profile reused between runs to keep the Zalo login")
+    arg_parser.add_argument("--mock", action="store_true",
+                            help="run against the local mock page (click its QR code to log in)")
+    args = arg_parser.parse_args()
+
+    scraper = None
     try:
-        #group_name = input("Enter Zalo group name to scan: ").strip()#ECOXUAN A-B-C
-        group_name = "ECOXUAN A-B-C"
-        scraper = ZaloGroupScraper()
-        scraper.scrape_group_members(group_name)
+        scraper = ZaloGroupScraper(profile_dir=args.profile_dir,
+                                   url=Path(MOCK_PAGE).as_uri() if args.mock else ZALO_URL)
+        scraper.scrape_group_members(args.group, args.output)
     except Exception as e:
         logging.error(f"Script failed: {str(e)}")
-
-        scraper.quit()
\ No newline at end of file
+    finally:
+        if scraper is not None:
+            scraper.quit()